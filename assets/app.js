@@ -5,6 +5,14 @@
 const recentDetectionsElement = document.getElementById('recentDetections');
 const feedbackContentElement = document.getElementById('feedback-content');
 const MAX_RECENT_SCANS = 5;
+const FEEDBACK_OBJECTS = {
+    "cat": { text: "Meow!", gif: "cat.webp" },
+    "cell phone": { text: "Stay connected", gif: "phone.webp" },
+    "clock": { text: "Time to go", gif: "clock.webp" },
+    "cup": { text: "Need a break?", gif: "cup.webp" },
+    "dog": { text: "Walkies?", gif: "dog.webp" },
+    "potted plant": { text: "Glow your ideas!", gif: "plant.webp" }
+};
 let scans = [];
 const socket = io(`http://${window.location.host}`); // Initialize socket.io connection
 let errorContainer = document.getElementById('error-container');
@@ -58,26 +66,22 @@ function initSocketIO() {
         }
     });
 
-    socket.on('detection', async (message) => {
-        printDetection(message);
+    // One message per frame: { timestamp, detections: [{ content, confidence }, ...] }, highest confidence first
+    socket.on('detections', async (batch) => {
+        const detections = batch.detections || [];
+        if (detections.length === 0) { return; }
+        for (let i = detections.length - 1; i >= 0; i--) {
+            printDetection({ ...detections[i], timestamp: batch.timestamp });
+        }
         renderDetections();
-        updateFeedback(message);
+        updateFeedback(detections.find((d) => FEEDBACK_OBJECTS[d.content]) || detections[0]);
     });
 
 }
 
 function updateFeedback(detection) {
-    const objectInfo = {
-        "cat": { text: "Meow!", gif: "cat.webp" },
-        "cell phone": { text: "Stay connected", gif: "phone.webp" },
-        "clock": { text: "Time to go", gif: "clock.webp" },
-        "cup": { text: "Need a break?", gif: "cup.webp" },
-        "dog": { text: "Walkies?", gif: "dog.webp" },
-        "potted plant": { text: "Glow your ideas!", gif: "plant.webp" }
-    };
-
-    if (detection && objectInfo[detection.content]) {
-        const info = objectInfo[detection.content];
+    if (detection && FEEDBACK_OBJECTS[detection.content]) {
+        const info = FEEDBACK_OBJECTS[detection.content];
         const confidence = Math.floor(detection.confidence * 100);
         feedbackContentElement.innerHTML = `
             <div class="feedback-detection">
@@ -0,0 +1,375 @@
+"""Offline load benchmark for media_service.py.
+
+Starts MediaServiceHandler in-process against local stand-ins, with no robot,
+network or Google credentials needed:
+
+- a socket.io image server that emits recorded frames
+- FakeGenaiClient with configurable latency and reply size
+- FakeTTSService
+- the null audio sink
+
+It then drives /llm_vision, /speak and /play from a pool of keep-alive
+clients. Latency percentiles, requests/s and peak RSS are reported per
+endpoint and saved as JSON, which a later run can be compared against:
+
+    python3 benchmark.py --concurrency 8 --duration 20 --output before.json
+    python3 benchmark.py --concurrency 8 --duration 20 --compare before.json
+"""
+
+import argparse
+import base64
+import glob
+import json
+import logging
+import math
+import os
+import random
+import resource
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import socketio
+
+from fakes import DEFAULT_REPLY, FakeGenaiClient, FakeTTSService, silent_wav
+
+ENDPOINTS = ('llm_vision', 'speak', 'play')
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=4, help='client threads (default 4)')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of load (default 10)')
+    parser.add_argument('--requests', type=int, default=0, help='stop after this many requests instead')
+    parser.add_argument('--mix', default='llm_vision=1,speak=1,play=1',
+                        help='endpoint weights, e.g. llm_vision=3,speak=1 (default equal)')
+    parser.add_argument('--warmup', type=int, default=2, help='unmeasured requests per endpoint first (default 2)')
+    parser.add_argument('--stream', action='store_true', help='request streamed /llm_vision replies')
+    parser.add_argument('--wait', action='store_true', help='send wait=1 to /speak and /play')
+    parser.add_argument('--busy-backoff', type=float, default=0.05,
+                        help='seconds a client pauses after a 503 Busy (default 0.05)')
+    parser.add_argument('--frames', default=os.path.join(REPO_DIR, 'image-*.png'),
+                        help='glob of recorded frames to emit (default the repo screenshots)')
+    parser.add_argument('--fps', type=float, default=10.0, help='frames per second from the image server')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='fake Gemini delay in seconds')
+    parser.add_argument('--llm-chunk-delay', type=float, default=0.0, help='delay between streamed chunks')
+    parser.add_argument('--llm-reply-chars', type=int, default=400, help='approximate size of the fake reply')
+    parser.add_argument('--tts-latency', type=float, default=0.2, help='fake TTS delay per sentence in seconds')
+    parser.add_argument('--speak-phrases', type=int, default=0,
+                        help='cycle through this many phrases so the TTS cache can hit (default 0: all unique)')
+    parser.add_argument('--audio-sink', default='null', help='AUDIO_SINK for the player (default null)')
+    parser.add_argument('--decision-cache', action='store_true', help='leave the decision cache on')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help="keep media_service's INFO logging")
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--compare', help='earlier JSON report to print the change against')
+    return parser.parse_args(argv)
+
+
+def parse_mix(spec):
+    weights = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip().lstrip('/')
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint in --mix: {name} (choose from {', '.join(ENDPOINTS)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+# --- stand-in camera -------------------------------------------------------------
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeImageServer:
+    """socket.io server that emits the recorded frames as 'image' events in a loop."""
+
+    def __init__(self, frames, fps=10.0):
+        self.frames = [base64.b64encode(frame).decode('ascii') for frame in frames]
+        self.fps = fps
+        # wsgiref cannot hand the raw socket to a websocket, so stay on long-polling; the
+        # client's one upgrade attempt is refused and logged as an error, which is expected here
+        self.sio = socketio.Server(async_mode='threading', transports=['polling'], logger=False, engineio_logger=False)
+        logging.getLogger('engineio.server').setLevel(logging.CRITICAL)
+        self.httpd = make_server('127.0.0.1', 0, socketio.WSGIApp(self.sio),
+                                 server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        self.emitted = 0
+        self._stop = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="FakeImageServer", daemon=True).start()
+        threading.Thread(target=self._emit_loop, name="FakeImageEmitter", daemon=True).start()
+
+    def _emit_loop(self):
+        while not self._stop.wait(1.0 / self.fps):
+            self.sio.emit('image', {'image': self.frames[self.emitted % len(self.frames)]})
+            self.emitted += 1
+
+    def stop(self):
+        self._stop.set()
+        self.httpd.shutdown()
+
+
+# --- load ------------------------------------------------------------------------
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile
+    rank = max(1, math.ceil(q / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class LoadRunner:
+    def __init__(self, client, args, weights, play_file):
+        self.client = client
+        self.args = args
+        self.names = list(weights)
+        self.weights = [weights[name] for name in self.names]
+        self.play_file = play_file
+        self.results = {name: {'latency_ms': [], 'ok': 0, 'busy': 0, 'errors': 0} for name in self.names}
+        self.error_samples = []
+        self._lock = threading.Lock()
+        self._issued = 0
+        self._phrase = 0
+
+    def _next_phrase(self):
+        with self._lock:
+            self._phrase += 1
+            n = self._phrase
+        if self.args.speak_phrases:
+            n %= self.args.speak_phrases
+        return f"Benchmark phrase number {n}. The robot is looking around the room."
+
+    def call(self, name, rng):
+        if name == 'llm_vision':
+            payload = {'distance': rng.randint(20, 300), 'plan': 'Explore the room', 'subplan': 'Scan left',
+                       'main_goal': 'Find the human', 'lang': 'en', 'stream': self.args.stream}
+            response = self.client.llm_vision(json.dumps(payload).encode('utf-8'), 'application/json',
+                                              stream=self.args.stream)
+            if self.args.stream:
+                try:
+                    lines = response.read().splitlines()
+                finally:
+                    response.close()
+                if not lines or b'"final"' not in lines[-1]:
+                    raise Exception(f"stream ended without a final reply: {lines[-1:]!r}")
+        elif name == 'speak':
+            self.client.speak(self._next_phrase(), wait=self.args.wait)
+        else:
+            self.client.play(self.play_file, wait=self.args.wait)
+
+    def _take_ticket(self):
+        with self._lock:
+            if self.args.requests and self._issued >= self.args.requests:
+                return False
+            self._issued += 1
+            return True
+
+    def worker(self, index, deadline):
+        rng = random.Random(self.args.seed * 1000 + index)
+        while time.time() < deadline and self._take_ticket():
+            name = rng.choices(self.names, self.weights)[0]
+            started = time.perf_counter()
+            outcome = 'ok'
+            try:
+                self.call(name, rng)
+            except Exception as e:
+                outcome = 'busy' if getattr(e, 'status', None) == 503 else 'errors'
+                if outcome == 'errors' and len(self.error_samples) < 10:
+                    self.error_samples.append(f"{name}: {e}")
+            ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                result = self.results[name]
+                result[outcome] += 1
+                if outcome == 'ok':
+                    result['latency_ms'].append(ms)
+            if outcome == 'busy' and self.args.busy_backoff:
+                time.sleep(self.args.busy_backoff)
+
+    def warm_up(self):
+        rng = random.Random(self.args.seed)
+        for name in self.names:
+            for _ in range(self.args.warmup):
+                try:
+                    self.call(name, rng)
+                except Exception as e:
+                    print(f"Warm-up {name} failed: {e}", file=sys.stderr)
+
+    def run(self):
+        started = time.time()
+        deadline = started + (self.args.duration if not self.args.requests else 10 ** 9)
+        threads = [threading.Thread(target=self.worker, args=(i, deadline), name=f"bench-{i}", daemon=True)
+                   for i in range(self.args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.time() - started
+
+    def report(self, elapsed):
+        endpoints = {}
+        for name, result in self.results.items():
+            latencies = sorted(result['latency_ms'])
+            endpoints[name] = {
+                'ok': result['ok'],
+                'busy': result['busy'],
+                'errors': result['errors'],
+                'rps': round(result['ok'] / elapsed, 2) if elapsed else None,
+                'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else None,
+                'p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+                'p95_ms': round(percentile(latencies, 95), 2) if latencies else None,
+                'p99_ms': round(percentile(latencies, 99), 2) if latencies else None,
+                'max_ms': round(latencies[-1], 2) if latencies else None,
+            }
+        total_ok = sum(r['ok'] for r in endpoints.values())
+        return {
+            'elapsed_sec': round(elapsed, 3),
+            'requests_ok': total_ok,
+            'rps': round(total_ok / elapsed, 2) if elapsed else None,
+            'endpoints': endpoints,
+            'error_samples': self.error_samples,
+        }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def compare(report, baseline_path):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nChange against {baseline_path}:")
+
+    def delta(new, old):
+        if new is None or old in (None, 0):
+            return 'n/a'
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    print(f"  total rps {baseline.get('rps')} -> {report['rps']} ({delta(report['rps'], baseline.get('rps'))}), "
+          f"peak RSS {baseline.get('peak_rss_mb')} -> {report['peak_rss_mb']} MB")
+    for name, now in report['endpoints'].items():
+        old = baseline.get('endpoints', {}).get(name)
+        if not old:
+            continue
+        print(f"  {name:<10} " + ", ".join(
+            f"{key} {old.get(key)} -> {now[key]} ({delta(now[key], old.get(key))})"
+            for key in ('p50_ms', 'p95_ms', 'p99_ms', 'rps')))
+
+
+def main(argv):
+    args = parse_args(argv)
+    weights = parse_mix(args.mix)
+    frame_files = sorted(glob.glob(args.frames))
+    if not frame_files:
+        raise SystemExit(f"No frames match {args.frames}")
+    workdir = tempfile.mkdtemp(prefix='agi-bench-')
+
+    image_server = FakeImageServer([open(path, 'rb').read() for path in frame_files], fps=args.fps)
+    image_server.start()
+
+    # media_service reads its configuration at import time
+    os.environ['IMAGE_SERVER_URL'] = image_server.url
+    os.environ['AUDIO_SINK'] = args.audio_sink
+    os.environ['TTS_CACHE_DIR'] = os.path.join(workdir, 'tts')
+    os.environ.setdefault('TTS_WARMUP', '0')
+    if not args.decision_cache:
+        os.environ['DECISION_CACHE'] = '0'
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+    import media_client
+    import media_service
+
+    reply = dict(DEFAULT_REPLY)
+    reply['plan'] = (reply['plan'] + ' ') * max(1, args.llm_reply_chars // (len(reply['plan']) + 1))
+    llm = FakeGenaiClient(reply=reply, latency=args.llm_latency, chunk_delay=args.llm_chunk_delay, keep_calls=False)
+    tts = FakeTTSService(latency=args.tts_latency)
+    media_service.LLM_CLIENT = llm
+    media_service.TTS_SERVICE_FACTORY = lambda: tts
+
+    play_file = os.path.join(workdir, 'beep.wav')
+    with open(play_file, 'wb') as f:
+        f.write(silent_wav(0.3))
+
+    media_service.start_frame_subscriber()
+    media_service.PLAYER.start()
+    media_service.compile_system_instructions()
+
+    class QuietMediaServiceHandler(media_service.MediaServiceHandler):
+        def log_message(self, format, *args):
+            pass
+
+    server = media_service.ThreadedMediaServer(('127.0.0.1', 0), QuietMediaServiceHandler)
+    threading.Thread(target=server.serve_forever, name="MediaService", daemon=True).start()
+    # No retries: a 503 is reported as busy instead of being hidden by backoff
+    # With wait=1 a clip can sit behind every queued utterance on the single speaker
+    timeouts = {'/play': 120, '/speak': 120} if args.wait else None
+    client = media_client.MediaServiceClient('127.0.0.1', server.server_address[1], timeouts=timeouts,
+                                             retries=0, stats_every=0)
+
+    if media_service.get_latest_image(timeout=10) is None:
+        raise SystemExit("The frame subscriber did not receive a frame from the fake image server")
+
+    runner = LoadRunner(client, args, weights, play_file)
+    runner.warm_up()
+    rss_before = peak_rss_mb()
+    elapsed = runner.run()
+    report = runner.report(elapsed)
+    report.update({
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': sys.version.split()[0],
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'frames': len(frame_files),
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_before_load_mb': rss_before,
+        'server': {
+            'lanes': {name: lane.stats() for name, lane in media_service.LANES.items()},
+            'llm': media_service.llm_tier_stats(),
+            'tts_cache': media_service.TTS_CACHE.stats(),
+            'playback': media_service.PLAYER.status()['counters'],
+            'frames': media_service.FRAME_SUBSCRIBER.stats(),
+            'spans': media_service.TRACER.summary(),
+            'fake_calls': {'gemini': llm.call_count, 'tts': tts.call_count, 'frames_emitted': image_server.emitted},
+        },
+    })
+
+    print(f"{'endpoint':<10} {'ok':>6} {'busy':>5} {'err':>4} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, r in report['endpoints'].items():
+        print(f"{name:<10} {r['ok']:>6} {r['busy']:>5} {r['errors']:>4} {r['rps'] or 0:>8} "
+              f"{r['p50_ms'] or 0:>9} {r['p95_ms'] or 0:>9} {r['p99_ms'] or 0:>9}")
+    print(f"total {report['requests_ok']} ok in {report['elapsed_sec']}s = {report['rps']} req/s, "
+          f"peak RSS {report['peak_rss_mb']} MB")
+    for sample in report['error_samples']:
+        print(f"error: {sample}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved {args.output}")
+    if args.compare:
+        compare(report, args.compare)
+
+    server.shutdown()
+    # The subscriber's pending long-poll has to be answered before it can disconnect
+    media_service.FRAME_SUBSCRIBER.stop()
+    image_server.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
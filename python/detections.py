@@ -0,0 +1,132 @@
+"""Time-indexed store of recent object detections.
+
+VideoObjectDetection reports every frame to main.py; DetectionHistory keeps the
+last `capacity` detections in preallocated arrays so agi_loop can tell the LLM
+what was seen recently ("person x12, max 0.91, 0.4s ago") instead of making it
+find every object in the image again.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+
+class DetectionHistory:
+    """Ring buffer of (timestamp, label, confidence, box) rows, queryable by time window and label.
+
+    Labels are interned to small integer ids; boxes are optional (NaN when absent).
+    """
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.label_ids = np.full(capacity, -1, dtype=np.int32)
+        self.confidences = np.zeros(capacity, dtype=np.float32)
+        self.boxes = np.full((capacity, 4), np.nan, dtype=np.float32)
+        self.labels = []
+        self._label_index = {}
+        self._next = 0
+        self.size = 0
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def _label_id(self, label):
+        label_id = self._label_index.get(label)
+        if label_id is None:
+            label_id = len(self.labels)
+            self.labels.append(label)
+            self._label_index[label] = label_id
+        return label_id
+
+    def add(self, label, confidence, timestamp=None, box=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            i = self._next
+            self.times[i] = timestamp
+            self.label_ids[i] = self._label_id(label)
+            self.confidences[i] = confidence if confidence is not None else np.nan
+            self.boxes[i] = box if box is not None else np.nan
+            self._next = (i + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+            self.total += 1
+
+    def add_frame(self, detections, timestamp=None):
+        """Record one frame from VideoObjectDetection: {label: {"confidence": .., "bounding_box_xyxy": ..}}."""
+        timestamp = time.time() if timestamp is None else timestamp
+        for label, value in detections.items():
+            value = value or {}
+            box = None
+            for key in ("bounding_box_xyxy", "bounding_box", "box"):
+                if value.get(key) is not None:
+                    box = value[key]
+                    break
+            try:
+                box = [float(v) for v in box][:4] if box is not None and len(box) >= 4 else None
+            except (TypeError, ValueError):
+                box = None
+            self.add(label, value.get("confidence"), timestamp, box)
+
+    def _mask(self, since_sec, label, now):
+        mask = np.zeros(self.capacity, dtype=bool)
+        mask[:self.size] = True
+        if since_sec is not None:
+            mask &= self.times >= now - since_sec
+        if label is not None:
+            label_id = self._label_index.get(label)
+            if label_id is None:
+                return np.zeros(self.capacity, dtype=bool)
+            mask &= self.label_ids == label_id
+        return mask
+
+    def query(self, since_sec=None, label=None, now=None):
+        """Detections of the last `since_sec` seconds (optionally one label), oldest first."""
+        now = time.time() if now is None else now
+        with self._lock:
+            idx = np.nonzero(self._mask(since_sec, label, now))[0]
+            idx = idx[np.argsort(self.times[idx], kind="stable")]
+            rows = []
+            for i in idx:
+                box = self.boxes[i]
+                rows.append({
+                    "label": self.labels[self.label_ids[i]],
+                    "confidence": float(self.confidences[i]),
+                    "timestamp": float(self.times[i]),
+                    "box": None if np.isnan(box).any() else box.tolist(),
+                })
+            return rows
+
+    def summary(self, since_sec, now=None, min_confidence=0.0):
+        """Per-label count, max confidence and seconds since last seen over the window, most recent first."""
+        now = time.time() if now is None else now
+        with self._lock:
+            mask = self._mask(since_sec, None, now) & (self.confidences >= min_confidence)
+            ids = self.label_ids[mask]
+            if not len(ids):
+                return []
+            n = len(self.labels)
+            counts = np.bincount(ids, minlength=n)
+            max_conf = np.full(n, -np.inf, dtype=np.float32)
+            np.maximum.at(max_conf, ids, self.confidences[mask])
+            last_seen = np.full(n, -np.inf)
+            np.maximum.at(last_seen, ids, self.times[mask])
+            present = np.nonzero(counts)[0]
+            present = present[np.argsort(-last_seen[present], kind="stable")]
+            return [{
+                "label": self.labels[i],
+                "count": int(counts[i]),
+                "max_confidence": round(float(max_conf[i]), 2),
+                "age_sec": round(max(0.0, now - float(last_seen[i])), 1),
+            } for i in present]
+
+    def summary_text(self, since_sec, now=None, min_confidence=0.0, max_labels=8):
+        items = self.summary(since_sec, now=now, min_confidence=min_confidence)[:max_labels]
+        return "; ".join(f"{s['label']} (x{s['count']}, max {s['max_confidence']:.2f}, {s['age_sec']}s ago)"
+                         for s in items)
+
+    def confirmed(self, label, since_sec, min_count=3, min_confidence=0.6, now=None):
+        """True if `label` was detected at least `min_count` times with enough confidence in the window."""
+        now = time.time() if now is None else now
+        with self._lock:
+            mask = self._mask(since_sec, label, now) & (self.confidences >= min_confidence)
+            return int(np.count_nonzero(mask)) >= min_count
@@ -0,0 +1,204 @@
+"""Offline stand-ins for the external services used by media_service.py and main.py.
+
+Point media_service at them to run it without network access or Google
+credentials, e.g. ``GEMINI_FAKE=1 python3 media_service.py``, or assign
+``media_service.LLM_CLIENT = FakeGenaiClient()`` from a script.
+FakeTTSService can be returned by ``media_service.TTS_SERVICE_FACTORY``, and
+FakeCloud takes the place of ``ArduinoCloud`` for telemetry.TelemetryPublisher.
+"""
+
+import base64
+import io
+import itertools
+import json
+import threading
+import time
+import wave
+
+
+DEFAULT_REPLY = {
+    "move": {"command": "left", "distance_cm": 0, "angle_deg": 30},
+    "rgb": "255,255,0",
+    "speak": None,
+    "sound": None,
+    "subplan": "Scanning the room by turning left",
+    "plan": "Look around to find the master human",
+    "memory_ops": [],
+}
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModels:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, model, contents, config=None):
+        self._client._record('generate_content', model=model, contents=contents, config=config)
+        self._client._delay(model, config)
+        return FakeResponse(self._client.reply_text())
+
+    def generate_content_stream(self, model, contents, config=None):
+        self._client._record('generate_content_stream', model=model, contents=contents, config=config)
+        self._client._delay(model, config)
+        text = self._client.reply_text()
+        size = self._client.stream_chunk_chars
+        for i in range(0, len(text), size):
+            if i and self._client.chunk_delay:
+                time.sleep(self._client.chunk_delay)
+            yield FakeResponse(text[i:i + size])
+
+
+class FakeCachedContent:
+    def __init__(self, name, model, config):
+        self.name = name
+        self.model = model
+        self.config = config
+
+
+class FakeCaches:
+    def __init__(self, client):
+        self._client = client
+        self._ids = itertools.count(1)
+        self.created = []
+
+    def create(self, model, config=None):
+        self._client._record('caches.create', model=model, config=config)
+        error = self._client.cache_error() if callable(self._client.cache_error) else self._client.cache_error
+        if error is not None:
+            raise error
+        instruction = getattr(config, 'system_instruction', '') or ''
+        if len(str(instruction)) < self._client.min_cache_chars:
+            raise Exception(f"Cached content is too small: {len(str(instruction))} chars, minimum is {self._client.min_cache_chars}")
+        cache = FakeCachedContent(f"cachedContents/fake-{next(self._ids)}", model, config)
+        self.created.append(cache)
+        return cache
+
+
+class FakeGenaiClient:
+    """Records every call and answers with a canned JSON reply.
+
+    ``reply`` is a dict (or JSON string) returned by every call. ``min_cache_chars``
+    makes caches.create() refuse system instructions shorter than that, the way the
+    real API refuses contexts below the model's minimum token count; ``cache_error``
+    is an exception, or a callable returning one or None, raised by caches.create()
+    instead (e.g. a transient 503).
+
+    ``latency`` is the delay in seconds before a reply (or its first streamed chunk)
+    or a callable ``latency(model, config)`` returning it, e.g. to make calls with a
+    large thinking budget slow; ``error`` is an exception, or a callable
+    ``error(model, config)`` returning one or None, raised after the delay.
+    ``chunk_delay`` is slept between streamed chunks. With ``keep_calls=False`` only
+    ``call_count`` is kept, so long benchmark runs do not hold every request in memory.
+    """
+
+    def __init__(self, reply=None, min_cache_chars=0, stream_chunk_chars=24, latency=0.0, error=None, chunk_delay=0.0,
+                 keep_calls=True, cache_error=None):
+        self.reply = reply if reply is not None else DEFAULT_REPLY
+        self.min_cache_chars = min_cache_chars
+        self.cache_error = cache_error
+        self.stream_chunk_chars = stream_chunk_chars
+        self.latency = latency
+        self.error = error
+        self.chunk_delay = chunk_delay
+        self.keep_calls = keep_calls
+        self.calls = []
+        self.call_count = 0
+        self._lock = threading.Lock()
+        self.models = FakeModels(self)
+        self.caches = FakeCaches(self)
+
+    def reply_text(self):
+        return self.reply if isinstance(self.reply, str) else json.dumps(self.reply)
+
+    def _delay(self, model, config):
+        delay = self.latency(model, config) if callable(self.latency) else self.latency
+        if delay:
+            time.sleep(delay)
+        error = self.error(model, config) if callable(self.error) else self.error
+        if error is not None:
+            raise error
+
+    def _record(self, method, **kwargs):
+        with self._lock:
+            self.call_count += 1
+            if self.keep_calls:
+                self.calls.append(dict(kwargs, method=method, time=time.time()))
+
+    def calls_to(self, method):
+        with self._lock:
+            return [call for call in self.calls if call['method'] == method]
+
+
+def silent_wav(seconds, rate=24000):
+    """WAV bytes of `seconds` of 16-bit mono silence."""
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b'\x00\x00' * int(seconds * rate))
+    return buf.getvalue()
+
+
+class FakeTTSRequest:
+    def __init__(self, service, body):
+        self.service = service
+        self.body = body
+
+    def execute(self):
+        service = self.service
+        if service.latency:
+            time.sleep(service.latency)
+        text = self.body.get('input', {}).get('text', '')
+        with service._lock:
+            service.call_count += 1
+            service.chars += len(text)
+        audio = silent_wav(max(service.min_audio_sec, len(text) * service.audio_sec_per_char))
+        return {'audioContent': base64.b64encode(audio).decode('ascii')}
+
+
+class FakeTTSService:
+    """Stand-in for the googleapiclient texttospeech service: ``text().synthesize(body=..).execute()``
+    sleeps ``latency`` seconds and returns silence as long as the text would take to say."""
+
+    def __init__(self, latency=0.0, audio_sec_per_char=0.06, min_audio_sec=0.2):
+        self.latency = latency
+        self.audio_sec_per_char = audio_sec_per_char
+        self.min_audio_sec = min_audio_sec
+        self.call_count = 0
+        self.chars = 0
+        self._lock = threading.Lock()
+
+    def text(self):
+        return self
+
+    def synthesize(self, body):
+        return FakeTTSRequest(self, body)
+
+
+class FakeCloud:
+    """Records every variable assignment, like ArduinoCloud properties would be pushed."""
+
+    def __init__(self):
+        object.__setattr__(self, "writes", [])
+        object.__setattr__(self, "values", {})
+
+    def register(self, name, on_write=None):
+        pass
+
+    def __setattr__(self, name, value):
+        self.writes.append((time.time(), name, value))
+        self.values[name] = value
+
+    def __getattr__(self, name):
+        try:
+            return self.values[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def writes_to(self, name):
+        return [value for _, n, value in self.writes if n == name]
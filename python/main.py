@@ -6,16 +6,23 @@ from datetime import datetime, UTC
 from arduino.app_bricks.arduino_cloud import ArduinoCloud
 from arduino.app_peripherals.microphone import Microphone
 
-import urllib.request
-import urllib.parse
 import os
 import logging
-import io
-import base64
 import json
 import time
 import colorsys
-import wave
+import struct
+import numpy as np
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from vad import VoiceActivityDetector
+import media_client
+from telemetry import TelemetryPublisher
+from detections import DetectionHistory
+from memory_store import FactMemory
+from occupancy import OccupancyGrid
+import robot_schema
+from tracing import Tracer
      
 ui = WebUI()
 detection_stream = VideoObjectDetection(confidence=0.5, debounce_sec=0.0)
@@ -26,55 +33,118 @@ logger = logging.getLogger("robot.main")
 
 MAIN_GOAL = "Be helpful assistant to the master human"
 
+# Every detection is kept here so agi_loop can summarize what was seen recently
+detection_history = DetectionHistory(capacity=int(os.environ.get("DETECTION_HISTORY_SIZE", "1024")))
+
+# At most this many "detections" batches per second reach the Web UI
+DETECTION_MAX_RATE = float(os.environ.get("DETECTION_MAX_RATE", "4"))
+# An unchanged label set is re-sent only after this many seconds (0 = never)
+DETECTION_REFRESH_SEC = float(os.environ.get("DETECTION_REFRESH_SEC", "5"))
+detection_emit_lock = threading.Lock()
+detection_emit = {"labels": None, "time": 0.0, "sent": 0, "unchanged": 0, "rate_limited": 0}
+
+
 def send_detections_to_ui(detections: dict):
-  for key, value in detections.items():
-    entry = {
-      "content": key,
-      "confidence": value.get("confidence"),
-      "timestamp": datetime.now(UTC).isoformat()
-    }
-    ui.send_message("detection", message=entry)
+  """Send one batched "detections" message per frame, skipping unchanged label sets."""
+  now = time.time()
+  detection_history.add_frame(detections, now)
+  labels = frozenset(detections)
+  with detection_emit_lock:
+    elapsed = now - detection_emit["time"]
+    if labels == detection_emit["labels"] and (not DETECTION_REFRESH_SEC or elapsed < DETECTION_REFRESH_SEC):
+      detection_emit["unchanged"] += 1
+      return
+    if DETECTION_MAX_RATE > 0 and elapsed < 1.0 / DETECTION_MAX_RATE:
+      detection_emit["rate_limited"] += 1
+      return
+    detection_emit["labels"] = labels
+    detection_emit["time"] = now
+    detection_emit["sent"] += 1
+    if detection_emit["sent"] % 100 == 0:
+      logger.info(f"Detection batches: {detection_emit['sent']} sent, {detection_emit['unchanged']} unchanged "
+                  f"and {detection_emit['rate_limited']} rate-limited frames skipped")
+
+  entries = [{"content": key, "confidence": value.get("confidence")} for key, value in detections.items()]
+  entries.sort(key=lambda entry: entry["confidence"] or 0, reverse=True)
+  ui.send_message("detections", message={"timestamp": datetime.now(UTC).isoformat(), "detections": entries})
  
 detection_stream.on_detect_all(send_detections_to_ui)
 
 arduino_cloud = ArduinoCloud()
-speed = 0
-back = False
-left = False
-right = False
-forward = False
-agi = False
+
+
+class RobotState:
+    """Control fields read by the MCU, guarded by a lock and versioned.
+
+    Every change bumps `version`, so the sketch can fetch all fields with one
+    get_state(since_version) call and get nothing back when it already has them.
+    The version starts from the wall clock so a restarted app never reuses a
+    version the MCU has already seen.
+    """
+
+    FIELDS = ("speed", "back", "left", "right", "forward", "agi", "rgb")
+
+    def __init__(self, **fields):
+        self._lock = threading.Lock()
+        self._fields = dict(fields)
+        self.version = int(time.time())
+
+    def get(self, name):
+        with self._lock:
+            return self._fields[name]
+
+    def update(self, **fields) -> int:
+        """Set fields; bumps the version only if a value actually changed."""
+        with self._lock:
+            changed = False
+            for name, value in fields.items():
+                if self._fields.get(name) != value:
+                    self._fields[name] = value
+                    changed = True
+            if changed:
+                self.version += 1
+            return self.version
+
+    def encode(self, since_version=None) -> str:
+        """"version|speed|back|left|right|forward|agi|r,g,b", or "" if since_version is current."""
+        with self._lock:
+            if since_version is not None and int(since_version) == self.version:
+                return ""
+            values = [str(self.version)]
+            for name in self.FIELDS:
+                value = self._fields[name]
+                if isinstance(value, bool):
+                    value = int(value)
+                values.append(str(value))
+            return "|".join(values)
+
+
+robot_state = RobotState(speed=0, back=False, left=False, right=False, forward=False, agi=False, rgb="255,0,255")
 
 def speed_callback(client: object, value: int):
-    global speed
     logger.info(f"Speed value updated from cloud: {value}")
-    speed = value
+    robot_state.update(speed=value)
 
 def back_callback(client: object, value: bool):
-    global back
     logger.info(f"Back value updated from cloud: {value}")
-    back = value
+    robot_state.update(back=value)
 
 def left_callback(client: object, value: bool):
-    global left
     logger.info(f"Left value updated from cloud: {value}")
-    left = value
+    robot_state.update(left=value)
 
 def right_callback(client: object, value: bool):
-    global right
     logger.info(f"Right value updated from cloud: {value}")
-    right = value
+    robot_state.update(right=value)
 
 def forward_callback(client: object, value: bool):
-    global forward
     logger.info(f"Forward value updated from cloud: {value}")
-    forward = value
+    robot_state.update(forward=value)
 
 
 def agi_callback(client: object, value: bool):
-    global agi
     logger.info(f"AGI value updated from cloud: {value}")
-    agi = value
+    robot_state.update(agi=value)
 
 def goal_callback(client: object, value: str):
     global MAIN_GOAL
@@ -96,11 +166,9 @@ def lang_callback(client: object, value: str):
     except Exception:
         pass
 
-rgb = "255,0,255"
 rgb_values = {"hue": 0, "sat": 0, "bri": 0, "swi": False}
 
 def update_rgb_from_values():
-    global rgb
     try:
         swi = rgb_values.get("swi", False)
         if isinstance(swi, str):
@@ -115,7 +183,8 @@ def update_rgb_from_values():
             
             r_float, g_float, b_float = colorsys.hsv_to_rgb(h, s, v)
             rgb = f"{int(r_float * 255)},{int(g_float * 255)},{int(b_float * 255)}"
-            
+
+        robot_state.update(rgb=rgb)
         logger.info(f"Updated RGB string: {rgb} from {rgb_values}")
     except Exception as e:
         logger.error(f"Error calculating RGB: {e}")
@@ -159,54 +228,65 @@ arduino_cloud.register("distance")
 arduino_cloud.register("temperature")
 arduino_cloud.register("humidity")
 
+# Deadband and rate limits between the MCU's ~10 Hz readings and the cloud link
+telemetry = TelemetryPublisher(arduino_cloud)
+
+def get_state(since_version=None):
+    """All MCU control fields in one call; "" when the MCU already has since_version."""
+    return robot_state.encode(since_version)
+
+# Single-field getters, kept for older sketches
 def get_speed():
-    return speed
+    return robot_state.get("speed")
 
 def get_back():
-    return back
+    return robot_state.get("back")
 
 def get_left():
-    return left
+    return robot_state.get("left")
 
 def get_right():
-    return right
+    return robot_state.get("right")
 
 def get_forward():
-    return forward
+    return robot_state.get("forward")
 
 def get_agi():
-    return agi
+    return robot_state.get("agi")
 
 def get_rgb():
-    return rgb
+    return robot_state.get("rgb")
 
 def set_distance(d):
-    arduino_cloud.distance = int(d)
+    telemetry.update("distance", d)
+
+# Keep-alive connections to media_service.py on the host
+media = media_client.from_env()
+
+# Per-stage timing of the AGI cycle; each finished cycle is posted to media_service's /metrics
+TRACING = os.environ.get("TRACING", "1") != "0"
+tracer = Tracer("robot", keep_cycles=int(os.environ.get("TRACE_KEEP_CYCLES", "20")), enabled=TRACING)
+trace_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace")
 
 def play_sound(filename):
     try:
-        query = urllib.parse.urlencode({'filename': filename})
-        url = f"http://172.17.0.1:5000/play?{query}"
-        with urllib.request.urlopen(url, timeout=55) as response:
-            logger.info(f"Sound service called: {response.read().decode()}")
+        logger.info(f"Sound service called: {media.play(filename)}")
     except Exception as e:
         logger.warning(f"Could not call sound service: {e}")
 
 def play_random_sound():
     try:
-        url = f"http://172.17.0.1:5000/play_random"
-        with urllib.request.urlopen(url, timeout=55) as response:
-            logger.info(f"Random sound service called: {response.read().decode()}")
+        logger.info(f"Random sound service called: {media.play_random()}")
     except Exception as e:
         logger.warning(f"Could not call random sound service: {e}")
 
 
-def speak(text):
+def speak(text, wait=False):
+    """Queue text for speech; with wait=True return only after it has been played."""
     try:
-        query = urllib.parse.urlencode({'text': text, 'lang': lang})
-        url = f"http://172.17.0.1:5000/speak?{query}"
-        with urllib.request.urlopen(url, timeout=55) as response:
-            logger.info(f"Speak service called: {response.read().decode()}")
+        with tracer.span("speak"):
+            reply = media.speak(text, lang=lang, wait=wait, cycle_id=tracer.current_cycle())
+        logger.info(f"Speak service called: {reply}")
     except Exception as e:
         logger.warning(f"Could not call speak service: {e}")
 
@@ -221,21 +301,170 @@ Bridge.provide("get_forward", get_forward)
 Bridge.provide("get_agi", get_agi)
 Bridge.provide("get_rgb", get_rgb)
 Bridge.provide("set_distance", set_distance)
+Bridge.provide("get_state", get_state)
 
 def set_temperature(t):
-  arduino_cloud.temperature = t
+  telemetry.update("temperature", t)
 
 def set_humidity(h):
-  arduino_cloud.humidity = h
+  telemetry.update("humidity", h)
+
+def set_telemetry(d, t, h):
+    """All sensor readings of one MCU loop in one call."""
+    set_distance(d)
+    set_temperature(t)
+    set_humidity(h)
 
 Bridge.provide("set_temperature", set_temperature)
 Bridge.provide("set_humidity", set_humidity)
+Bridge.provide("set_telemetry", set_telemetry)
 
 play_sound("python/sounds/startup.wav")
 speak("Robot is ready")
 
-def ask_llm_vision(distance: float, plan: str = "", subplan: str = "", movement_history: list = None, space_map: str = "", memory: str = "") -> dict:
-    """Call the /llm_vision endpoint, sending distance, plan, subplan, map, and audio if available. Returns parsed JSON dict or {}."""
+# /llm_vision request body: 4-byte big-endian JSON length, the JSON payload, then raw WAV bytes
+FRAME_CONTENT_TYPE = "application/x-agi-frame"
+MIC_RATE = 16000
+MIC_MAX_SECONDS = 10
+# Hard cap on one reply; the VAD normally ends the recording much earlier
+MIC_RECORD_SECONDS = float(os.environ.get("MIC_RECORD_SECONDS", "8"))
+
+
+class AudioBuffer:
+    """Preallocated int16 buffer that microphone chunks are copied into.
+
+    The recording is handed to the HTTP request as a WAV header plus a
+    memoryview of the buffer, so it is never written to disk or base64 encoded.
+    """
+
+    def __init__(self, max_seconds: float = MIC_MAX_SECONDS, rate: int = MIC_RATE):
+        self.rate = rate
+        self.data = np.zeros(int(max_seconds * rate), dtype=np.int16)
+        self.start = 0
+        self.length = 0
+
+    def clear(self):
+        self.start = 0
+        self.length = 0
+
+    def trim(self, start: int, end: int):
+        """Keep only samples [start, end) of the recording, without copying."""
+        self.start = max(0, min(start, self.length))
+        self.length = max(self.start, min(end, self.length))
+
+    def append(self, chunk) -> bool:
+        """Copy a chunk in; returns False once the buffer is full."""
+        samples = np.asarray(chunk).reshape(-1)
+        if samples.dtype != np.int16:
+            samples = samples.astype(np.int16)
+        n = min(len(samples), len(self.data) - self.length)
+        self.data[self.length:self.length + n] = samples[:n]
+        self.length += n
+        return n == len(samples)
+
+    def seconds(self) -> float:
+        return (self.length - self.start) / float(self.rate)
+
+    def wav_parts(self) -> list:
+        pcm = memoryview(self.data[self.start:self.length]).cast("B")
+        header = struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + len(pcm), b"WAVE", b"fmt ", 16, 1, 1,
+                             self.rate, self.rate * 2, 2, 16, b"data", len(pcm))
+        return [header, pcm]
+
+
+mic_buffer = AudioBuffer()
+pending_audio = False
+
+
+def take_pending_audio() -> list:
+    """WAV body parts of the last recording if it has not been sent yet, else []."""
+    global pending_audio
+    if not pending_audio or mic_buffer.length <= mic_buffer.start:
+        return []
+    pending_audio = False
+    return mic_buffer.wav_parts()
+
+
+AGI_STREAM = os.environ.get("AGI_STREAM", "1") != "0"
+stream_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="llm-stream")
+
+
+def read_streamed_reply(body) -> robot_schema.RobotResponse:
+    """Send a streamed /llm_vision request. Returns the early (actionable) fields right away; the full
+    reply is delivered by the Future in `pending` once the slow fields have arrived."""
+    started = time.time()
+    response = media.llm_vision(body, FRAME_CONTENT_TYPE, stream=True)
+
+    def next_message():
+        line = response.readline()
+        if not line:
+            raise Exception("llm_vision stream ended before the final reply")
+        message = json.loads(line.decode("utf-8"))
+        if message.get("stage") == "error":
+            raise Exception(message.get("error"))
+        return message
+
+    try:
+        message = next_message()
+    except Exception:
+        response.close()
+        raise
+    if message.get("stage") == "final":
+        response.close()
+        logger.info(f"llm_vision time-to-complete: {time.time() - started:.2f}s (no early reply)")
+        return robot_schema.parse_reply(message.get("fields"))
+
+    time_to_move = time.time() - started
+    logger.info(f"llm_vision time-to-move: {time_to_move:.2f}s")
+
+    def read_rest():
+        try:
+            while True:
+                message = next_message()
+                if message.get("stage") == "final":
+                    logger.info(f"llm_vision time-to-move: {time_to_move:.2f}s, time-to-complete: {time.time() - started:.2f}s")
+                    return robot_schema.parse_reply(message.get("fields"))
+        finally:
+            response.close()
+
+    early = robot_schema.parse_fields(message.get("fields"))
+    early.pending = stream_executor.submit(read_rest)
+    return early
+
+
+# Window of the "seen in last N s" detection summary sent with every request
+DETECTION_WINDOW_SEC = float(os.environ.get("DETECTION_WINDOW_SEC", "10"))
+DETECTION_MIN_CONFIDENCE = float(os.environ.get("DETECTION_MIN_CONFIDENCE", "0.5"))
+# Label (e.g. "person") that, once confirmed by the detector, lets a cycle go without the camera frame
+IMAGE_SKIP_LABEL = os.environ.get("IMAGE_SKIP_LABEL", "")
+IMAGE_SKIP_CONFIRM_SEC = float(os.environ.get("IMAGE_SKIP_CONFIRM_SEC", "2"))
+IMAGE_SKIP_MAX_CONSECUTIVE = int(os.environ.get("IMAGE_SKIP_MAX_CONSECUTIVE", "2"))
+# Ask for a downscaled frame when the detection summary already names what is in view
+IMAGE_LOW_DETAIL_WITH_DETECTIONS = os.environ.get("IMAGE_LOW_DETAIL_WITH_DETECTIONS", "1") != "0"
+image_skips = 0
+
+
+def choose_image_detail(detections_summary: str, has_audio: bool) -> str:
+    """'none' to skip the frame, 'low' for a downscaled one, 'high' for the full preprocessed frame."""
+    global image_skips
+    if (IMAGE_SKIP_LABEL and not has_audio and image_skips < IMAGE_SKIP_MAX_CONSECUTIVE
+            and detection_history.confirmed(IMAGE_SKIP_LABEL, IMAGE_SKIP_CONFIRM_SEC, min_confidence=DETECTION_MIN_CONFIDENCE)):
+        image_skips += 1
+        return "none"
+    image_skips = 0
+    if detections_summary and IMAGE_LOW_DETAIL_WITH_DETECTIONS:
+        return "low"
+    return "high"
+
+
+def ask_llm_vision(distance: float, plan: str = "", subplan: str = "", movement_history: list = None, space_map: str = "", memory: str = "", stream: bool = None, history_summary: str = "") -> robot_schema.RobotResponse:
+    """Call the /llm_vision endpoint, sending distance, plan, subplan, map, and audio if available.
+    Returns the validated reply, or None when the call failed or the reply was malformed.
+
+    When streaming, the reply holds only the early fields and its `pending` Future delivers the full reply.
+    """
+    if stream is None:
+        stream = AGI_STREAM
     try:
         if movement_history is None:
             movement_history = []
@@ -247,70 +476,381 @@ def ask_llm_vision(distance: float, plan: str = "", subplan: str = "", movement_
             "memory": memory,
             "main_goal": MAIN_GOAL,
             "movement_history": movement_history,
-            "lang": lang
+            "movement_summary": history_summary,
+            "lang": lang,
+            "stream": stream,
+            "cycle_id": tracer.current_cycle(),
         }
         
-        # Include mic.wav if it exists
-        if os.path.exists("mic.wav"):
-            try:
-                with open("mic.wav", "rb") as audio_file:
-                    audio_data = audio_file.read()
-                    audio_base64 = base64.b64encode(audio_data).decode('utf-8')
-                    payload["audio"] = audio_base64
-                    payload["audio_format"] = "wav"
-                    logger.info("Including mic.wav in llm_vision request")
-                # Delete the file after reading it
-                os.remove("mic.wav")
-                logger.info("Deleted mic.wav after inclusion in payload")
-            except Exception as audio_err:
-                logger.warning(f"Could not read/delete mic.wav: {audio_err}")
-        
-        data = json.dumps(payload).encode("utf-8")
-        req = urllib.request.Request(f"http://172.17.0.1:5000/llm_vision", data=data, headers={"Content-Type":"application/json"})
-        with urllib.request.urlopen(req, timeout=55) as response:
-            resp = response.read().decode("utf-8")
-            try:
-                return json.loads(resp)
-            except Exception:
-                logger.warning("llm_vision returned non-json, raw: %s", resp)
-                return {}
+        # Attach the recorded user reply, if any, as a binary body part
+        audio_parts = take_pending_audio()
+        if audio_parts:
+            payload["audio_format"] = "wav"
+            logger.info(f"Including {mic_buffer.seconds():.1f}s of recorded audio in llm_vision request")
+
+        detections_summary = detection_history.summary_text(DETECTION_WINDOW_SEC, min_confidence=DETECTION_MIN_CONFIDENCE)
+        payload["detections_summary"] = detections_summary
+        payload["detections_window_sec"] = DETECTION_WINDOW_SEC
+        payload["image_detail"] = choose_image_detail(detections_summary, bool(audio_parts))
+        if payload["image_detail"] != "high":
+            logger.info(f"Image detail {payload['image_detail']}, detections: {detections_summary}")
+
+        json_part = json.dumps(payload).encode("utf-8")
+        body = [len(json_part).to_bytes(4, "big"), json_part] + audio_parts
+        # Streamed: until the early fields arrive
+        with tracer.span("llm_request"):
+            if stream:
+                return read_streamed_reply(body)
+            return robot_schema.parse_reply(media.llm_vision(body, FRAME_CONTENT_TYPE))
+    except robot_schema.MalformedReply as e:
+        logger.warning(f"llm_vision returned a malformed reply: {e}")
+        return None
     except Exception as e:
         logger.warning(f"Could not call LLM vision service: {e}")
-        return {}
+        return None
 
 # Internal subplan/context for AGI loop
 plan = ""
 subplan = ""
-space_map = ""
-movement_history = []
-memory = ""
+
+
+class MovementHistory:
+    """Run-length compacted movement history.
+
+    Repeated identical moves are merged into one run ("forward 20cm x3"). Only
+    the last `window` runs are kept verbatim; older runs are folded into a
+    rolling summary of totals, so the prompt stays the same size however long
+    the robot has been running.
+    """
+
+    UNITS = {"forward": "cm", "back": "cm", "left": "deg", "right": "deg"}
+
+    def __init__(self, window: int = 12):
+        self.window = window
+        self.runs = []  # [command, amount, count]
+        self.folded_moves = 0
+        self.totals = {"forward": 0, "back": 0, "left": 0, "right": 0, "stop": 0}
+        self._lock = threading.Lock()
+
+    def append(self, mv: dict):
+        cmd = mv.get("command")
+        if cmd in ("forward", "back"):
+            amount = int(mv.get("distance_cm") or 0)
+        elif cmd in ("left", "right"):
+            amount = int(mv.get("angle_deg") or 0)
+        else:
+            amount = 0
+        with self._lock:
+            if self.runs and self.runs[-1][0] == cmd and self.runs[-1][1] == amount:
+                self.runs[-1][2] += 1
+                return
+            self.runs.append([cmd, amount, 1])
+            while len(self.runs) > self.window:
+                old_cmd, old_amount, count = self.runs.pop(0)
+                self.folded_moves += count
+                self.totals[old_cmd] = self.totals.get(old_cmd, 0) + (old_amount * count if old_cmd != "stop" else count)
+
+    def last_command(self):
+        with self._lock:
+            return self.runs[-1][0] if self.runs else None
+
+    def last_turn(self):
+        """Direction of the most recent left/right turn, or None."""
+        with self._lock:
+            for cmd, _, _ in reversed(self.runs):
+                if cmd in ("left", "right"):
+                    return cmd
+            return None
+
+    def to_list(self) -> list:
+        with self._lock:
+            items = []
+            for cmd, amount, count in self.runs:
+                text = cmd if cmd == "stop" else f"{cmd} {amount}{self.UNITS.get(cmd, '')}"
+                items.append(f"{text} x{count}" if count > 1 else text)
+            return items
+
+    def summary(self) -> str:
+        with self._lock:
+            if not self.folded_moves:
+                return ""
+            parts = [f"{cmd} {total}{self.UNITS[cmd]}" for cmd, total in self.totals.items() if total and cmd in self.UNITS]
+            if self.totals.get("stop"):
+                parts.append(f"stop x{self.totals['stop']}")
+            return f"{self.folded_moves} earlier moves ({', '.join(parts)})"
+
+
+movement_history = MovementHistory(window=int(os.environ.get("MOVEMENT_HISTORY_WINDOW", "12")))
 
 MEMORY_FILE = "memory.txt"
+MEMORY_JOURNAL = os.environ.get("MEMORY_JOURNAL", "memory.jsonl")
+# Size cap of the facts put into each prompt
+MEMORY_PROMPT_CHARS = int(os.environ.get("MEMORY_PROMPT_CHARS", "1200"))
+
+# Facts learned by the LLM; the old free-text memory.txt is imported on first start
+fact_memory = FactMemory(MEMORY_JOURNAL, legacy_path=MEMORY_FILE,
+                         max_facts=int(os.environ.get("MEMORY_MAX_FACTS", "200")))
 
-def load_memory():
-    global memory
-    if os.path.exists(MEMORY_FILE):
+
+def memory_for_prompt() -> str:
+    """Facts most relevant to the goal, plans and what the camera has seen lately."""
+    context = " ".join((MAIN_GOAL, plan, subplan, detection_history.summary_text(DETECTION_WINDOW_SEC)))
+    return fact_memory.relevant(context, max_chars=MEMORY_PROMPT_CHARS)
+
+# Future of the full reply whose slow fields (plan, subplan, memory_ops) are still streaming in
+pending_state = None
+pending_state_lock = threading.Lock()
+
+
+def apply_state_fields(resp: robot_schema.RobotResponse):
+    global plan, subplan
+    try:
+        if resp.plan is not None:
+            plan = resp.plan
+        if resp.subplan is not None:
+            subplan = resp.subplan
+        if resp.memory_ops:
+            fact_memory.apply(resp.memory_ops)
+    except Exception as e:
+        logger.warning(f"Could not apply plan/memory from LLM reply: {e}")
+
+
+def finish_pending_state():
+    """Wait for the slow fields of the previous streamed reply and apply them to the AGI state."""
+    global pending_state
+    with pending_state_lock:
+        if pending_state is None:
+            return
         try:
-            with open(MEMORY_FILE, "r", encoding="utf-8") as f:
-                memory = f.read()
-            logger.info("Memory loaded from %s", MEMORY_FILE)
+            with tracer.span("pending_state"):
+                rest = pending_state.result(timeout=55)
+            apply_state_fields(rest)
         except Exception as e:
-            logger.warning("Could not load memory: %s", e)
+            logger.warning(f"Could not complete streamed LLM reply: {e}")
+        finally:
+            pending_state = None
+
+# Pipelined AGI cycle: while the MCU executes a move, fetch the decision for the next cycle.
+AGI_PIPELINE = os.environ.get("AGI_PIPELINE", "1") != "0"
+# Fire the prefetch this long before the move is predicted to end; agi_loop follows the move at once
+PREFETCH_LEAD_SEC = float(os.environ.get("PREFETCH_LEAD_SEC", "0.2"))
+PREFETCH_MAX_DISTANCE_DELTA_CM = float(os.environ.get("PREFETCH_MAX_DISTANCE_DELTA_CM", "15"))
+PREFETCH_MAX_AGE_SEC = float(os.environ.get("PREFETCH_MAX_AGE_SEC", "30"))
+
+# Motion model from sketch.ino: ~20 cm/s and 50 ms/deg at speed 45, scaled linearly with speed
+SKETCH_BASE_SPEED = 45.0
+SKETCH_CM_PER_SEC = 20.0
+SKETCH_MS_PER_DEG = 50.0
 
-def save_memory(new_memory):
-    global memory
-    memory = new_memory
+prefetch = None
+prefetch_stats = {"used": 0, "discarded": 0}
+
+
+def estimate_move(move_cmd: str):
+    """Return (expected duration in seconds, expected change of the forward distance reading in cm or None)."""
+    parts = move_cmd.split("|")
     try:
-        with open(MEMORY_FILE, "w", encoding="utf-8") as f:
-            f.write(memory)
-        logger.info("Memory saved to %s", MEMORY_FILE)
-    except Exception as e:
-        logger.warning("Could not save memory: %s", e)
+        if parts[0] == "MOVE" and len(parts) == 4:
+            dist, spd = float(parts[2]), float(parts[3])
+            cm_per_sec = max(SKETCH_CM_PER_SEC * (spd / SKETCH_BASE_SPEED if spd > 0 else 1.0), 0.5)
+            delta = -dist if parts[1] == "forward" else dist
+            return dist / cm_per_sec, delta
+        if parts[0] == "TURN" and len(parts) == 4:
+            ang, spd = float(parts[2]), float(parts[3])
+            scale = spd / SKETCH_BASE_SPEED if spd > 0 else 1.0
+            return ang * SKETCH_MS_PER_DEG / scale / 1000.0, None
+    except ValueError:
+        pass
+    return 0.0, 0.0
 
-load_memory()
 
-def agi_loop(distance):
-    """Called from MCU. Sends distance + subplan to LLM-vision, handles JSON response.
+# Local map from dead reckoning and the ultrasonic sensor; the LLM only reads it
+occupancy = OccupancyGrid(size=int(os.environ.get("OCCUPANCY_GRID_SIZE", "128")),
+                          cell_cm=float(os.environ.get("OCCUPANCY_CELL_CM", "20")))
+OCCUPANCY_RENDER_RADIUS = int(os.environ.get("OCCUPANCY_RENDER_RADIUS", "8"))
+
+
+def dead_reckon(move_cmd: str):
+    """Advance the occupancy grid pose by what the sketch will execute for move_cmd.
+
+    The sketch turns the command into a delay with the motion model above and truncates
+    it to whole milliseconds; the same delay is converted back into cm or degrees here.
+    """
+    parts = move_cmd.split("|") if move_cmd else []
+    if len(parts) != 4 or parts[0] not in ("MOVE", "TURN"):
+        return
+    try:
+        spd = float(parts[3])
+    except ValueError:
+        return
+    duration, _ = estimate_move(move_cmd)
+    scale = spd / SKETCH_BASE_SPEED if spd > 0 else 1.0
+    executed_ms = int(duration * 1000.0)
+    if parts[0] == "MOVE":
+        cm = executed_ms / 1000.0 * max(SKETCH_CM_PER_SEC * scale, 0.5)
+        occupancy.move(cm if parts[1] == "forward" else -cm)
+    else:
+        deg = executed_ms * scale / SKETCH_MS_PER_DEG
+        occupancy.turn(deg if parts[1] == "left" else -deg)
+
+
+def schedule_prefetch(move_cmd: str, distance: float):
+    """Launch the next /llm_vision call to fire as soon as move_cmd is expected to finish."""
+    global prefetch
+    if pending_audio:
+        # Fresh user audio deserves a non-speculative cycle
+        return
+    duration, delta = estimate_move(move_cmd)
+    predicted = distance + delta if delta is not None else distance
+    if distance >= 1000:
+        predicted = distance
+    cancelled = threading.Event()
+    # Set by take_prefetch when agi_loop arrives before the prefetch has fired: fire it right away
+    fire_now = threading.Event()
+    delay = max(0.0, duration - PREFETCH_LEAD_SEC)
+    # The prefetched request belongs to the next cycle, which takes over this ID
+    cycle_id = tracer.new_cycle_id()
+
+    # Each prefetch gets its own thread, so a new one never queues behind a discarded call still in flight.
+    # The Future only turns running when the call fires; until then it can be cancelled.
+    future = Future()
+
+    def run():
+        fire_now.wait(delay)
+        if cancelled.is_set() or not future.set_running_or_notify_cancel():
+            return
+        try:
+            with tracer.cycle(cycle_id):
+                finish_pending_state()
+                future.set_result(ask_llm_vision(distance=predicted, plan=plan, subplan=subplan, movement_history=movement_history.to_list(), history_summary=movement_history.summary(), space_map=occupancy.render(OCCUPANCY_RENDER_RADIUS), memory=memory_for_prompt()))
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="agi-prefetch", daemon=True).start()
+    prefetch = {
+        "cycle_id": cycle_id,
+        "future": future,
+        "cancelled": cancelled,
+        "fire_now": fire_now,
+        "predicted_distance": predicted,
+        "goal": MAIN_GOAL,
+        "lang": lang,
+        "created": time.time(),
+    }
+    logger.info(f"Prefetching next AGI decision in {delay:.2f}s for predicted distance {predicted}")
+
+
+def take_prefetch(distance: float):
+    """Return the speculative response if it is still valid for the actual distance, else None."""
+    global prefetch
+    p, prefetch = prefetch, None
+    if not p:
+        return None
+    reason = None
+    if p["goal"] != MAIN_GOAL or p["lang"] != lang:
+        reason = "goal or language changed"
+    elif time.time() - p["created"] > PREFETCH_MAX_AGE_SEC:
+        reason = "too old"
+    elif abs(distance - p["predicted_distance"]) > PREFETCH_MAX_DISTANCE_DELTA_CM:
+        reason = f"distance {distance} differs from predicted {p['predicted_distance']}"
+    if reason is None:
+        # Still valid: if the move ended before the prefetch fired, it fires now
+        p["fire_now"].set()
+        try:
+            resp = p["future"].result(timeout=55)
+        except Exception as e:
+            resp = None
+            reason = f"failed: {e}"
+        if resp:
+            prefetch_stats["used"] += 1
+            logger.info(f"Using prefetched AGI decision (used={prefetch_stats['used']}, discarded={prefetch_stats['discarded']})")
+            return resp
+        reason = reason or "empty response"
+    discard_prefetch(p)
+    logger.info(f"Discarding prefetched AGI decision: {reason}")
+    return None
+
+# Safety reflex: obstacle handling that does not wait for the LLM
+REFLEX_ENABLED = os.environ.get("AGI_REFLEX", "1") != "0"
+REFLEX_BLOCKED_CM = float(os.environ.get("REFLEX_BLOCKED_CM", "25"))
+# Closing in: below REFLEX_CLOSING_CM and at least REFLEX_CLOSING_DELTA_CM nearer than the previous reading
+REFLEX_CLOSING_CM = float(os.environ.get("REFLEX_CLOSING_CM", "40"))
+REFLEX_CLOSING_DELTA_CM = float(os.environ.get("REFLEX_CLOSING_DELTA_CM", "10"))
+# After this many reflexes in a row the LLM decides again, so the robot cannot reflex forever
+REFLEX_MAX_CONSECUTIVE = int(os.environ.get("REFLEX_MAX_CONSECUTIVE", "3"))
+REFLEX_BACK_CM = 20
+REFLEX_TURN_DEG = 45
+REFLEX_SPEED = 50
+REFLEX_RGB = "255,0,0"
+
+last_distance = None
+consecutive_reflexes = 0
+decision_stats = {"reflex": 0, "llm": 0, "prefetched": 0}
+# Log the reply parser's malformed/invalid-field counters every N LLM decisions
+REPLY_STATS_EVERY = int(os.environ.get("REPLY_STATS_EVERY", "50"))
+
+
+def reflex_reason(distance: float):
+    """Why the robot must escape without asking the LLM, or None."""
+    if distance >= 1000:
+        # No echo: either open space or too close for the sonar; trust the previous reading
+        if last_distance is not None and last_distance < REFLEX_CLOSING_CM and movement_history.last_command() == "forward":
+            return f"no echo right after {last_distance:.0f} cm"
+        return None
+    if 0 < distance < REFLEX_BLOCKED_CM:
+        return f"blocked at {distance:.0f} cm"
+    if (distance < REFLEX_CLOSING_CM and last_distance is not None and last_distance < 1000
+            and last_distance - distance >= REFLEX_CLOSING_DELTA_CM and movement_history.last_command() == "forward"):
+        return f"closing in {last_distance:.0f} -> {distance:.0f} cm"
+    return None
+
+
+def escape_move() -> dict:
+    """Back off first; once backed off, turn away from the side the last turn went to, wider on repeats."""
+    if movement_history.last_command() != "back":
+        return {"command": "back", "distance_cm": REFLEX_BACK_CM}
+    turn = "right" if movement_history.last_turn() == "left" else "left"
+    return {"command": turn, "angle_deg": REFLEX_TURN_DEG * max(1, consecutive_reflexes)}
+
+
+def discard_prefetch(p):
+    p["cancelled"].set()
+    p["future"].cancel()
+    p["fire_now"].set()
+    prefetch_stats["discarded"] += 1
+
+
+def cancel_prefetch():
+    global prefetch
+    p, prefetch = prefetch, None
+    if p:
+        discard_prefetch(p)
+
+
+def run_reflex(distance: float, reason: str) -> str:
+    """Pick and record an escape move, let the LLM think in the background, return the MCU command."""
+    global consecutive_reflexes
+    consecutive_reflexes += 1
+    decision_stats["reflex"] += 1
+    mv = escape_move()
+    if mv["command"] == "back":
+        move_cmd = f"MOVE|back|{mv['distance_cm']}|{REFLEX_SPEED}"
+    else:
+        move_cmd = f"TURN|{mv['command']}|{mv['angle_deg']}|{REFLEX_SPEED}"
+    robot_state.update(rgb=REFLEX_RGB)
+    movement_history.append(mv)
+    dead_reckon(move_cmd)
+    logger.info(f"Reflex ({reason}): {move_cmd} [reflex={decision_stats['reflex']}, llm={decision_stats['llm']}, "
+                f"prefetched={decision_stats['prefetched']}]")
+    # The speculative decision was made for a different situation; start a fresh one for after the escape
+    cancel_prefetch()
+    if AGI_PIPELINE:
+        schedule_prefetch(move_cmd, distance)
+    return move_cmd
+
+
+def run_agi_cycle(distance):
+    """Sends distance + subplan to LLM-vision, handles the reply (see robot_schema.RESPONSE_SCHEMA).
 
     {
       "speak": {"text": "...",
@@ -318,60 +858,74 @@ def agi_loop(distance):
       "move": {"command": "forward|back|left|right|stop",  "distance_cm": integer, "angle_deg": integer },
       "plan": "updated global strategy",
       "subplan": "updated context string",
-      "map": "updated map string",
-      "memory": "updated memory string"
+      "memory_ops": [{"op": "add|update|delete", "key": "fact_id", "value": "fact"}]
     }
     """
-    
-    
-    global plan, subplan, space_map, memory, forward, back, left, right, movement_history, rgb
-    logger.info(f"AGI loop called with distance: {distance}, plan: {plan}, subplan: {subplan}, memory size: {len(memory)}")
-
-    resp = ask_llm_vision(distance=distance, plan=plan, subplan=subplan, movement_history=movement_history, space_map=space_map, memory=memory)
+    global pending_state, pending_audio
+    logger.info(f"AGI loop called with distance: {distance}, plan: {plan}, subplan: {subplan}, facts: {len(fact_memory)}")
+
+    global last_distance, consecutive_reflexes
+    reason = reflex_reason(distance) if REFLEX_ENABLED and consecutive_reflexes < REFLEX_MAX_CONSECUTIVE else None
+    if reason is None or distance < 1000:
+        # A no-echo reading right after a near one is not free space
+        occupancy.observe(distance)
+    last_distance = distance
+    if reason is not None:
+        return run_reflex(distance, reason)
+    consecutive_reflexes = 0
+
+    finish_pending_state()
+    resp = take_prefetch(distance) if AGI_PIPELINE else None
+    if resp is not None:
+        decision_stats["prefetched"] += 1
+    else:
+        decision_stats["llm"] += 1
+        if REPLY_STATS_EVERY and decision_stats["llm"] % REPLY_STATS_EVERY == 0:
+            logger.info(f"LLM reply stats: {robot_schema.stats()}")
+        resp = ask_llm_vision(distance=distance, plan=plan, subplan=subplan, movement_history=movement_history.to_list(), history_summary=movement_history.summary(), space_map=occupancy.render(OCCUPANCY_RENDER_RADIUS), memory=memory_for_prompt())
     move_cmd = ""
-    if not resp:
+    if resp is None:
         return move_cmd
 
-    # Update state if provided
-    try:
-        if "plan" in resp and isinstance(resp["plan"], str):
-            plan = resp["plan"]
-        if "subplan" in resp and isinstance(resp["subplan"], str):
-            subplan = resp["subplan"]
-        if "map" in resp and isinstance(resp["map"], str):
-            space_map = resp["map"]
-        if "memory" in resp and isinstance(resp["memory"], str):
-            save_memory(resp["memory"])
-    except Exception:
-        pass
+    # Update state if provided; for a streamed reply the slow fields are applied once they arrive
+    if resp.pending is None:
+        apply_state_fields(resp)
+    else:
+        with pending_state_lock:
+            pending_state = resp.pending
+        resp.pending = None
 
     # Handle speaking
     try:
-        sp = resp.get("speak")
-        if sp and isinstance(sp, dict):
-            text = sp.get("text")
-            if text:
-                speak(text)
-                logger.info("Robot speaking!! Starting 10-second recording...")
-    
-                # now record mic for 5 sec and save to file with proper WAV header
+        text = resp.speak
+        if text:
+            # Wait for playback so the recording does not capture our own voice
+            speak(text, wait=True)
+            logger.info("Robot speaking!! Listening for a reply...")
+
+            # Record into the in-memory buffer (S16_LE, 16 kHz mono) until the VAD
+            # sees the end of speech, or gives up when nobody starts talking
+            with tracer.span("listen"):
                 mic = Microphone()
                 mic.start()
                 try:
                     audio_chunk_iterator = mic.stream()  # Returns a numpy array iterator
                     start_time = time.time()
-                    
-                    # Use wave module to write with header
-                    with wave.open("mic.wav", "wb") as wf:
-                        wf.setnchannels(1)
-                        wf.setsampwidth(2) # S16_LE is 2 bytes
-                        wf.setframerate(16000)
-                        
-                        for chunk in audio_chunk_iterator:
-                            wf.writeframes(chunk.tobytes())
-                            if time.time() - start_time >= 5:
-                                break
-                    logger.info("Recording finished and saved to mic.wav with WAV header")
+                    mic_buffer.clear()
+                    vad = VoiceActivityDetector(rate=MIC_RATE)
+                    for chunk in audio_chunk_iterator:
+                        full = not mic_buffer.append(chunk)
+                        state = vad.process(chunk)
+                        if full or state in ("ended", "no_speech") or time.time() - start_time >= MIC_RECORD_SECONDS:
+                            break
+                    listened = mic_buffer.seconds()
+                    if vad.speech_detected:
+                        mic_buffer.trim(*vad.trim_bounds(mic_buffer.length))
+                        pending_audio = True
+                        logger.info(f"Recording finished ({vad.state}): kept {mic_buffer.seconds():.1f}s of speech out of {listened:.1f}s")
+                    else:
+                        pending_audio = False
+                        logger.info(f"No speech detected after {listened:.1f}s, not sending audio")
                 finally:
                     mic.stop()
                   
@@ -380,29 +934,25 @@ def agi_loop(distance):
 
     # Handle sound
     try:
-        snd = resp.get("sound")
-        if snd == "casual":
+        if resp.sound == "casual":
              play_random_sound()
     except Exception as e:
         logger.warning("Warning handling sound: %s", e)
 
     # Handle RGB
     try:
-        rgb_val = resp.get("rgb")
-        if rgb_val and isinstance(rgb_val, str):
-            # Validate format "R,G,B"
-            parts = rgb_val.split(',')
-            if len(parts) == 3:
-                 rgb = rgb_val
-                 logger.info(f"AGI set RGB to: {rgb}")
+        # Already validated as "R,G,B" by robot_schema
+        if resp.rgb:
+            robot_state.update(rgb=resp.rgb)
+            logger.info(f"AGI set RGB to: {resp.rgb}")
     except Exception as e:
         logger.warning("Warning handling rgb: %s", e)
 
 
     # Handle movement: build a short command string for MCU to execute and return it
     try:
-        mv = resp.get("move")
-        if mv and isinstance(mv, dict):
+        mv = resp.move
+        if mv:
             # Expected keys: command (forward|back|left|right), distance_cm, angle_deg
             cmd = mv.get("command")
             mv_distance = mv.get("distance_cm")
@@ -420,10 +970,47 @@ def agi_loop(distance):
             # Add to history if a valid move command was generated
             if move_cmd:
                 movement_history.append(mv)
+                dead_reckon(move_cmd)
 
     except Exception as e:
         logger.warning("Warning handling move: %s", e)
 
+    if AGI_PIPELINE:
+        schedule_prefetch(move_cmd, distance)
+
+    return move_cmd
+
+
+# (cycle ID, time agi_loop returned) of the previous cycle
+last_cycle = None
+
+
+def publish_trace(cycle_id):
+    """Log a finished cycle's breakdown and post its spans to media_service in the background."""
+    spans = {name.split(".", 1)[1]: seconds for name, seconds in tracer.cycle_spans(cycle_id).items()}
+    logger.info(f"Cycle {cycle_id} breakdown (s): {spans}")
+
+    def post():
+        try:
+            media.trace("robot", cycle_id, spans)
+        except Exception as e:
+            logger.debug(f"Could not post trace of cycle {cycle_id}: {e}")
+
+    trace_executor.submit(post)
+
+
+def agi_loop(distance):
+    """Called from MCU. Runs one AGI cycle under a new cycle ID (or the one reserved by the prefetch)."""
+    global last_cycle
+    started = time.time()
+    cycle_id = prefetch["cycle_id"] if prefetch else tracer.new_cycle_id()
+    if last_cycle is not None and TRACING:
+        # Between cycles: the MCU executing the returned command plus the Bridge round trip
+        tracer.record("mcu", started - last_cycle[1], last_cycle[0])
+        publish_trace(last_cycle[0])
+    with tracer.cycle(cycle_id), tracer.span("cycle"):
+        move_cmd = run_agi_cycle(distance)
+    last_cycle = (cycle_id, time.time())
     return move_cmd
 
 
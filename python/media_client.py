@@ -0,0 +1,271 @@
+"""Keep-alive HTTP client for media_service.py.
+
+Each thread keeps one persistent HTTP/1.1 connection to the media service, so
+a robot cycle (speak, play a sound, ask the LLM) does not pay for a TCP
+handshake per call. Calls get per-endpoint timeouts, are retried with backoff
+when the request could not be sent or the service answers 503, and their
+latency is recorded in a per-endpoint histogram.
+"""
+
+import bisect
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+
+logger = logging.getLogger("media-client")
+
+# Seconds; /speak with wait=1 blocks until playback has finished
+DEFAULT_TIMEOUTS = {
+    "/play": 5,
+    "/play_random": 5,
+    "/speak": 60,
+    "/llm_vision": 55,
+    "/trace": 2,
+}
+DEFAULT_TIMEOUT = 10
+
+# Upper bounds in milliseconds of the latency histogram buckets
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+# Transport errors worth a retry. They are only retried when raised while connecting or
+# sending: once the request is out, the service may already be acting on it (a billed
+# Gemini call, a sound playing), and resending would do it twice.
+RETRYABLE_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    ConnectionResetError,
+    ConnectionRefusedError,
+    ConnectionAbortedError,
+    BrokenPipeError,
+)
+
+
+class MediaServiceError(Exception):
+    def __init__(self, path, status, body):
+        super().__init__(f"{path} returned HTTP {status}: {body[:200]!r}")
+        self.path = path
+        self.status = status
+        self.body = body
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile (None if empty)."""
+        if not self.count:
+            return None
+        rank = q / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def snapshot(self):
+        labels = [f"<={b}ms" for b in self.buckets] + [f">{self.buckets[-1]}ms"]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 1) if self.count else None,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "buckets": {label: n for label, n in zip(labels, self.counts) if n},
+        }
+
+
+class MediaServiceClient:
+    """Typed calls to media_service over per-thread keep-alive connections."""
+
+    def __init__(self, host="172.17.0.1", port=5000, timeouts=None, retries=2, backoff=0.25,
+                 idle_timeout=50.0, stats_every=50):
+        self.host = host
+        self.port = port
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self.retries = retries
+        self.backoff = backoff
+        # Reconnect before the server's keep-alive timeout closes the socket under us
+        self.idle_timeout = idle_timeout
+        self.stats_every = stats_every
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.connect_latency = LatencyHistogram()
+        self.counters = {"calls": 0, "errors": 0, "retries": 0, "connections_opened": 0, "connections_reused": 0}
+
+    # --- connection handling -------------------------------------------------
+
+    def _connection(self, timeout):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+            self._local.conn = conn
+            self._local.last_used = 0.0
+        if conn.sock is not None and time.time() - self._local.last_used > self.idle_timeout:
+            conn.close()
+        conn.timeout = timeout
+        if conn.sock is None:
+            started = time.time()
+            conn.connect()
+            with self._lock:
+                self.connect_latency.observe((time.time() - started) * 1000)
+                self.counters["connections_opened"] += 1
+        else:
+            conn.sock.settimeout(timeout)
+            with self._lock:
+                self.counters["connections_reused"] += 1
+        return conn
+
+    def _discard_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+
+    def close(self):
+        """Close this thread's connection."""
+        self._discard_connection()
+        self._local.conn = None
+
+    # --- requests --------------------------------------------------------------
+
+    def request(self, method, path, params=None, body=None, headers=None, stream=False, timeout=None):
+        """Send a request and return (status, body bytes), or the open response when stream=True.
+
+        Raises MediaServiceError for HTTP errors and the underlying exception when
+        the service stays unreachable after the retries.
+        """
+        if timeout is None:
+            timeout = self.timeouts.get(path, DEFAULT_TIMEOUT)
+        url = path + ("?" + urllib.parse.urlencode(params) if params else "")
+        headers = dict(headers or {})
+        if body is not None and "Content-Length" not in headers:
+            parts = [body] if isinstance(body, (bytes, bytearray, memoryview)) else list(body)
+            headers["Content-Length"] = str(sum(len(part) for part in parts))
+            body = parts
+
+        started = time.time()
+        attempt = 0
+        try:
+            while True:
+                sent = False
+                try:
+                    conn = self._connection(timeout)
+                    conn.request(method, url, body=body, headers=headers)
+                    sent = True
+                    response = conn.getresponse()
+                except RETRYABLE_ERRORS as e:
+                    self._discard_connection()
+                    if sent or attempt >= self.retries:
+                        raise
+                    self._sleep_before_retry(path, attempt, e)
+                    attempt += 1
+                    continue
+                except Exception:
+                    self._discard_connection()
+                    raise
+
+                if response.status == 503 and attempt < self.retries:
+                    response.read()
+                    self._local.last_used = time.time()
+                    self._sleep_before_retry(path, attempt, "service busy")
+                    attempt += 1
+                    continue
+
+                if stream and response.status < 400:
+                    # The streamed reply ends with the connection; the next call reconnects
+                    self._local.last_used = time.time()
+                    return response
+                try:
+                    data = response.read()
+                except Exception:
+                    self._discard_connection()
+                    raise
+                self._local.last_used = time.time()
+                if response.will_close:
+                    self._discard_connection()
+                if response.status >= 400:
+                    raise MediaServiceError(path, response.status, data)
+                return response.status, data
+        except Exception:
+            with self._lock:
+                self.counters["errors"] += 1
+            raise
+        finally:
+            self._record(path, (time.time() - started) * 1000)
+
+    def _sleep_before_retry(self, path, attempt, reason):
+        delay = self.backoff * (2 ** attempt)
+        logger.info(f"Retrying {path} in {delay:.2f}s ({reason})")
+        with self._lock:
+            self.counters["retries"] += 1
+        time.sleep(delay)
+
+    def _record(self, path, ms):
+        with self._lock:
+            self.latency.setdefault(path, LatencyHistogram()).observe(ms)
+            self.counters["calls"] += 1
+            report = self.stats_every and self.counters["calls"] % self.stats_every == 0
+        if report:
+            logger.info(f"Media service client stats: {self.stats()}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "connect": self.connect_latency.snapshot(),
+                "latency": {path: hist.snapshot() for path, hist in self.latency.items()},
+            }
+
+    # --- endpoints ---------------------------------------------------------------
+
+    def play(self, filename, wait=False):
+        params = {"filename": filename}
+        if wait:
+            params["wait"] = "1"
+        return self.request("GET", "/play", params)[1].decode("utf-8")
+
+    def play_random(self):
+        return self.request("GET", "/play_random")[1].decode("utf-8")
+
+    def speak(self, text, lang="en", wait=False, cycle_id=None):
+        params = {"text": text, "lang": lang}
+        if wait:
+            params["wait"] = "1"
+        if cycle_id:
+            params["cycle"] = cycle_id
+        return self.request("GET", "/speak", params)[1].decode("utf-8")
+
+    def llm_vision(self, body, content_type, stream=False):
+        """POST a /llm_vision body (bytes or a list of parts). Returns the raw reply bytes,
+        or the open NDJSON response when stream=True."""
+        headers = {"Content-Type": content_type}
+        if stream:
+            return self.request("POST", "/llm_vision", body=body, headers=headers, stream=True)
+        return self.request("POST", "/llm_vision", body=body, headers=headers)[1]
+
+    def trace(self, source, cycle_id, spans):
+        """Post one cycle's {span name: seconds} to the service's /metrics."""
+        body = json.dumps({"source": source, "cycle_id": cycle_id, "spans": spans}).encode("utf-8")
+        return self.request("POST", "/trace", body=body, headers={"Content-Type": "application/json"})[1]
+
+
+def from_env():
+    return MediaServiceClient(
+        host=os.environ.get("MEDIA_SERVICE_HOST", "172.17.0.1"),
+        port=int(os.environ.get("MEDIA_SERVICE_PORT", "5000")),
+        retries=int(os.environ.get("MEDIA_CLIENT_RETRIES", "2")),
+        stats_every=int(os.environ.get("MEDIA_CLIENT_STATS_EVERY", "50")),
+    )
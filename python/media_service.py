@@ -3,18 +3,30 @@ import socketserver
 import subprocess
 import urllib.parse
 import sys
-import tempfile
 import base64
+import hashlib
+import io
 import os
 import socketio
 import threading
 import json
 import re
-import ast
 import random
 import glob
+import time
+import collections
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
+import shutil
+import signal
+import wave
 from datetime import datetime
 
+import robot_schema
+from tracing import Tracer
+
 os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = '/home/arduino/google.json'
 
 import logging
@@ -39,39 +51,548 @@ try:
 except ImportError:
     logger.warning("google-genai library not found. LLM will not work.")
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+    logger.warning("Pillow not found. Camera frames will be sent to Gemini without preprocessing.")
+
+
+PRIORITY_SPEECH = 0
+PRIORITY_SOUND = 1
+PRIORITY_CASUAL = 2
+
+
+class PlaybackQueueFull(Exception):
+    pass
+
+
+class AplaySink:
+    """Plays clips on the speaker through aplay."""
+
+    def start(self, filename):
+        return subprocess.Popen(['aplay', '-q', filename])
+
+    def finish(self, handle):
+        code = handle.wait()
+        if code not in (0, -signal.SIGTERM):
+            raise Exception(f"aplay exited with code {code}")
+
+    def stop(self, handle):
+        if handle.poll() is None:
+            handle.terminate()
+
+
+class NullSink:
+    """Discards audio. With realtime=True it still waits for the clip's duration."""
+
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+
+    def start(self, filename):
+        duration = 0.0
+        if self.realtime:
+            try:
+                with wave.open(filename, 'rb') as wf:
+                    duration = wf.getnframes() / float(wf.getframerate())
+            except Exception:
+                pass
+        return {'stopped': threading.Event(), 'duration': duration}
+
+    def finish(self, handle):
+        handle['stopped'].wait(handle['duration'])
+
+    def stop(self, handle):
+        handle['stopped'].set()
+
+
+class FileSink:
+    """Copies every played clip into a directory, numbered in playback order."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.count = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self, filename):
+        self.count += 1
+        target = os.path.join(self.directory, f"{self.count:05d}_{os.path.basename(filename)}")
+        shutil.copyfile(filename, target)
+        return target
+
+    def finish(self, handle):
+        pass
+
+    def stop(self, handle):
+        pass
+
+
+def make_audio_sink(spec):
+    if spec == 'null':
+        return NullSink()
+    if spec == 'null-realtime':
+        return NullSink(realtime=True)
+    if spec.startswith('file:'):
+        return FileSink(spec[len('file:'):])
+    return AplaySink()
+
+
+class PlaybackJob:
+    def __init__(self, job_id, source, priority, label):
+        # source is a file path, or a Future resolving to one while TTS is still synthesizing
+        self.id = job_id
+        self.source = source
+        self.filename = source if isinstance(source, str) else None
+        self.priority = priority
+        self.label = label or (os.path.basename(source) if isinstance(source, str) else f"job {job_id}")
+        self.state = 'queued'
+        self.error = None
+        self.queued_at = time.time()
+        self.started_at = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def info(self):
+        return {
+            'id': self.id,
+            'label': self.label,
+            'priority': self.priority,
+            'state': self.state,
+            'queued_sec': round((self.started_at or time.time()) - self.queued_at, 3),
+        }
+
+
+class AudioPlayer:
+    """Single speaker, many producers: a priority queue drained by one playback thread.
+
+    Lower priority numbers play first (speech before effects); equal priorities
+    play in arrival order. Speech arriving while a casual effect is playing
+    interrupts the effect.
+    """
+
+    def __init__(self, sink, max_queue=16, source_timeout=30.0):
+        self.sink = sink
+        self.max_queue = max_queue
+        self.source_timeout = source_timeout
+        self._heap = []
+        self._seq = itertools.count()
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._current = None
+        self._current_handle = None
+        self._thread = None
+        self.counters = {'played': 0, 'cancelled': 0, 'interrupted': 0, 'failed': 0, 'rejected': 0}
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="AudioPlayer", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, source, priority=PRIORITY_SOUND, interrupt=False, label=None):
+        return self.enqueue_group([source], priority=priority, interrupt=interrupt, label=label)[0]
+
+    def enqueue_group(self, sources, priority=PRIORITY_SOUND, interrupt=False, label=None):
+        """Queue several clips back to back; nothing of equal priority can slip in between them."""
+        self.start()
+        with self._cond:
+            queued = sum(1 for _, _, job in self._heap if job.state == 'queued')
+            if queued + len(sources) > self.max_queue:
+                self.counters['rejected'] += 1
+                raise PlaybackQueueFull(f"playback queue is full ({queued} clips waiting)")
+            jobs = []
+            for i, source in enumerate(sources):
+                part_label = label if len(sources) == 1 or not label else f"{label} [{i + 1}/{len(sources)}]"
+                job = PlaybackJob(next(self._ids), source, priority, part_label)
+                heapq.heappush(self._heap, (priority, next(self._seq), job))
+                jobs.append(job)
+            current = self._current
+            if current and current.state == 'playing':
+                if (interrupt and priority <= current.priority) or (
+                        priority == PRIORITY_SPEECH and current.priority == PRIORITY_CASUAL):
+                    self._stop_current_locked()
+            self._cond.notify_all()
+        for job in jobs:
+            logger.info(f"Queued playback job {job.id}: {job.label} (priority {priority})")
+        return jobs
+
+    def cancel(self, job_id):
+        with self._cond:
+            if self._current and self._current.id == job_id:
+                self._stop_current_locked()
+                return True
+            for _, _, job in self._heap:
+                if job.id == job_id and job.state == 'queued':
+                    self._finish_job(job, 'cancelled')
+                    return True
+        return False
+
+    def stop_current(self):
+        with self._cond:
+            return self._stop_current_locked()
+
+    def clear(self):
+        with self._cond:
+            for _, _, job in self._heap:
+                if job.state == 'queued':
+                    self._finish_job(job, 'cancelled')
+            self._heap = []
+            self._stop_current_locked()
+
+    def _stop_current_locked(self):
+        if not self._current:
+            return False
+        self._current.state = 'interrupted'
+        if self._current_handle:
+            try:
+                self.sink.stop(self._current_handle)
+            except Exception as e:
+                logger.warning(f"Failed to stop playback: {e}")
+        return True
+
+    def _finish_job(self, job, state, error=None):
+        job.state = state
+        job.error = error
+        self.counters[state] = self.counters.get(state, 0) + 1
+        job.done.set()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job = heapq.heappop(self._heap)
+                if job.state != 'queued':
+                    continue
+                job.state = 'playing'
+                job.started_at = time.time()
+                self._current = job
+
+            if job.filename is None:
+                # Streamed speech: wait until this chunk has been synthesized, but not forever
+                try:
+                    job.filename = job.source.result(timeout=self.source_timeout)
+                except concurrent.futures.TimeoutError:
+                    job.source.cancel()
+                    with self._cond:
+                        self._current = None
+                        logger.error(f"Speech chunk for {job.label} not synthesized within {self.source_timeout}s")
+                        self._finish_job(job, 'failed', 'synthesis timed out')
+                    continue
+                except Exception as e:
+                    with self._cond:
+                        self._current = None
+                        logger.error(f"Speech chunk for {job.label} failed to synthesize: {e}")
+                        self._finish_job(job, 'failed', str(e))
+                    continue
+
+            with self._cond:
+                if job.state == 'interrupted':
+                    self._current = None
+                    self._finish_job(job, 'interrupted')
+                    continue
+                try:
+                    self._current_handle = self.sink.start(job.filename)
+                except Exception as e:
+                    logger.error(f"Failed to play audio: {e}", exc_info=True)
+                    self._current = None
+                    self._finish_job(job, 'failed', str(e))
+                    continue
+                handle = self._current_handle
+
+            error = None
+            try:
+                self.sink.finish(handle)
+            except Exception as e:
+                error = str(e)
+
+            with self._cond:
+                self._current = None
+                self._current_handle = None
+                if job.state == 'interrupted':
+                    self._finish_job(job, 'interrupted')
+                    logger.info(f"Interrupted audio: {job.label}")
+                elif error:
+                    logger.error(f"Failed to play audio {job.filename}: {error}")
+                    self._finish_job(job, 'failed', error)
+                else:
+                    self._finish_job(job, 'played')
+                    logger.info(f"Finished playing audio: {job.filename}")
+
+    def status(self):
+        with self._cond:
+            current = self._current.info() if self._current else None
+            if current:
+                current['elapsed_sec'] = round(time.time() - self._current.started_at, 3)
+            queued = [job.info() for _, _, job in sorted(self._heap) if job.state == 'queued']
+            return {
+                'sink': type(self.sink).__name__,
+                'current': current,
+                'queued': queued,
+                'counters': dict(self.counters),
+            }
+
+
+PLAYER = AudioPlayer(
+    make_audio_sink(os.environ.get('AUDIO_SINK', 'aplay')),
+    max_queue=int(os.environ.get('AUDIO_QUEUE_DEPTH', '16')),
+    source_timeout=float(os.environ.get('TTS_CHUNK_TIMEOUT_SEC', '30')),
+)
+
+
+def play_audio_file(filename, priority=PRIORITY_SOUND):
+    job = PLAYER.enqueue(filename, priority=priority)
+    job.wait()
+    if job.state == 'failed':
+        raise Exception(job.error)
+    return job
+
+
+def pick_random_sound():
+    sounds_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sounds')
+    files = glob.glob(os.path.join(sounds_dir, '*.wav'))
+    if not files:
+        logger.warning(f"No .wav files found in {sounds_dir}")
+        return None
+    return random.choice(files)
 
-def play_audio_file(filename):
-    try:
-        subprocess.run(['aplay', filename], check=True) #Popen if no wait
-        logger.info(f"Finished playing audio via aplay: {filename}")
-    except Exception as e:
-        logger.error(f"Failed to play audio: {e}", exc_info=True)
-        raise e
 
 def play_random_sound():
     try:
-        sounds_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sounds')
-        files = glob.glob(os.path.join(sounds_dir, '*.wav'))
-        if not files:
-            logger.warning(f"No .wav files found in {sounds_dir}")
-            return None
-        
-        filename = random.choice(files)
-        play_audio_file(filename)
+        filename = pick_random_sound()
+        if filename:
+            PLAYER.enqueue(filename, priority=PRIORITY_CASUAL)
         return filename
     except Exception as e:
         logger.error(f"Failed to play random sound: {e}", exc_info=True)
         return None
 
 PORT = 5000
-TTS_CACHE = {}
 LLM_CLIENT = None
+LLM_INIT_LOCK = threading.Lock()
+
+
+class TTSCache:
+    """Persistent, size-bounded cache of synthesized speech.
+
+    Files are named by a hash of everything that affects the audio (text,
+    language, voice, audio config) and evicted least-recently-used once the
+    directory grows past max_bytes. File mtimes carry the LRU order across
+    restarts.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def make_key(text, lang, voice, audio_config):
+        blob = json.dumps([text, lang, voice, audio_config], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.wav")
+
+    def _load(self):
+        files = []
+        for filename in glob.glob(os.path.join(self.directory, '*.wav')):
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            files.append((st.st_mtime, os.path.basename(filename)[:-4], st.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self.total_bytes += size
+        logger.info(f"TTS cache loaded {len(self._entries)} entries ({self.total_bytes} bytes) from {self.directory}")
+        self._evict()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            path = self.path(key)
+            if not os.path.exists(path):
+                self.total_bytes -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def put(self, key, audio_content):
+        path = self.path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(audio_content)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)
+            self._entries[key] = len(audio_content)
+            self.total_bytes += len(audio_content)
+            self._evict(keep=key)
+        return path
+
+    def _evict(self, keep=None):
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            self.total_bytes -= self._entries.pop(key)
+            self.evictions += 1
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+TTS_CACHE = TTSCache(
+    os.environ.get('TTS_CACHE_DIR', os.path.expanduser('~/.cache/agi-robot/tts')),
+    int(os.environ.get('TTS_CACHE_MAX_BYTES', str(64 * 1024 * 1024))),
+)
+
+TTS_AUDIO_CONFIG = {'audioEncoding': 'LINEAR16', 'volumeGainDb': 10.0} # +10dB for "speak loud"
+
+# Stock phrases main.py says at startup and on cloud updates
+TTS_WARMUP_PHRASES = [
+    ("Robot is ready", "en"),
+    ("Language changed to en", "en"),
+    ("Language changed to ru", "ru"),
+    ("Language changed to cz", "cz"),
+]
+
+
+TTS_SERVICE_FACTORY = lambda: build('texttospeech', 'v1')
+TTS_LOCAL = threading.local()
+TTS_STREAMING = os.environ.get('TTS_STREAMING', '1') != '0'
+TTS_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.environ.get('TTS_STREAM_WORKERS', '3')), thread_name_prefix="TTS")
+SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?…;])\s+')
+MIN_SENTENCE_CHARS = 20
+
+
+def get_tts_service():
+    # googleapiclient services are not thread-safe, so build one per worker thread and reuse it
+    service = getattr(TTS_LOCAL, 'service', None)
+    if service is None:
+        # Note: Requires GOOGLE_APPLICATION_CREDENTIALS environment variable to be set
+        logger.info(f"Initializing Google TTS service in {threading.current_thread().name}...")
+        service = TTS_SERVICE_FACTORY()
+        TTS_LOCAL.service = service
+    return service
+
+
+def split_sentences(text):
+    """Split text into sentences, gluing very short fragments onto the next one."""
+    sentences = []
+    pending = ''
+    for part in SENTENCE_SPLIT_RE.split(text.strip()):
+        pending = f"{pending} {part}".strip() if pending else part.strip()
+        if len(pending) >= MIN_SENTENCE_CHARS:
+            sentences.append(pending)
+            pending = ''
+    if pending:
+        if sentences and len(pending) < MIN_SENTENCE_CHARS:
+            sentences[-1] = f"{sentences[-1]} {pending}"
+        else:
+            sentences.append(pending)
+    return sentences or [text]
+
+
+def synthesize_speech_stream(text, lang):
+    """Start synthesizing every sentence of text concurrently; returns one Future per sentence in order."""
+    return [TTS_EXECUTOR.submit(synthesize_speech, sentence, lang) for sentence in split_sentences(text)]
+
+
+def tts_voice(lang):
+    # Select voice based on language
+    if lang == 'ru':
+        return {'languageCode': 'ru-RU', 'name': 'ru-RU-Wavenet-D'}
+    elif lang == 'cz' or lang == 'cs':
+        return {'languageCode': 'cs-CZ', 'name': 'cs-CZ-Wavenet-A'}
+    # Default to English
+    return {'languageCode': 'en-US', 'name': 'en-US-Neural2-D'}
+
+
+def synthesize_speech(text, lang):
+    voice = tts_voice(lang)
+    cache_key = TTSCache.make_key(text, lang, voice, TTS_AUDIO_CONFIG)
+    cached = TTS_CACHE.get(cache_key)
+    if cached:
+        logger.info(f"Using cached audio for text: {text} ({lang})")
+        return cached
+
+    service = get_tts_service()
+
+    logger.info(f"Synthesizing text: {text} with voice: {voice['name']}")
+    response = service.text().synthesize(
+        body={
+            'input': {'text': text},
+            'voice': voice,
+            'audioConfig': TTS_AUDIO_CONFIG
+        }
+    ).execute()
+    logger.info("TTS synthesis successful.")
+
+    audio_content = base64.b64decode(response['audioContent'])
+    return TTS_CACHE.put(cache_key, audio_content)
+
+
+def warm_tts_cache(phrases=None):
+    for text, lang in phrases or TTS_WARMUP_PHRASES:
+        try:
+            synthesize_speech(text, lang)
+        except Exception as e:
+            logger.warning(f"TTS warm-up failed for '{text}' ({lang}): {e}")
+    logger.info(f"TTS warm-up finished: {TTS_CACHE.stats()}")
+
 
 def init_llm():
-    global LLM_CLIENT
     if LLM_CLIENT:
         return
-    
+
+    with LLM_INIT_LOCK:
+        if LLM_CLIENT:
+            return
+        _create_llm_client()
+
+
+def _create_llm_client():
+    global LLM_CLIENT
+    if os.environ.get('GEMINI_FAKE') == '1':
+        from fakes import FakeGenaiClient
+        LLM_CLIENT = FakeGenaiClient()
+        logger.warning("Using offline FakeGenaiClient (GEMINI_FAKE=1)")
+        return
+
     try:
         api_key = os.environ.get("GEMINI_KEY")
         if not api_key:
@@ -85,6 +606,53 @@ def init_llm():
         raise
 
 
+def decode_image_event(data):
+    """Extract raw image bytes from a socket.io 'image' event payload, or None."""
+    try:
+        b64 = None
+        if isinstance(data, bytes):
+            return data
+        if isinstance(data, str):
+            b64 = data
+        if isinstance(data, dict):
+            for key in ('b64', 'image', 'img', 'data', 'payload'):
+                v = data.get(key)
+                if v:
+                    b64 = v
+                    break
+            if not b64 and 'frames' in data and data['frames']:
+                first = data['frames'][0]
+                if isinstance(first, (str, bytes)):
+                    b64 = first
+        if isinstance(data, (list, tuple)) and data:
+            for item in data:
+                if isinstance(item, (str, bytes)):
+                    b64 = item
+                    break
+                if isinstance(item, dict):
+                    for key in ('b64', 'image', 'img', 'data'):
+                        if item.get(key):
+                            b64 = item.get(key)
+                            break
+                    if b64:
+                        break
+
+        if b64 is None:
+            return None
+
+        if isinstance(b64, bytes):
+            return b64
+
+        if isinstance(b64, str) and b64.startswith('data:image'):
+            parts = b64.split(',', 1)
+            if len(parts) == 2:
+                b64 = parts[1]
+
+        return base64.b64decode(b64)
+    except Exception:
+        return None
+
+
 def get_image_from_socket(timeout=5):
     sio = socketio.Client(logger=False, engineio_logger=False)
     result = {'data': None}
@@ -92,61 +660,8 @@ def get_image_from_socket(timeout=5):
 
     @sio.on('image')
     def _on_image(data):
-        try:
-            b64 = None
-            if isinstance(data, bytes):
-                result['data'] = data
-                done.set()
-                return
-            if isinstance(data, str):
-                b64 = data
-            if isinstance(data, dict):
-                for key in ('b64', 'image', 'img', 'data', 'payload'):
-                    v = data.get(key)
-                    if v:
-                        b64 = v
-                        break
-                if not b64 and 'frames' in data and data['frames']:
-                    first = data['frames'][0]
-                    if isinstance(first, (str, bytes)):
-                        b64 = first
-            if isinstance(data, (list, tuple)) and data:
-                for item in data:
-                    if isinstance(item, (str, bytes)):
-                        b64 = item
-                        break
-                    if isinstance(item, dict):
-                        for key in ('b64', 'image', 'img', 'data'):
-                            if item.get(key):
-                                b64 = item.get(key)
-                                break
-                        if b64:
-                            break
-
-            if b64 is None:
-                result['data'] = None
-                done.set()
-                return
-
-            if isinstance(b64, bytes):
-                result['data'] = b64
-                done.set()
-                return
-
-            if isinstance(b64, str) and b64.startswith('data:image'):
-                parts = b64.split(',', 1)
-                if len(parts) == 2:
-                    b64 = parts[1]
-
-            try:
-                result['data'] = base64.b64decode(b64)
-            except Exception:
-                result['data'] = None
-            finally:
-                done.set()
-        except Exception:
-            result['data'] = None
-            done.set()
+        result['data'] = decode_image_event(data)
+        done.set()
 
     try:
         server_url = os.environ.get('IMAGE_SERVER_URL', 'http://localhost:4912')
@@ -165,115 +680,945 @@ def get_image_from_socket(timeout=5):
         return None
 
 
-def send_to_gemini(text, image_bytes, lang="en", audio_bytes=None):
+class FrameSubscriber:
+    """Long-lived socket.io subscriber that keeps the most recent camera frames.
+
+    Frames are decoded once on arrival and kept in a small ring buffer of
+    (timestamp, bytes) tuples, so /llm_vision can take the freshest frame
+    without paying for a connect/handshake/first-frame wait on every request.
+    """
 
+    def __init__(self, server_url, buffer_size=4, reconnect_delay=1.0, max_reconnect_delay=10.0):
+        self.server_url = server_url
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self._frames = collections.deque(maxlen=buffer_size)
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._sio = None
+        self._last_read_ts = 0.0
+        self.connected = False
+        self.frames_received = 0
+        self.frames_dropped = 0
+        self.decode_errors = 0
+        self.reconnects = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="FrameSubscriber", daemon=True)
+        self._thread.start()
+        logger.info(f"Frame subscriber started for {self.server_url}")
+
+    def stop(self):
+        self._stop.set()
+        if self._sio:
+            try:
+                self._sio.disconnect()
+            except Exception:
+                pass
+        with self._cond:
+            self._cond.notify_all()
+
+    def _run(self):
+        delay = self.reconnect_delay
+        while not self._stop.is_set():
+            # Reconnection is ours (backoff + counter): sio.wait() returns as soon as the link drops
+            sio = socketio.Client(logger=False, engineio_logger=False, reconnection=False)
+            sio.on('image', self._on_image)
+            sio.on('connect', self._on_connect)
+            sio.on('disconnect', self._on_disconnect)
+            self._sio = sio
+            try:
+                sio.connect(self.server_url)
+                delay = self.reconnect_delay
+                sio.wait()
+            except Exception as e:
+                logger.warning(f"Frame subscriber connection to {self.server_url} failed: {e}")
+            finally:
+                self.connected = False
+                try:
+                    sio.disconnect()
+                except Exception:
+                    pass
+            if self._stop.wait(delay):
+                break
+            self.reconnects += 1
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def _on_connect(self):
+        self.connected = True
+        logger.info("Frame subscriber connected")
+
+    def _on_disconnect(self, *args):
+        self.connected = False
+        logger.warning("Frame subscriber disconnected")
+
+    def _on_image(self, data):
+        frame = decode_image_event(data)
+        now = time.time()
+        with self._cond:
+            if not frame:
+                self.decode_errors += 1
+                return
+            # A frame that falls off the ring without ever being read was dropped
+            if len(self._frames) == self._frames.maxlen:
+                oldest_ts, _ = self._frames[0]
+                if oldest_ts > self._last_read_ts:
+                    self.frames_dropped += 1
+            self._frames.append((now, frame))
+            self.frames_received += 1
+            self._cond.notify_all()
+
+    def _newest(self, newer_than=None, max_age=None):
+        if not self._frames:
+            return None
+        ts, frame = self._frames[-1]
+        if newer_than is not None and ts <= newer_than:
+            return None
+        if max_age is not None and time.time() - ts > max_age:
+            return None
+        return ts, frame
+
+    def get_frame(self, newer_than=None, max_age=None, timeout=0.0):
+        """Return (timestamp, bytes) of the freshest frame matching the constraints.
+
+        Waits up to `timeout` seconds for a matching frame; returns None if none arrives.
+        """
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                found = self._newest(newer_than, max_age)
+                if found:
+                    self._last_read_ts = max(self._last_read_ts, found[0])
+                    return found
+                remaining = deadline - time.time()
+                if remaining <= 0 or self._stop.is_set():
+                    return None
+                self._cond.wait(remaining)
+
+    def stats(self):
+        with self._cond:
+            last_ts = self._frames[-1][0] if self._frames else None
+            return {
+                'connected': self.connected,
+                'buffered': len(self._frames),
+                'frame_age_sec': round(time.time() - last_ts, 3) if last_ts else None,
+                'frames_received': self.frames_received,
+                'frames_dropped': self.frames_dropped,
+                'decode_errors': self.decode_errors,
+                'reconnects': self.reconnects,
+            }
+
+
+IMAGE_PREPROCESS = os.environ.get('IMAGE_PREPROCESS', '1') != '0'
+IMAGE_MAX_SIDE = int(os.environ.get('IMAGE_MAX_SIDE', '768'))
+IMAGE_JPEG_QUALITY = int(os.environ.get('IMAGE_JPEG_QUALITY', '80'))
+# Longest side for requests that ask for image_detail=low
+IMAGE_LOW_DETAIL_MAX_SIDE = int(os.environ.get('IMAGE_LOW_DETAIL_MAX_SIDE', '384'))
+# Fractions of the frame height cut from the top and bottom; the floor-level horizon band is what matters
+IMAGE_CROP_TOP = float(os.environ.get('IMAGE_CROP_TOP', '0'))
+IMAGE_CROP_BOTTOM = float(os.environ.get('IMAGE_CROP_BOTTOM', '0'))
+IMAGE_STATS = {'frames': 0, 'bytes_in': 0, 'bytes_out': 0, 'ms_total': 0.0, 'last': None}
+IMAGE_STATS_LOCK = threading.Lock()
+
+
+def detect_image_mime(data):
+    if data[:3] == b'\xff\xd8\xff':
+        return 'image/jpeg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    return 'application/octet-stream'
+
+
+def preprocess_image(data, max_side=None):
+    """Crop, downscale and re-encode a camera frame for upload. Returns (bytes, mime type).
+
+    Same input and settings always give the same bytes. Without Pillow, or with
+    IMAGE_PREPROCESS=0, the frame is passed through with its detected mime type.
+    """
+    started = time.time()
+    mime = detect_image_mime(data)
+    out, out_mime, size = data, mime, None
+    if Image is not None and IMAGE_PREPROCESS:
+        try:
+            max_side = max_side or IMAGE_MAX_SIDE
+            img = Image.open(io.BytesIO(data))
+            img.load()
+            width, height = img.size
+            top = int(height * IMAGE_CROP_TOP)
+            bottom = height - int(height * IMAGE_CROP_BOTTOM)
+            changed = False
+            if 0 < bottom - top < height:
+                img = img.crop((0, top, width, bottom))
+                changed = True
+            if max(img.size) > max_side:
+                scale = max_side / float(max(img.size))
+                img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.Resampling.LANCZOS)
+                changed = True
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            buf = io.BytesIO()
+            img.save(buf, format='JPEG', quality=IMAGE_JPEG_QUALITY)
+            size = img.size
+            # Re-encoding an untouched JPEG can make it bigger; keep the original then
+            if changed or mime != 'image/jpeg' or buf.tell() < len(data):
+                out, out_mime = buf.getvalue(), 'image/jpeg'
+        except Exception as e:
+            logger.warning(f"Image preprocessing failed, sending original frame: {e}")
+    elapsed_ms = (time.time() - started) * 1000.0
+    with IMAGE_STATS_LOCK:
+        IMAGE_STATS['frames'] += 1
+        IMAGE_STATS['bytes_in'] += len(data)
+        IMAGE_STATS['bytes_out'] += len(out)
+        IMAGE_STATS['ms_total'] += elapsed_ms
+        IMAGE_STATS['last'] = {'bytes_in': len(data), 'bytes_out': len(out), 'ms': round(elapsed_ms, 2),
+                               'mime_in': mime, 'mime_out': out_mime, 'size': size}
+    logger.info(f"Preprocessed frame {mime} {len(data)} -> {out_mime} {len(out)} bytes {size or ''} in {elapsed_ms:.1f} ms")
+    return out, out_mime
+
+
+def image_dhash(data, size=8):
+    """64-bit difference hash of an encoded image, or None without Pillow."""
+    if Image is None:
+        return None
     try:
-        # Build a prompt that forces a JSON-only response matching the expected schema
-        lang_instruction = ""
-        if lang == 'ru':
-            lang_instruction = "IMPORTANT: The content of the 'speak' field MUST be in RUSSIAN language."
-        elif lang == 'cz' or lang == 'cs':
-            lang_instruction = "IMPORTANT: The content of the 'speak' field MUST be in CZECH language."
-        else:
-            lang_instruction = "IMPORTANT: The content of the 'speak' field MUST be in ENGLISH language."
-
-        schema_instructions = (
-            "You are 'AGI Robot', a highly intelligent, curious, and helpful autonomous mobile assistant. "
-            "PHYSICAL SPECS: Two wheels (differential drive), NO arms or head. Dimensions: 24cm(W) x 12cm(L) x 10cm(H). "
-            "You move ONLY on flat floors. Your WebCam is on your roof, looking forward. "
-            "INPUTS: 1. Visual image from camera. 2. Ultrasonic distance reading (cm). 3. Main Goal. 4. Movement history. 5. User audio response. "
-            "OBJECTIVE: Assist your master human, achieve your goals, and maintain a helpful, friendly, yet robotic persona.\n\n"
-            "BEHAVIOR RULES:\n"
-            "1. SAFETY FIRST: Maintain a safety buffer. If 'distance' < 25 cm, you ARE BLOCKED. You MUST STOP and move 'back' or 'turn' to find a clear path. Do NOT attempt to move 'forward' if blocked.\n"
-            "2. SYSTEMATIC SCANNING: To find an object or orient yourself, perform a scanning sequence (e.g., turn 30° left, wait, turn 60° right). Once a target is spotted, center it in your vision before advancing.\n"
-            "3. INTERACTIVE INTELLIGENCE: If the user provides audio input, analyze it carefully and respond. If you are uncertain about a goal or see something interesting, ASK the user for clarification. Use 'speak' to communicate your intent.\n"
-            "4. MOOD & EXPRESSION: Use the 'rgb' LED to signal your internal state. Align your color with your current action or mood. Be proactive in updating your mood.\n"
-            "5. LOGICAL PLANNING: Use 'plan' to explain your long-term strategy and what you see in the image. Use 'subplan' for the immediate tactical moves (e.g., 'Moving forward carefully', 'Turning to avoid the chair').\n"
-            "6. SPATIAL AWARENESS: Maintain a 2D text-based map (1 block = 1x1 meter). Mark yourself (R), walls (W), obstacles (O), paths (P), and targets (T). Update the map based on your movement history and visual observations.\n"
-            "7. CONTINUOUS LEARNING: Use 'memory' to store important facts (e.g., 'The kitchen is to the left', 'The master's name is Max'). This data persists across all sessions. Update it whenever you learn something significant.\n\n"
-            "RESPONSE FORMAT:\n"
-            "Return ONLY a single valid JSON object (no markdown, no extra text) with these exact keys:\n"
-            f"- speak: {{\"text\": \"...\"}} or null (concise, robotic but friendly speech. {lang_instruction})\n"
-            "- sound: \"casual\" or null (to attract attention or signal small success)\n"
-            "- move: {{\"command\": \"forward\"|\"back\"|\"left\"|\"right\"|\"stop\", \"distance_cm\": int (20-100), \"angle_deg\": int (15-180)}} or null\n"
-            "- rgb: \"R,G,B\" string. MANDATORY. Use this mood logic:\n"
-            "  - \"255,255,255\" (White): NEUTRAL / READY\n"
-            "  - \"0,255,0\" (Green): HAPPY / SUCCESS / TARGET REACHED\n"
-            "  - \"255,0,0\" (Red): BLOCKED / FRUSTRATED / STUCK\n"
-            "  - \"0,0,255\" (Blue): THINKING / ANALYZING / PROCESSING\n"
-            "  - \"255,255,0\" (Yellow): CURIOUS / SEARCHING / SCANNING\n"
-            "  - \"255,165,0\" (Orange): CAUTIOUS / OBSTACLE NEARBY\n"
-            "  - \"128,0,128\" (Purple): EXCITED / SPECIAL DISCOVERY\n"
-            "- plan: string (High-level reasoning, visual summary, and strategic goal status)\n"
-            "- subplan: string (Tactical implementation of the current move)\n"
-            "- map: string (Text-based 2D map with legend)\n"
-            "- memory: string (Persistent information to save forever)\n"
-        )
-        
-        current_time_str = datetime.now().astimezone().strftime("%Y-%m-%d %H:%M:%S %z (%Z)")
-        prompt_text = f"CURRENT TIME: {current_time_str}\n\n{schema_instructions}\n\nInput context:\n{text}"
+        img = Image.open(io.BytesIO(data))
+        img.draft('L', (size * 8, size * 8))
+        img = img.convert('L').resize((size + 1, size), Image.Resampling.BILINEAR)
+        px = img.tobytes()
+        bits = 0
+        for row in range(size):
+            base = row * (size + 1)
+            for col in range(size):
+                bits = (bits << 1) | (px[base + col] > px[base + col + 1])
+        return bits
+    except Exception as e:
+        logger.warning(f"Could not hash frame: {e}")
+        return None
 
-        init_llm()
-        if not LLM_CLIENT:
-            raise Exception('LLM_CLIENT is not initialized')
 
-        logger.info(f'Sending text+image+audio to Gemini model (lang={lang})...')
-        
-        contents = [
-            types.Content(
-                role="user",
-                parts=[
-                    types.Part.from_text(text=prompt_text),
-                ]
+class DecisionCache:
+    """Reuses recent LLM decisions when the robot sees the same scene in the same situation.
+
+    Entries are grouped by (quantized distance, last executed move, main goal,
+    language, audio present) and matched on the perceptual hash of the frame
+    within `threshold` differing bits. A hit returns the stored reply without its
+    memory_ops ('replay') or, when the stored decision was itself to stop, a
+    cheap stop-and-keep-mood reply ('hold') instead of calling the model. In 'hold' mode a stored decision
+    to move is not reused, so the robot is never frozen by a look-alike scene.
+    """
+
+    def __init__(self, max_entries=32, ttl=20.0, threshold=6, bucket_cm=10, mode='hold'):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.bucket_cm = bucket_cm
+        self.mode = mode
+        self._entries = collections.OrderedDict()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_sec = 0.0
+
+    def make_key(self, image_bytes, payload, has_audio):
+        """Cache key for a request, or None when the request must always reach the model."""
+        if has_audio or payload.get('prompt') or not image_bytes:
+            with self._lock:
+                self.bypassed += 1
+            return None
+        image_hash = image_dhash(image_bytes)
+        if image_hash is None:
+            return None
+        try:
+            bucket = int(float(payload.get('distance')) // self.bucket_cm)
+        except (TypeError, ValueError):
+            bucket = None
+        history = payload.get('movement_history') or []
+        # "forward 20cm x3" -> "forward 20cm": the run count changes on every repeat
+        last_move = str(history[-1]).rsplit(' x', 1)[0] if history else None
+        group = (bucket, last_move, payload.get('main_goal', ''), payload.get('lang', 'en'), has_audio)
+        return group, image_hash
+
+    def lookup(self, key):
+        if key is None:
+            return None
+        group, image_hash = key
+        now = time.time()
+        with self._lock:
+            for entry_id in reversed(list(self._entries)):
+                entry = self._entries[entry_id]
+                if now - entry['time'] > self.ttl:
+                    del self._entries[entry_id]
+                    continue
+                if entry['group'] == group and (entry['hash'] ^ image_hash).bit_count() <= self.threshold:
+                    if self.mode != 'replay' and (entry['response'].get('move') or {}).get('command') != 'stop':
+                        break
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    self.saved_sec += entry['llm_sec']
+                    return self._reply_for(entry['response'])
+            self.misses += 1
+        return None
+
+    def _reply_for(self, response):
+        if self.mode == 'replay':
+            reply = json.loads(json.dumps(response))
+            # The facts were stored when the reply was new; applying them again would duplicate them
+            reply['memory_ops'] = []
+            return reply
+        return {'move': {'command': 'stop'}, 'rgb': response.get('rgb'), 'speak': None, 'sound': None}
+
+    def store(self, key, response, llm_sec):
+        if key is None or not isinstance(response, dict):
+            return
+        group, image_hash = key
+        with self._lock:
+            self._entries[next(self._ids)] = {'group': group, 'hash': image_hash, 'response': response,
+                                              'time': time.time(), 'llm_sec': llm_sec}
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'mode': self.mode,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'saved_sec': round(self.saved_sec, 2),
+            }
+
+
+DECISION_CACHE = DecisionCache(
+    max_entries=int(os.environ.get('DECISION_CACHE_SIZE', '32')),
+    ttl=float(os.environ.get('DECISION_CACHE_TTL_SEC', '20')),
+    threshold=int(os.environ.get('DECISION_CACHE_THRESHOLD', '6')),
+    bucket_cm=float(os.environ.get('DECISION_CACHE_BUCKET_CM', '10')),
+    mode=os.environ.get('DECISION_CACHE_MODE', 'hold'),
+) if os.environ.get('DECISION_CACHE', '1') != '0' else None
+
+
+def cached_decision(request, payload):
+    """Return (cache key, cached reply or None) for a prepared /llm_vision request."""
+    if DECISION_CACHE is None:
+        return None, None
+    key = DECISION_CACHE.make_key(request['image_bytes'], payload, bool(request.get('audio_bytes')))
+    cached = DECISION_CACHE.lookup(key)
+    if cached is not None:
+        logger.info(f"Decision cache hit ({DECISION_CACHE.mode}), skipping Gemini call")
+    return key, cached
+
+
+def remember_decision(key, response, llm_sec):
+    if DECISION_CACHE is not None:
+        DECISION_CACHE.store(key, response, llm_sec)
+
+
+IMAGE_SERVER_URL = os.environ.get('IMAGE_SERVER_URL', 'http://localhost:4912')
+FRAME_BUFFER_SIZE = int(os.environ.get('FRAME_BUFFER_SIZE', '4'))
+FRAME_MAX_AGE = float(os.environ.get('FRAME_MAX_AGE', '2.0'))
+FRAME_SUBSCRIBER = None
+
+
+def start_frame_subscriber():
+    global FRAME_SUBSCRIBER
+    if FRAME_SUBSCRIBER is None:
+        FRAME_SUBSCRIBER = FrameSubscriber(IMAGE_SERVER_URL, buffer_size=FRAME_BUFFER_SIZE)
+    FRAME_SUBSCRIBER.start()
+    return FRAME_SUBSCRIBER
+
+
+def get_latest_image(newer_than=None, timeout=5):
+    """Freshest camera frame: from the background subscriber if running, else a one-shot connection."""
+    if FRAME_SUBSCRIBER is not None:
+        found = FRAME_SUBSCRIBER.get_frame(newer_than=newer_than, max_age=FRAME_MAX_AGE, timeout=timeout)
+        if found:
+            ts, frame = found
+            logger.info(f"Using buffered frame, age {time.time() - ts:.3f}s, size {len(frame)} bytes")
+            return frame
+        if FRAME_SUBSCRIBER.connected:
+            logger.warning("No fresh frame from subscriber within timeout")
+            return None
+        logger.warning("Frame subscriber not connected, falling back to one-shot socket connection")
+    return get_image_from_socket(timeout=timeout)
+
+
+# Keys the robot can act on right away; the model is asked to emit them first
+EARLY_RESPONSE_KEYS = ('move', 'rgb', 'speak', 'sound')
+GEMINI_MODEL = "gemini-3-flash-preview" ## "gemini-3-flash-preview", ##"gemini-robotics-er-1.5-preview",
+
+# Generation settings from slowest/best to fastest; a call that is about to miss its
+# deadline is hedged with the next tier down
+GEMINI_TIERS = collections.OrderedDict([
+    ('full', {'thinking_budget': 16000, 'search': True, 'temperature': 1.3}),
+    ('fast', {'thinking_budget': 1024, 'search': False, 'temperature': 1.0}),
+    ('minimal', {'thinking_budget': 128, 'search': False, 'temperature': 0.7}),
+])
+
+
+def _policy_entry(context, default):
+    tier, _, deadline = os.environ.get(f'LLM_POLICY_{context.upper()}', default).partition(':')
+    return tier, float(deadline)
+
+
+# Starting tier and latency deadline in seconds per request context
+LLM_POLICY = {
+    'audio': _policy_entry('audio', 'full:15'),
+    'blocked': _policy_entry('blocked', 'minimal:4'),
+    'routine': _policy_entry('routine', 'fast:8'),
+}
+LLM_BLOCKED_CM = float(os.environ.get('LLM_BLOCKED_CM', '25'))
+# Start the hedge request once this fraction of the deadline has passed (>= 1 disables hedging)
+LLM_HEDGE_AFTER = float(os.environ.get('LLM_HEDGE_AFTER', '0.6'))
+# Give up entirely after this long; stays below the client's 55 s timeout
+LLM_HARD_TIMEOUT = float(os.environ.get('LLM_HARD_TIMEOUT', '50'))
+LLM_CONCURRENCY = int(os.environ.get('LLM_CONCURRENCY', '3'))
+# Every admitted request may run one attempt per tier, and losing attempts keep their worker until
+# Gemini answers; two spare workers let a new request start while old attempts drain
+LLM_WORKERS = int(os.environ.get('LLM_WORKERS', str(LLM_CONCURRENCY * len(GEMINI_TIERS) + 2)))
+LLM_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix='gemini')
+# How often a hedge that found no free worker looks again
+LLM_HEDGE_RETRY_SEC = 0.25
+LLM_TIER_STATS = {'calls': collections.Counter(), 'wins': collections.Counter(), 'failures': collections.Counter(),
+                  'hedges': 0, 'hedges_skipped': 0, 'fallbacks': 0, 'deadline_missed': 0, 'wasted': 0,
+                  'in_flight': 0}
+LLM_TIER_STATS_LOCK = threading.Lock()
+
+
+class IncrementalJSONObject:
+    """Scans a JSON object as it streams in and reports each top-level member once it is complete.
+
+    Text before the opening brace (e.g. a markdown fence) is ignored. Members
+    that fail to parse are skipped; the caller can still fall back to parsing
+    the full text at the end.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self.fields = {}
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+
+    def feed(self, chunk):
+        """Add streamed text; returns a list of (key, value) members completed by it."""
+        self.text += chunk
+        completed = []
+        text = self.text
+        i = self._pos
+        while i < len(text) and not self.done:
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif self._depth == 0:
+                if ch == '{':
+                    self._depth = 1
+                    self._member_start = i + 1
+            elif ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._emit(text[self._member_start:i], completed)
+                    self.done = True
+            elif ch == ',' and self._depth == 1:
+                self._emit(text[self._member_start:i], completed)
+                self._member_start = i + 1
+            i += 1
+        self._pos = i
+        return completed
+
+    def _emit(self, member, completed):
+        member = member.strip()
+        if not member:
+            return
+        try:
+            parsed = json.loads('{' + member + '}')
+        except Exception:
+            logger.debug(f"Skipping unparsable streamed member: {member[:80]}")
+            return
+        for key, value in parsed.items():
+            self.fields[key] = value
+            completed.append((key, value))
+
+
+SYSTEM_INSTRUCTIONS = {}
+CACHED_CONTEXTS = {}
+CACHED_CONTEXTS_LOCK = threading.Lock()
+GEMINI_CONTEXT_CACHE = os.environ.get('GEMINI_CONTEXT_CACHE', '1') != '0'
+GEMINI_CACHE_TTL_SEC = int(os.environ.get('GEMINI_CACHE_TTL_SEC', '3600'))
+# After a failed cache create, wait this long before the next try, doubling up to the max
+GEMINI_CACHE_RETRY_SEC = float(os.environ.get('GEMINI_CACHE_RETRY_SEC', '30'))
+GEMINI_CACHE_RETRY_MAX_SEC = 600.0
+# Constrain replies to robot_schema.RESPONSE_SCHEMA as JSON
+GEMINI_RESPONSE_SCHEMA = os.environ.get('GEMINI_RESPONSE_SCHEMA', '1') != '0'
+
+# Per-stage timing of /llm_vision and /speak, merged with the spans main.py posts to /trace
+TRACER = Tracer('media', keep_cycles=int(os.environ.get('TRACE_KEEP_CYCLES', '20')),
+                enabled=os.environ.get('TRACING', '1') != '0')
+
+
+def normalize_lang(lang):
+    if lang == 'cs':
+        return 'cz'
+    return lang if lang in ('en', 'ru', 'cz') else 'en'
+
+
+def build_system_instruction(lang):
+    # Static persona, rules and a schema that forces a JSON-only response
+    lang_instruction = ""
+    if lang == 'ru':
+        lang_instruction = "IMPORTANT: The content of the 'speak' field MUST be in RUSSIAN language."
+    elif lang == 'cz' or lang == 'cs':
+        lang_instruction = "IMPORTANT: The content of the 'speak' field MUST be in CZECH language."
+    else:
+        lang_instruction = "IMPORTANT: The content of the 'speak' field MUST be in ENGLISH language."
+
+    schema_instructions = (
+        "You are 'AGI Robot', a highly intelligent, curious, and helpful autonomous mobile assistant. "
+        "PHYSICAL SPECS: Two wheels (differential drive), NO arms or head. Dimensions: 24cm(W) x 12cm(L) x 10cm(H). "
+        "You move ONLY on flat floors. Your WebCam is on your roof, looking forward. "
+        "INPUTS: 1. Visual image from camera. 2. Ultrasonic distance reading (cm). 3. Main Goal. 4. Movement history. 5. User audio response. "
+        "OBJECTIVE: Assist your master human, achieve your goals, and maintain a helpful, friendly, yet robotic persona.\n\n"
+        "BEHAVIOR RULES:\n"
+        "1. SAFETY FIRST: Maintain a safety buffer. If 'distance' < 25 cm, you ARE BLOCKED. You MUST STOP and move 'back' or 'turn' to find a clear path. Do NOT attempt to move 'forward' if blocked.\n"
+        "2. SYSTEMATIC SCANNING: To find an object or orient yourself, perform a scanning sequence (e.g., turn 30° left, wait, turn 60° right). Once a target is spotted, center it in your vision before advancing.\n"
+        "3. INTERACTIVE INTELLIGENCE: If the user provides audio input, analyze it carefully and respond. If you are uncertain about a goal or see something interesting, ASK the user for clarification. Use 'speak' to communicate your intent.\n"
+        "4. MOOD & EXPRESSION: Use the 'rgb' LED to signal your internal state. Align your color with your current action or mood. Be proactive in updating your mood.\n"
+        "5. LOGICAL PLANNING: Use 'plan' to explain your long-term strategy and what you see in the image. Use 'subplan' for the immediate tactical moves (e.g., 'Moving forward carefully', 'Turning to avoid the chair').\n"
+        "6. SPATIAL AWARENESS: You receive a local occupancy grid built from your odometry and distance sensor (# obstacle, . free, ? unknown, the arrow is you and your heading). Use it with the image to avoid known obstacles and explore unknown areas; you do not write the map yourself.\n"
+        "7. CONTINUOUS LEARNING: Use 'memory_ops' to store important facts (e.g., 'The kitchen is to the left', 'The master's name is Max'). Facts persist across all sessions; the relevant ones are listed under Permanent Memory as 'key: value'. Emit ONLY changes: add a new fact, update or delete an existing key. Return [] when nothing new was learned.\n\n"
+        "RESPONSE FORMAT:\n"
+        "Return ONLY a single valid JSON object (no markdown, no extra text) with these exact keys, in this order:\n"
+        "- move: {\"command\": \"forward\"|\"back\"|\"left\"|\"right\"|\"stop\", \"distance_cm\": int (20-100), \"angle_deg\": int (15-180)}, always present; use {\"command\": \"stop\"} to stay in place\n"
+        "- rgb: \"R,G,B\" string. MANDATORY. Use this mood logic:\n"
+        "  - \"255,255,255\" (White): NEUTRAL / READY\n"
+        "  - \"0,255,0\" (Green): HAPPY / SUCCESS / TARGET REACHED\n"
+        "  - \"255,0,0\" (Red): BLOCKED / FRUSTRATED / STUCK\n"
+        "  - \"0,0,255\" (Blue): THINKING / ANALYZING / PROCESSING\n"
+        "  - \"255,255,0\" (Yellow): CURIOUS / SEARCHING / SCANNING\n"
+        "  - \"255,165,0\" (Orange): CAUTIOUS / OBSTACLE NEARBY\n"
+        "  - \"128,0,128\" (Purple): EXCITED / SPECIAL DISCOVERY\n"
+        f"- speak: {{\"text\": \"...\"}} or null (concise, robotic but friendly speech. {lang_instruction})\n"
+        "- sound: \"casual\" or null (to attract attention or signal small success)\n"
+        "- subplan: string (Tactical implementation of the current move)\n"
+        "- plan: string (High-level reasoning, visual summary, and strategic goal status)\n"
+        "- memory_ops: [{\"op\": \"add\"|\"update\"|\"delete\", \"key\": \"short_snake_case_id\", \"value\": \"fact\"}] (changes to persistent memory, [] if none; value not needed for delete)\n"
+    )
+    return schema_instructions
+
+
+def compile_system_instructions():
+    for lang in ('en', 'ru', 'cz'):
+        SYSTEM_INSTRUCTIONS[lang] = build_system_instruction(lang)
+    logger.info(f"Compiled system instructions: { {lang: len(text) for lang, text in SYSTEM_INSTRUCTIONS.items()} }")
+
+
+def get_system_instruction(lang):
+    lang = normalize_lang(lang)
+    if lang not in SYSTEM_INSTRUCTIONS:
+        SYSTEM_INSTRUCTIONS[lang] = build_system_instruction(lang)
+    return SYSTEM_INSTRUCTIONS[lang]
+
+
+def gemini_tools():
+    return [types.Tool(google_search=types.GoogleSearchRetrieval())]
+
+
+def get_cached_context(lang, model, search=True):
+    """Name of a model-side cached context holding the system instruction and tools, or None.
+
+    The cache is created once per (model, language, search tool) and refreshed shortly before its TTL runs
+    out. The create call runs outside CACHED_CONTEXTS_LOCK; while one thread creates or
+    refreshes a cache, other requests use the previous cache if it is still alive, or send
+    the system instruction inline. If the API says the instruction is below the model's
+    minimum cacheable size, caching is switched off for that key. Other errors (network,
+    5xx, quota) are retried after a backoff.
+    """
+    if not GEMINI_CONTEXT_CACHE:
+        return None
+    key = (model, normalize_lang(lang), search)
+    now = time.time()
+    with CACHED_CONTEXTS_LOCK:
+        entry = CACHED_CONTEXTS.setdefault(key, {'name': None, 'expires': 0, 'disabled': False, 'creating': False,
+                                                 'retry_at': 0, 'failures': 0})
+        alive = entry['name'] if now < entry['expires'] else None
+        if entry['disabled'] or entry['creating'] or now < entry['retry_at'] or (alive and now < entry['expires'] - 60):
+            return alive
+        entry['creating'] = True
+    try:
+        cache = LLM_CLIENT.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                display_name=f"agi-robot-{key[1]}" + ("" if search else "-nosearch"),
+                system_instruction=get_system_instruction(lang),
+                tools=gemini_tools() if search else None,
+                ttl=f"{GEMINI_CACHE_TTL_SEC}s",
             )
-        ]
-        
-        if image_bytes:
-             contents[0].parts.append(types.Part.from_bytes(data=image_bytes, mime_type="image/jpeg"))
-        
-        if audio_bytes:
-             contents[0].parts.append(types.Part.from_bytes(data=audio_bytes, mime_type="audio/wav"))
-             logger.info(f"Including audio in Gemini request, size: {len(audio_bytes)} bytes")
-       
+        )
+    except Exception as e:
+        with CACHED_CONTEXTS_LOCK:
+            entry['creating'] = False
+            if any(hint in str(e).lower() for hint in ('too small', 'min_total_token_count', 'minimum')):
+                entry['disabled'] = True
+                logger.warning(f"Gemini context caching unavailable for {key}, sending system instruction inline: {e}")
+            else:
+                delay = min(GEMINI_CACHE_RETRY_SEC * 2 ** entry['failures'], GEMINI_CACHE_RETRY_MAX_SEC)
+                entry['failures'] += 1
+                entry['retry_at'] = time.time() + delay
+                logger.warning(f"Could not create Gemini context cache for {key}, retrying in {delay:.0f}s: {e}")
+        return alive
+    with CACHED_CONTEXTS_LOCK:
+        entry.update(name=cache.name, expires=time.time() + GEMINI_CACHE_TTL_SEC, creating=False, retry_at=0, failures=0)
+    logger.info(f"Created Gemini context cache {cache.name} for {key}")
+    return cache.name
+
+
+def build_gemini_request(text, image_bytes, lang="en", audio_bytes=None, model=None, image_mime="image/jpeg", tier='full'):
+    # Only the dynamic state report, image and audio are built per call
+    current_time_str = datetime.now().astimezone().strftime("%Y-%m-%d %H:%M:%S %z (%Z)")
+    prompt_text = f"CURRENT TIME: {current_time_str}\n\nInput context:\n{text}"
+
+    init_llm()
+    if not LLM_CLIENT:
+        raise Exception('LLM_CLIENT is not initialized')
+
+    logger.info(f'Sending text+image+audio to Gemini model (lang={lang})...')
+    
+    contents = [
+        types.Content(
+            role="user",
+            parts=[
+                types.Part.from_text(text=prompt_text),
+            ]
+        )
+    ]
+    
+    if image_bytes:
+         contents[0].parts.append(types.Part.from_bytes(data=image_bytes, mime_type=image_mime))
+    
+    if audio_bytes:
+         contents[0].parts.append(types.Part.from_bytes(data=audio_bytes, mime_type="audio/wav"))
+         logger.info(f"Including audio in Gemini request, size: {len(audio_bytes)} bytes")
+
+    settings = GEMINI_TIERS[tier]
+    thinking_config = types.ThinkingConfig(include_thoughts=False, thinking_budget=settings['thinking_budget'])
+    output_config = {}
+    if GEMINI_RESPONSE_SCHEMA:
+        output_config = {'response_mime_type': 'application/json', 'response_schema': robot_schema.RESPONSE_SCHEMA}
+    cached_content = get_cached_context(lang, model or GEMINI_MODEL, search=settings['search'])
+    if cached_content:
+        generate_content_config = types.GenerateContentConfig(
+            temperature = settings['temperature'],
+            cached_content = cached_content,
+            thinking_config = thinking_config,
+            **output_config
+        )
+    else:
         generate_content_config = types.GenerateContentConfig(
-            temperature = 1.3,
-            tools = [types.Tool(google_search=types.GoogleSearchRetrieval())],
-            thinking_config = types.ThinkingConfig(include_thoughts=False, thinking_budget=16000)
+            temperature = settings['temperature'],
+            system_instruction = get_system_instruction(lang),
+            tools = gemini_tools() if settings['search'] else None,
+            thinking_config = thinking_config,
+            **output_config
         )
 
+    return contents, generate_content_config
+
+
+def parse_gemini_text(response_text):
+    """Validated reply dict; raises robot_schema.MalformedReply so the next tier can answer."""
+    return robot_schema.parse_reply(response_text).to_dict()
+
+
+def send_to_gemini(text, image_bytes, lang="en", audio_bytes=None, image_mime="image/jpeg", tier='full'):
+
+    try:
+        contents, generate_content_config = build_gemini_request(text, image_bytes, lang, audio_bytes, image_mime=image_mime, tier=tier)
+
         response = LLM_CLIENT.models.generate_content(
-            model = "gemini-3-flash-preview", ## "gemini-3-flash-preview", ##"gemini-robotics-er-1.5-preview", 
+            model = GEMINI_MODEL,
             contents = contents,
             config = generate_content_config
         )
         
         response_text = response.text if hasattr(response, 'text') else str(response)
+        return parse_gemini_text(response_text)
 
-        # Try to parse JSON and return parsed object if valid (same logic as before)
-        try:
-            return json.loads(response_text)
-        except Exception:
-            try:
-                val = ast.literal_eval(response_text)
-                if isinstance(val, (dict, list)):
-                    return val
-            except Exception:
-                pass
+    except Exception as e:
+        logger.error(f"Failed to call Gemini API: {e}", exc_info=True)
+        raise
 
-            m = re.search(r"\{[\s\S]*\}", response_text)
-            if m:
-                try:
-                    return json.loads(m.group(0))
-                except Exception:
-                    pass
 
-        raise Exception('Gemini returned non-JSON or unparsable response')
+def send_to_gemini_stream(text, image_bytes, lang="en", audio_bytes=None, image_mime="image/jpeg", on_early=None, tier='full'):
+    """Like send_to_gemini, but streams the reply and calls on_early(fields) as soon as
+    the actionable keys (EARLY_RESPONSE_KEYS) are complete, before plan/memory_ops arrive.
+    Returns the full parsed object.
+    """
+    try:
+        contents, generate_content_config = build_gemini_request(text, image_bytes, lang, audio_bytes, image_mime=image_mime, tier=tier)
+
+        started = time.time()
+        early_sent = False
+        parser = IncrementalJSONObject()
+        stream = LLM_CLIENT.models.generate_content_stream(
+            model = GEMINI_MODEL,
+            contents = contents,
+            config = generate_content_config
+        )
+        for chunk in stream:
+            chunk_text = getattr(chunk, 'text', None)
+            if not chunk_text:
+                continue
+            for key, _ in parser.feed(chunk_text):
+                if early_sent:
+                    continue
+                if key not in EARLY_RESPONSE_KEYS or all(k in parser.fields for k in EARLY_RESPONSE_KEYS):
+                    early_sent = True
+                    early = robot_schema.parse_fields(
+                        {k: parser.fields[k] for k in EARLY_RESPONSE_KEYS if k in parser.fields}).to_dict(skip_empty=True)
+                    logger.info(f"Gemini time-to-move: {time.time() - started:.2f}s (keys: {list(early)})")
+                    if on_early:
+                        on_early(early)
+
+        result = parse_gemini_text(parser.fields if parser.done else parser.text)
+        logger.info(f"Gemini time-to-complete: {time.time() - started:.2f}s")
+        return result
 
     except Exception as e:
-        logger.error(f"Failed to call Gemini API: {e}", exc_info=True)
+        logger.error(f"Failed to call Gemini API (stream): {e}", exc_info=True)
         raise
 
 
+def llm_policy(payload, request):
+    """(context, starting tier, deadline seconds) for a /llm_vision request."""
+    if request.get('audio_bytes'):
+        context = 'audio'
+    else:
+        try:
+            blocked = 0 < float(payload.get('distance')) < LLM_BLOCKED_CM
+        except (TypeError, ValueError):
+            blocked = False
+        context = 'blocked' if blocked else 'routine'
+    tier, deadline = LLM_POLICY[context]
+    if payload.get('tier') in GEMINI_TIERS:
+        tier = payload['tier']
+    if payload.get('deadline_sec'):
+        deadline = float(payload['deadline_sec'])
+    return context, tier, deadline
+
+
+class TierRace:
+    """Decides which of the concurrent attempts of one request gets to answer.
+
+    In stream mode the early fields already sent to the client are kept in `early`:
+    they are sent once per request, even when the attempt that sent them fails later.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.winner = None
+        self.early = None
+
+    @property
+    def answered(self):
+        """True once the client has something to act on."""
+        return self.winner is not None or self.early is not None
+
+    def claim(self, tier):
+        with self._lock:
+            if self.winner is None:
+                self.winner = tier
+            return self.winner == tier
+
+    def claim_early(self, tier, fields):
+        """Claim the race for an attempt's early fields; False if early fields were already sent."""
+        with self._lock:
+            if self.early is not None:
+                return False
+            if self.winner is None:
+                self.winner = tier
+            if self.winner != tier:
+                return False
+            self.early = fields
+            return True
+
+    def reconcile(self, result):
+        """The final reply, with the actionable keys the client already received in early fields."""
+        if self.early is None or not isinstance(result, dict):
+            return result
+        return dict(result, **{key: self.early.get(key) for key in EARLY_RESPONSE_KEYS})
+
+    def release(self, tier):
+        with self._lock:
+            if self.winner == tier:
+                self.winner = None
+
+
+def _count(key, tier=None):
+    with LLM_TIER_STATS_LOCK:
+        if tier is None:
+            LLM_TIER_STATS[key] += 1
+        else:
+            LLM_TIER_STATS[key][tier] += 1
+
+
+def run_with_deadline(attempt, start_tier, deadline, received=None, race=None):
+    """Call attempt(tier, race) for start_tier and hedge with cheaper tiers when it runs late.
+
+    The deadline counts from `received` (when the request arrived, so time spent queued
+    for the llm lane and fetching the frame is included), or from now. After
+    LLM_HEDGE_AFTER * deadline (or as soon as an attempt fails) the next tier is started
+    alongside, unless every LLM_EXECUTOR worker is taken; the first attempt to claim the
+    race answers. Once the race has a winner (in stream mode: once early fields were sent)
+    the deadline counts as met and no hedge is started. Attempts that lose keep running
+    in the background and their results are dropped.
+    """
+    tiers = list(GEMINI_TIERS)[list(GEMINI_TIERS).index(start_tier):]
+    race = race or TierRace()
+    started = received or time.time()
+    hedge_at = started + deadline * LLM_HEDGE_AFTER
+    hedge_skipped = False
+    futures = {}
+    results = {}
+    errors = []
+    missed = False
+
+    def tracked(tier, race):
+        try:
+            return attempt(tier, race)
+        finally:
+            with LLM_TIER_STATS_LOCK:
+                LLM_TIER_STATS['in_flight'] -= 1
+
+    def launch(tier, why):
+        _count('calls', tier)
+        if why:
+            _count(why)
+            logger.info(f"Starting {tier} tier Gemini call ({why}) after {time.time() - started:.2f}s")
+        with LLM_TIER_STATS_LOCK:
+            LLM_TIER_STATS['in_flight'] += 1
+        futures[LLM_EXECUTOR.submit(tracked, tier, race)] = tier
+
+    launch(tiers.pop(0), None)
+    try:
+        while True:
+            now = time.time()
+            if not missed and not race.answered and now > started + deadline:
+                missed = True
+                _count('deadline_missed')
+                logger.warning(f"Gemini deadline of {deadline:.1f}s missed")
+            pending = [f for f in futures if not f.done()]
+            if not pending and not tiers:
+                raise errors[-1] if errors else Exception('No Gemini attempt returned a result')
+            if not pending:
+                launch(tiers.pop(0), 'fallbacks')
+                continue
+            if now >= started + LLM_HARD_TIMEOUT:
+                raise TimeoutError(f"No Gemini reply within {LLM_HARD_TIMEOUT:.0f}s")
+            wake = started + LLM_HARD_TIMEOUT
+            if tiers and LLM_HEDGE_AFTER < 1 and len(pending) == 1 and not race.answered:
+                if now >= hedge_at:
+                    with LLM_TIER_STATS_LOCK:
+                        worker_free = LLM_TIER_STATS['in_flight'] < LLM_WORKERS
+                    if worker_free:
+                        launch(tiers.pop(0), 'hedges')
+                        continue
+                    # A queued hedge would only start once some other call finishes
+                    if not hedge_skipped:
+                        hedge_skipped = True
+                        _count('hedges_skipped')
+                        logger.warning(f"No free Gemini worker for a hedge ({LLM_WORKERS} busy)")
+                    hedge_at = now + LLM_HEDGE_RETRY_SEC
+                wake = min(wake, hedge_at)
+            if not missed and not race.answered:
+                wake = min(wake, started + deadline)
+            done, _ = concurrent.futures.wait(pending, timeout=max(0.0, wake - now),
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                tier = futures[future]
+                try:
+                    results[tier] = future.result()
+                except Exception as e:
+                    _count('failures', tier)
+                    errors.append(e)
+                    race.release(tier)
+                    logger.warning(f"Gemini {tier} tier failed: {e}")
+            for tier, result in list(results.items()):
+                if race.claim(tier):
+                    _count('wins', tier)
+                    logger.info(f"Gemini {tier} tier answered in {time.time() - started:.2f}s")
+                    return result
+    finally:
+        # Attempts launched for this request whose answer is not used
+        with LLM_TIER_STATS_LOCK:
+            LLM_TIER_STATS['wasted'] += len(futures) - (1 if race.winner in futures.values() else 0)
+
+
+def call_gemini(request, payload, received=None):
+    context, tier, deadline = llm_policy(payload, request)
+    logger.info(f"Gemini policy: {context} -> {tier} tier, {deadline:.1f}s deadline")
+    cycle_id = TRACER.current_cycle()
+
+    def attempt(tier, race):
+        with TRACER.span(f'gemini_{tier}', cycle_id):
+            return send_to_gemini(**request, tier=tier)
+
+    return run_with_deadline(attempt, tier, deadline, received)
+
+
+def call_gemini_stream(request, payload, on_early=None, received=None):
+    """Streaming variant: the first attempt to produce its early fields wins the race.
+
+    If that attempt fails afterwards, a fallback tier completes the reply, but its early
+    fields are not sent and its final reply keeps the ones the robot already acted on.
+    """
+    context, tier, deadline = llm_policy(payload, request)
+    logger.info(f"Gemini policy (stream): {context} -> {tier} tier, {deadline:.1f}s deadline")
+    cycle_id = TRACER.current_cycle()
+
+    def attempt(tier, race):
+        def early(fields):
+            if race.claim_early(tier, fields) and on_early:
+                on_early(fields)
+        with TRACER.span(f'gemini_{tier}', cycle_id):
+            return send_to_gemini_stream(**request, on_early=early, tier=tier)
+
+    race = TierRace()
+    return race.reconcile(run_with_deadline(attempt, tier, deadline, received, race))
+
+
+def llm_tier_stats():
+    with LLM_TIER_STATS_LOCK:
+        stats = {key: dict(value) if isinstance(value, collections.Counter) else value
+                 for key, value in LLM_TIER_STATS.items()}
+    stats['replies'] = robot_schema.stats()
+    stats['policy'] = {context: {'tier': tier, 'deadline_sec': deadline} for context, (tier, deadline) in LLM_POLICY.items()}
+    return stats
+
+
 def normalize_response_object(response_text):
     if isinstance(response_text, bytes):
         return response_text
@@ -281,198 +1626,465 @@ def normalize_response_object(response_text):
         return json.dumps(response_text).encode('utf-8')
 
 
+# Per-section prompt budgets in estimated tokens; older clients send unbounded history/memory/map
+PROMPT_TOKEN_BUDGET = {
+    'history': int(os.environ.get('PROMPT_BUDGET_HISTORY', '200')),
+    'memory': int(os.environ.get('PROMPT_BUDGET_MEMORY', '600')),
+    'map': int(os.environ.get('PROMPT_BUDGET_MAP', '300')),
+    'plan': int(os.environ.get('PROMPT_BUDGET_PLAN', '250')),
+    'detections': int(os.environ.get('PROMPT_BUDGET_DETECTIONS', '80')),
+}
+
+
+def estimate_tokens(text):
+    # Roughly 4 characters per token for Gemini on mixed English/JSON text
+    return (len(text) + 3) // 4 if text else 0
+
+
+def fit_to_token_budget(text, budget, keep='head'):
+    """Trim text to about `budget` tokens, keeping its start (head) or its end (tail)."""
+    if not isinstance(text, str):
+        text = json.dumps(text, ensure_ascii=False, separators=(',', ':'))
+    max_chars = budget * 4
+    if len(text) <= max_chars:
+        return text
+    marker = ' [...] '
+    if keep == 'tail':
+        return marker + text[-(max_chars - len(marker)):]
+    return text[:max_chars - len(marker)] + marker
+
+
+def format_movement_history(movement_history, movement_summary=''):
+    items = []
+    for item in movement_history or []:
+        items.append(item if isinstance(item, str) else json.dumps(item, separators=(',', ':')))
+    text = ', '.join(items) or 'none'
+    if movement_summary:
+        text = f"{movement_summary}; then {text}"
+    return text
+
+
+# /llm_vision binary body: 4-byte big-endian JSON length, the JSON payload, then raw audio bytes
+FRAME_CONTENT_TYPE = 'application/x-agi-frame'
+
+
+def parse_frame_body(body):
+    """Split a length-prefixed /llm_vision body into (payload dict, audio bytes or None)."""
+    if len(body) < 4:
+        raise Exception('Frame body is too short')
+    json_len = int.from_bytes(body[:4], 'big')
+    if 4 + json_len > len(body):
+        raise Exception(f'Frame JSON length {json_len} exceeds body size {len(body)}')
+    payload = json.loads(body[4:4 + json_len].decode('utf-8')) if json_len else {}
+    audio_bytes = body[4 + json_len:] or None
+    return payload, audio_bytes
+
+
+class LaneBusy(Exception):
+    pass
+
+
+class WorkLane:
+    """Bounded pool of worker slots for one kind of request.
+
+    At most `concurrency` requests run at once and at most `max_queue` wait
+    for a slot; anything beyond that is rejected with LaneBusy (HTTP 503).
+    """
+
+    def __init__(self, name, concurrency, max_queue, wait_timeout=None):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @contextlib.contextmanager
+    def slot(self):
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise LaneBusy(f"{self.name} lane is full ({self.active} active, {self.waiting} queued)")
+            self.waiting += 1
+        acquired = self._slots.acquire(timeout=self.wait_timeout)
+        with self._lock:
+            self.waiting -= 1
+            if not acquired:
+                self.rejected += 1
+        if not acquired:
+            raise LaneBusy(f"{self.name} lane timed out waiting for a slot")
+        with self._lock:
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'concurrency': self.concurrency,
+                'max_queue': self.max_queue,
+                'active': self.active,
+                'waiting': self.waiting,
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
+
+
+KEEPALIVE_TIMEOUT = float(os.environ.get('KEEPALIVE_TIMEOUT', '60'))
+
+# Audio playback is serialized on the speaker by PLAYER; TTS synthesis and LLM calls run in parallel
+LANES = {
+    'tts': WorkLane('tts', int(os.environ.get('TTS_CONCURRENCY', '2')), int(os.environ.get('TTS_QUEUE_DEPTH', '8'))),
+    'llm': WorkLane('llm', LLM_CONCURRENCY, int(os.environ.get('LLM_QUEUE_DEPTH', '4'))),
+}
+
+
 class MediaServiceHandler(http.server.BaseHTTPRequestHandler):
+    # Keep-alive: every reply carries a Content-Length so the client can reuse the connection
+    protocol_version = 'HTTP/1.1'
+    # Idle keep-alive connections are closed after this many seconds
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers and body go out in separate writes; with Nagle on, the body waits for the
+    # client's delayed ACK (~40 ms per request on a reused connection)
+    disable_nagle_algorithm = True
+
+    def _reply(self, code, body=b'', content_type='text/plain; charset=utf-8'):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(code)
+        if body:
+            self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _reply_json(self, code, obj):
+        self._reply(code, json.dumps(obj).encode('utf-8'), 'application/json; charset=utf-8')
+
     def do_GET(self):
         parsed_url = urllib.parse.urlparse(self.path)
         logger.info(f"Received request: {self.path}")
+        try:
+            self._handle_get(parsed_url)
+        except (LaneBusy, PlaybackQueueFull) as e:
+            logger.warning(f"Rejecting {parsed_url.path}: {e}")
+            self._reply(503, f"Busy: {e}")
+
+    def _query_flag(self, query, name, default=False):
+        value = query.get(name, [None])[0]
+        if value is None:
+            return default
+        return value.lower() in ('1', 'true', 'yes')
+
+    def _enqueue_audio(self, filename, priority, query, label=None):
+        job = PLAYER.enqueue(filename, priority=priority, interrupt=self._query_flag(query, 'interrupt'), label=label)
+        if self._query_flag(query, 'wait'):
+            job.wait()
+            if job.state == 'failed':
+                raise Exception(job.error)
+        return job
+
+    def _handle_get(self, parsed_url):
+        query_components = urllib.parse.parse_qs(parsed_url.query)
         if parsed_url.path == '/play':
-            query_components = urllib.parse.parse_qs(parsed_url.query)
             filename = query_components.get('filename', [None])[0]
-            
+
             if filename:
+                if not os.path.isfile(filename):
+                    self._reply(404, f"Error: file not found: {filename}")
+                    return
                 try:
-                    play_audio_file(filename)
-                    
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/plain')
-                    self.end_headers()
-                    self.wfile.write(f"Playing {filename}".encode('utf-8'))
-                    logger.info(f"Successfully started playing {filename}")
+                    job = self._enqueue_audio(filename, PRIORITY_SOUND, query_components)
+                    self._reply(200, f"Playing {filename} (job {job.id}, {job.state})")
+                    logger.info(f"Successfully queued {filename}")
+                except PlaybackQueueFull:
+                    raise
                 except Exception as e:
                     logger.error(f"Error playing file {filename}: {e}", exc_info=True)
-                    self.send_response(500)
-                    self.send_header('Content-type', 'text/plain')
-                    self.end_headers()
-                    self.wfile.write(f"Error: {e}".encode('utf-8'))
+                    self._reply(500, f"Error: {e}")
             else:
-                self.send_response(400)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(b"Missing 'filename' parameter. Usage: /play?filename=sound.wav")
-                self.wfile.write(b"Missing 'filename' parameter. Usage: /play?filename=sound.wav")
+                self._reply(400, "Missing 'filename' parameter. Usage: /play?filename=sound.wav")
         elif parsed_url.path == '/play_random':
-            filename = play_random_sound()
+            filename = pick_random_sound()
             if filename:
-                 self.send_response(200)
-                 self.send_header('Content-type', 'text/plain')
-                 self.end_headers()
-                 self.wfile.write(f"Playing random sound: {filename}".encode('utf-8'))
-                 logger.info(f"Successfully started playing random sound: {filename}")
+                job = self._enqueue_audio(filename, PRIORITY_CASUAL, query_components)
+                self._reply(200, f"Playing random sound: {filename} (job {job.id}, {job.state})")
+                logger.info(f"Successfully queued random sound: {filename}")
             else:
-                 self.send_response(500)
-                 self.send_header('Content-type', 'text/plain')
-                 self.end_headers()
-                 self.wfile.write(b"Failed to play random sound (check logs)")
+                self._reply(500, "Failed to play random sound (check logs)")
+        elif parsed_url.path == '/playback/status':
+            self._reply_json(200, PLAYER.status())
+        elif parsed_url.path == '/playback/stop':
+            self._reply_json(200, {'stopped': PLAYER.stop_current()})
+        elif parsed_url.path == '/playback/cancel':
+            if self._query_flag(query_components, 'all'):
+                PLAYER.clear()
+                self._reply_json(200, {'cancelled': 'all'})
+                return
+            try:
+                job_id = int(query_components.get('id', [''])[0])
+            except ValueError:
+                self._reply(400, "Missing 'id' parameter. Usage: /playback/cancel?id=3 or /playback/cancel?all=1")
+                return
+            self._reply_json(200, {'cancelled': PLAYER.cancel(job_id)})
+        elif parsed_url.path == '/frames/status':
+            stats = FRAME_SUBSCRIBER.stats() if FRAME_SUBSCRIBER else {'running': False}
+            with IMAGE_STATS_LOCK:
+                stats['preprocess'] = dict(IMAGE_STATS)
+            self._reply_json(200, stats)
+        elif parsed_url.path == '/tts/status':
+            self._reply_json(200, TTS_CACHE.stats())
+        elif parsed_url.path == '/decision_cache/status':
+            self._reply_json(200, DECISION_CACHE.stats() if DECISION_CACHE else {'enabled': False})
+        elif parsed_url.path == '/llm/status':
+            self._reply_json(200, llm_tier_stats())
+        elif parsed_url.path == '/metrics':
+            self._reply(200, TRACER.prometheus(), 'text/plain; version=0.0.4; charset=utf-8')
+        elif parsed_url.path == '/trace/cycles':
+            try:
+                n = int(query_components.get('n', ['0'])[0])
+            except ValueError:
+                n = 0
+            self._reply_json(200, {'cycles': TRACER.recent_cycles(n or None), 'spans': TRACER.summary()})
+        elif parsed_url.path == '/lanes/status':
+            self._reply_json(200, {name: lane.stats() for name, lane in LANES.items()})
         elif parsed_url.path == '/speak':
-            query_components = urllib.parse.parse_qs(parsed_url.query)
             text = query_components.get('text', [None])[0]
             lang = query_components.get('lang', ['en'])[0]
+            cycle_id = query_components.get('cycle', [None])[0]
 
             if text:
                 try:
-                    # Cache key now includes language
-                    cache_key = f"{lang}:{text}"
-                    if cache_key in TTS_CACHE:
-                        logger.info(f"Using cached audio for text: {text} ({lang})")
-                        temp_filename = TTS_CACHE[cache_key]
+                    label = f"speak: {text[:40]}"
+                    if self._query_flag(query_components, 'stream', TTS_STREAMING):
+                        with TRACER.span('tts', cycle_id), LANES['tts'].slot():
+                            chunks = synthesize_speech_stream(text, lang)
+                            # Hold the slot until the first sentence is ready; the rest keep synthesizing
+                            chunks[0].result()
+                        jobs = PLAYER.enqueue_group(chunks, priority=PRIORITY_SPEECH,
+                                                    interrupt=self._query_flag(query_components, 'interrupt'), label=label)
+                        if self._query_flag(query_components, 'wait'):
+                            with TRACER.span('playback', cycle_id):
+                                for job in jobs:
+                                    job.wait()
+                            failed = [job for job in jobs if job.state == 'failed']
+                            if failed:
+                                raise Exception(f"{len(failed)} of {len(jobs)} sentences failed: {failed[0].error}")
+                        job = jobs[-1]
                     else:
-                        # Initialize TTS service
-                        # Note: Requires GOOGLE_APPLICATION_CREDENTIALS environment variable to be set
-                        logger.info(f"Initializing Google TTS service for lang={lang}...")
-                        service = build('texttospeech', 'v1')
-
-                        input_text = {'text': text}
-                        
-                        # Select voice based on language
-                        if lang == 'ru':
-                            voice = {'languageCode': 'ru-RU', 'name': 'ru-RU-Wavenet-D'}
-                        elif lang == 'cz' or lang == 'cs':
-                            voice = {'languageCode': 'cs-CZ', 'name': 'cs-CZ-Wavenet-A'}
-                        else:
-                            # Default to English
-                            voice = {'languageCode': 'en-US', 'name': 'en-US-Neural2-D'}
-
-                        audio_config = {'audioEncoding': 'LINEAR16', 'volumeGainDb': 10.0} # +10dB for "speak loud"
-
-                        logger.info(f"Synthesizing text: {text} with voice: {voice['name']}")
-                        response = service.text().synthesize(
-                            body={
-                                'input': input_text,
-                                'voice': voice,
-                                'audioConfig': audio_config
-                            }
-                        ).execute()
-                        logger.info("TTS synthesis successful.")
-
-                        # Decode audio
-                        audio_content = base64.b64decode(response['audioContent'])
-
-                        # Write to temp file
-                        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as f:
-                            f.write(audio_content)
-                            temp_filename = f.name
-                        
-                        # Cache the filename
-                        TTS_CACHE[cache_key] = temp_filename
-
-                    play_audio_file(temp_filename)
-
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/plain; charset=utf-8')
-                    self.end_headers()
-                    self.wfile.write(f"Speaking ({lang}): {text}".encode('utf-8'))
-                
+                        with TRACER.span('tts', cycle_id), LANES['tts'].slot():
+                            temp_filename = synthesize_speech(text, lang)
+                        with TRACER.span('playback', cycle_id):
+                            job = self._enqueue_audio(temp_filename, PRIORITY_SPEECH, query_components, label=label)
+                    self._reply(200, f"Speaking ({lang}): {text} (job {job.id}, {job.state})")
+                except (LaneBusy, PlaybackQueueFull):
+                    raise
                 except Exception as e:
                     logger.error(f"Error calling Google TTS: {e}", exc_info=True)
-                    self.send_response(500)
-                    self.send_header('Content-type', 'text/plain; charset=utf-8')
-                    self.end_headers()
-                    self.wfile.write(f"Error calling Google TTS: {e}".encode('utf-8'))
+                    self._reply(500, f"Error calling Google TTS: {e}")
             else:
-                self.send_response(400)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(b"Missing 'text' parameter. Usage: /speak?text=Hello")
-        
+                self._reply(400, "Missing 'text' parameter. Usage: /speak?text=Hello")
+
         else:
-            self.send_response(404)
-            self.end_headers()
+            self._reply(404)
 
     def do_POST(self):
         parsed_url = urllib.parse.urlparse(self.path)
         logger.info(f"Received POST request: {self.path}")
         if parsed_url.path == '/llm_vision':
+            received = time.time()
             try:
                 content_length = int(self.headers.get('Content-Length', 0))
                 body = self.rfile.read(content_length) if content_length else b''
-                try:
-                    payload = json.loads(body.decode('utf-8')) if body else {}
-                except Exception:
-                    payload = {}
-
-                distance = payload.get('distance')
-                plan = payload.get('plan', '')
-                subplan = payload.get('subplan', '')
-                space_map = payload.get('map', '')
-                memory = payload.get('memory', '')
-                main_goal = payload.get('main_goal', '')
-                movement_history = payload.get('movement_history', [])
-                lang = payload.get('lang', 'en')
-                
-                # Extract audio if present
                 audio_bytes = None
-                if 'audio' in payload:
+                if self.headers.get('Content-Type', '').startswith(FRAME_CONTENT_TYPE):
+                    payload, audio_bytes = parse_frame_body(body)
+                else:
                     try:
-                        audio_base64 = payload.get('audio')
-                        audio_bytes = base64.b64decode(audio_base64)
-                        logger.info(f"Decoded audio from payload, size: {len(audio_bytes)} bytes")
-                    except Exception as audio_err:
-                        logger.warning(f"Could not decode audio: {audio_err}")
-
-                # Compose a prompt for the multimodal model
-                prompt = payload.get('prompt') or (
-                    f"ROBOT STATE REPORT:\n"
-                    f"- Main Goal: {main_goal}\n"
-                    f"- Global Plan: {plan}\n"
-                    f"- Current Subplan: {subplan}\n"
-                    f"- Permanent Memory: {memory}\n"
-                    f"- Distance to Obstacle: {distance} cm\n"
-                    f"- Movement History: {movement_history}\n"
-                    f"- Current Spatial Map:\n{space_map}\n\n"
-                    f"TASK: Analyze the visual scene and any user audio. "
-                    f"Update your mood (RGB), reasoning (plan), tactical steps (subplan), and the map. "
-                    f"Choose the best movement command to safely progress toward the Main Goal."
-                )
-
-                image_data = get_image_from_socket(timeout=5)
-
-                if not image_data:
-                    raise Exception('No image available for llm_vision')
-
-                logger.info('Sending text+image+audio to Gemini model (POST handler)...')
-                response_text = send_to_gemini(prompt, image_data, lang=lang, audio_bytes=audio_bytes)
-
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json; charset=utf-8')
-                self.end_headers()
-                out = normalize_response_object(response_text)
-                self.wfile.write(out)
+                        payload = json.loads(body.decode('utf-8')) if body else {}
+                    except Exception:
+                        payload = {}
+
+                with TRACER.cycle(payload.get('cycle_id')), TRACER.span('llm_vision'), LANES['llm'].slot():
+                    if payload.get('stream'):
+                        self._llm_vision_stream(payload, audio_bytes, received)
+                        return
+                    request = self._prepare_llm_vision(payload, audio_bytes)
+                    cache_key, response_text = cached_decision(request, payload)
+                    if response_text is None:
+                        logger.info('Sending text+image+audio to Gemini model (POST handler)...')
+                        started = time.time()
+                        response_text = call_gemini(request, payload, received)
+                        remember_decision(cache_key, response_text, time.time() - started)
+
+                self._reply(200, normalize_response_object(response_text), 'application/json; charset=utf-8')
                 logger.info('Received response from Gemini and returned to client (POST).')
 
+            except LaneBusy as e:
+                logger.warning(f"Rejecting /llm_vision: {e}")
+                self._reply(503, f"Busy: {e}")
             except Exception as e:
                 logger.error(f"Error in POST /llm_vision: {e}", exc_info=True)
-                self.send_response(500)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(f"Error: {e}".encode('utf-8'))
+                self._reply(500, f"Error: {e}")
+        elif parsed_url.path == '/trace':
+            try:
+                content_length = int(self.headers.get('Content-Length', 0) or 0)
+                report = json.loads(self.rfile.read(content_length).decode('utf-8')) if content_length else {}
+                for name, seconds in (report.get('spans') or {}).items():
+                    TRACER.record(name, float(seconds), report.get('cycle_id'), source=report.get('source') or 'robot')
+                self._reply(204)
+            except Exception as e:
+                logger.warning(f"Bad /trace report: {e}")
+                self._reply(400, f"Error: {e}")
+        else:
+            # Drain the unread body so the next request on this connection parses cleanly
+            content_length = int(self.headers.get('Content-Length', 0) or 0)
+            if content_length:
+                self.rfile.read(content_length)
+            self._reply(404)
+
+    def _prepare_llm_vision(self, payload, audio_bytes=None):
+        distance = payload.get('distance')
+        plan = payload.get('plan', '')
+        subplan = payload.get('subplan', '')
+        space_map = payload.get('map', '')
+        memory = payload.get('memory', '')
+        main_goal = payload.get('main_goal', '')
+        movement_history = payload.get('movement_history', [])
+        movement_summary = payload.get('movement_summary', '')
+        lang = payload.get('lang', 'en')
+        detections_summary = payload.get('detections_summary', '')
+        detections_window = payload.get('detections_window_sec', 10)
+        image_detail = payload.get('image_detail', 'high')
+
+        # Extract base64 audio sent by older clients in the JSON payload
+        if audio_bytes:
+            logger.info(f"Received binary audio part, size: {len(audio_bytes)} bytes")
+        elif 'audio' in payload:
+            try:
+                audio_base64 = payload.get('audio')
+                audio_bytes = base64.b64decode(audio_base64)
+                logger.info(f"Decoded audio from payload, size: {len(audio_bytes)} bytes")
+            except Exception as audio_err:
+                logger.warning(f"Could not decode audio: {audio_err}")
+
+        with TRACER.span('prompt_build'):
+            history_text = format_movement_history(movement_history, movement_summary)
+            sections = {
+                'history': fit_to_token_budget(history_text, PROMPT_TOKEN_BUDGET['history'], keep='tail'),
+                'memory': fit_to_token_budget(memory, PROMPT_TOKEN_BUDGET['memory']),
+                'map': fit_to_token_budget(space_map, PROMPT_TOKEN_BUDGET['map']),
+                'plan': fit_to_token_budget(plan, PROMPT_TOKEN_BUDGET['plan']),
+                'subplan': fit_to_token_budget(subplan, PROMPT_TOKEN_BUDGET['plan']),
+                'detections': fit_to_token_budget(detections_summary, PROMPT_TOKEN_BUDGET['detections']),
+            }
+            logger.info("Estimated prompt tokens: " + ", ".join(
+                f"{name}={estimate_tokens(text)}" for name, text in sections.items()))
+
+            # Compose a prompt for the multimodal model
+            prompt = payload.get('prompt') or (
+                f"ROBOT STATE REPORT:\n"
+                f"- Main Goal: {main_goal}\n"
+                f"- Global Plan: {sections['plan']}\n"
+                f"- Current Subplan: {sections['subplan']}\n"
+                f"- Permanent Memory (key: value):\n{sections['memory'] or 'none'}\n"
+                f"- Distance to Obstacle: {distance} cm\n"
+                f"- Objects Detected in Last {detections_window:g}s: {sections['detections'] or 'none'}\n"
+                f"- Movement History (oldest first): {sections['history']}\n"
+                f"- Local Occupancy Grid:\n{sections['map']}\n\n"
+                f"TASK: Analyze the visual scene and any user audio. "
+                f"Update your mood (RGB), reasoning (plan) and tactical steps (subplan). "
+                f"Choose the best movement command to safely progress toward the Main Goal."
+            )
+
+        if image_detail == 'none':
+            # The client trusts its detector this cycle; no frame is fetched or uploaded
+            image_data, image_mime = None, None
+            if not payload.get('prompt'):
+                prompt += "\nNo camera frame this cycle: rely on the detected objects and distance."
         else:
-            self.send_response(404)
-            self.end_headers()
+            with TRACER.span('frame_fetch'):
+                image_data = get_latest_image(newer_than=payload.get('frame_after'), timeout=5)
+
+            if not image_data:
+                raise Exception('No image available for llm_vision')
+
+            max_side = IMAGE_LOW_DETAIL_MAX_SIDE if image_detail == 'low' else None
+            with TRACER.span('preprocess'):
+                image_data, image_mime = preprocess_image(image_data, max_side=max_side)
+
+        return {
+            'text': prompt,
+            'image_bytes': image_data,
+            'image_mime': image_mime,
+            'lang': lang,
+            'audio_bytes': audio_bytes,
+        }
+
+    def _llm_vision_stream(self, payload, audio_bytes=None, received=None):
+        """Newline-delimited JSON reply: an 'early' message with the actionable keys as soon as
+        they are complete, then a 'final' message with the full object (or an 'error' message)."""
+        request = self._prepare_llm_vision(payload, audio_bytes)
+
+        self.send_response(200)
+        self.send_header('Content-type', 'application/x-ndjson; charset=utf-8')
+        # No Content-Length: the stream ends when the connection closes
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def write_message(message):
+            self.wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+        try:
+            cache_key, result = cached_decision(request, payload)
+            if result is None:
+                logger.info('Streaming text+image+audio to Gemini model (POST handler)...')
+                started = time.time()
+                result = call_gemini_stream(request, payload,
+                                            on_early=lambda fields: write_message({'stage': 'early', 'fields': fields}),
+                                            received=received)
+                remember_decision(cache_key, result, time.time() - started)
+            write_message({'stage': 'final', 'fields': result})
+            logger.info('Streamed response from Gemini to client (POST).')
+        except Exception as e:
+            logger.error(f"Error in streamed /llm_vision: {e}", exc_info=True)
+            try:
+                write_message({'stage': 'error', 'error': str(e)})
+            except Exception:
+                pass
+
+
+class ThreadedMediaServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
 
 if __name__ == "__main__":
-    socketserver.TCPServer.allow_reuse_address = True
-    with socketserver.TCPServer(("", PORT), MediaServiceHandler) as httpd:
-        logger.info(f"Media and LLM service running on http://localhost:{PORT}")
+    if os.environ.get('FRAME_SUBSCRIBER', '1') != '0':
+        start_frame_subscriber()
+    PLAYER.start()
+    compile_system_instructions()
+    if os.environ.get('TTS_WARMUP', '1') != '0':
+        threading.Thread(target=warm_tts_cache, name="TTSWarmup", daemon=True).start()
+    if os.environ.get('MEDIA_SERVICE_THREADED', '1') != '0':
+        server_class = ThreadedMediaServer
+    else:
+        socketserver.TCPServer.allow_reuse_address = True
+        server_class = socketserver.TCPServer
+    with server_class(("", PORT), MediaServiceHandler) as httpd:
+        logger.info(f"Media and LLM service running on http://localhost:{PORT} ({server_class.__name__})")
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
@@ -0,0 +1,227 @@
+"""Key-value fact memory persisted as an append-only journal.
+
+The LLM no longer rewrites its whole memory on every reply. It emits
+`memory_ops` ({"op": "add"|"update"|"delete", "key": .., "value": ..}), which
+are applied here and appended to a JSON-lines journal. On load the journal is
+replayed. Once it holds many more lines than there are live facts, it is
+compacted into one line per fact. Only the facts most relevant to the current
+goal are put into the prompt.
+"""
+
+import json
+import logging
+import os
+import re
+import string
+import threading
+import time
+
+logger = logging.getLogger("robot.memory")
+
+WORD_RE = re.compile(r"[^\W_]{3,}", re.UNICODE)
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+MAX_KEY_CHARS = 64
+MAX_VALUE_CHARS = 300
+
+
+def words(text):
+    return set(WORD_RE.findall(text.lower())) if text else set()
+
+
+def split_note(text, limit=MAX_VALUE_CHARS):
+    """Pack the sentences of a free-text note into chunks of at most `limit` characters.
+    A sentence longer than that is split between words."""
+    chunks = []
+    current = ""
+    for sentence in SENTENCE_END_RE.split(text.strip()):
+        while len(sentence) > limit:
+            cut = sentence.rfind(" ", 0, limit + 1)
+            cut = cut if cut > 0 else limit
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if current and len(current) + 1 + len(sentence) > limit:
+            chunks.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return [chunk for chunk in chunks if chunk]
+
+
+class FactMemory:
+    """Facts keyed by a short id, e.g. {"kitchen_location": "The kitchen is left of the hallway"}."""
+
+    def __init__(self, path="memory.jsonl", legacy_path=None, max_facts=200, compact_ratio=3.0, compact_min_lines=100):
+        self.path = path
+        self.max_facts = max_facts
+        self.compact_ratio = compact_ratio
+        self.compact_min_lines = compact_min_lines
+        self.facts = {}
+        self.journal_lines = 0
+        self.counters = {"added": 0, "updated": 0, "deleted": 0, "rejected": 0, "truncated": 0, "compactions": 0}
+        self._lock = threading.Lock()
+        self.load()
+        if legacy_path:
+            self.migrate(legacy_path)
+
+    def __len__(self):
+        with self._lock:
+            return len(self.facts)
+
+    # --- persistence -----------------------------------------------------------
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with self._lock:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        self.journal_lines += 1
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            logger.warning(f"Skipping corrupt memory journal line: {line[:80]}")
+                            continue
+                        if entry.get("op") == "delete":
+                            self.facts.pop(entry.get("key"), None)
+                        elif entry.get("op") == "set":
+                            self.facts[entry["key"]] = {"value": entry["value"], "updated": entry.get("ts", 0.0)}
+                logger.info(f"Loaded {len(self.facts)} facts from {self.path} ({self.journal_lines} journal lines)")
+            except Exception as e:
+                logger.warning(f"Could not load memory journal: {e}")
+        self.maybe_compact()
+
+    def migrate(self, legacy_path):
+        """Import a free-text memory.txt once. Each non-empty line becomes fact note_N; a line
+        longer than MAX_VALUE_CHARS (the old memory was often one long paragraph) is split
+        into sentence chunks note_N_a, note_N_b, ... so nothing is cut off."""
+        if not os.path.exists(legacy_path):
+            return
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                lines = [line.strip(" -*\t") for line in f.read().splitlines()]
+            ops = []
+            for i, line in enumerate((l for l in lines if l), start=1):
+                chunks = split_note(line)
+                if len(chunks) == 1:
+                    ops.append({"op": "add", "key": f"note_{i}", "value": chunks[0]})
+                    continue
+                for j, chunk in enumerate(chunks):
+                    suffix = string.ascii_lowercase[j] if j < 26 else str(j + 1)
+                    ops.append({"op": "add", "key": f"note_{i}_{suffix}", "value": chunk})
+            if len(ops) > self.max_facts:
+                logger.warning(f"{legacy_path} yields {len(ops)} facts but only {self.max_facts} are kept; "
+                               f"the oldest will be dropped")
+            self.apply(ops)
+            os.replace(legacy_path, legacy_path + ".migrated")
+            logger.info(f"Migrated {legacy_path} into {self.path} as {len(ops)} facts")
+        except Exception as e:
+            logger.warning(f"Could not migrate {legacy_path}: {e}")
+
+    def _append(self, entries):
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.journal_lines += len(entries)
+        except Exception as e:
+            logger.warning(f"Could not append to memory journal: {e}")
+
+    def maybe_compact(self):
+        with self._lock:
+            if self.journal_lines < max(self.compact_min_lines, self.compact_ratio * len(self.facts)):
+                return
+            tmp = self.path + ".tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    for key, fact in self.facts.items():
+                        f.write(json.dumps({"op": "set", "key": key, "value": fact["value"], "ts": fact["updated"]},
+                                           ensure_ascii=False) + "\n")
+                os.replace(tmp, self.path)
+                logger.info(f"Compacted memory journal from {self.journal_lines} to {len(self.facts)} lines")
+                self.journal_lines = len(self.facts)
+                self.counters["compactions"] += 1
+            except Exception as e:
+                logger.warning(f"Could not compact memory journal: {e}")
+
+    # --- updates -----------------------------------------------------------------
+
+    def apply(self, ops) -> int:
+        """Apply memory_ops from the model; returns the number of facts changed."""
+        if not isinstance(ops, list):
+            return 0
+        now = time.time()
+        entries = []
+        with self._lock:
+            for op in ops:
+                if not isinstance(op, dict):
+                    self.counters["rejected"] += 1
+                    continue
+                kind = op.get("op")
+                key = str(op.get("key") or "").strip()[:MAX_KEY_CHARS]
+                value = op.get("value")
+                if not key:
+                    self.counters["rejected"] += 1
+                    continue
+                if kind == "delete":
+                    if self.facts.pop(key, None) is not None:
+                        entries.append({"op": "delete", "key": key, "ts": now})
+                        self.counters["deleted"] += 1
+                    continue
+                if kind not in ("add", "update") or not isinstance(value, str) or not value.strip():
+                    self.counters["rejected"] += 1
+                    continue
+                value = value.strip()
+                if len(value) > MAX_VALUE_CHARS:
+                    logger.warning(f"Memory fact {key} truncated from {len(value)} to {MAX_VALUE_CHARS} chars")
+                    self.counters["truncated"] += 1
+                    value = value[:MAX_VALUE_CHARS]
+                existing = self.facts.get(key)
+                if existing is not None and existing["value"] == value:
+                    continue
+                if existing is None and len(self.facts) >= self.max_facts:
+                    # Make room by dropping the fact that has gone longest without an update
+                    oldest = min(self.facts, key=lambda k: self.facts[k]["updated"])
+                    del self.facts[oldest]
+                    entries.append({"op": "delete", "key": oldest, "ts": now})
+                    logger.info(f"Memory full, dropped oldest fact {oldest}")
+                self.facts[key] = {"value": value, "updated": now}
+                entries.append({"op": "set", "key": key, "value": value, "ts": now})
+                self.counters["updated" if existing is not None else "added"] += 1
+            if entries:
+                self._append(entries)
+        if entries:
+            logger.info(f"Applied {len(entries)} memory changes, {len(self)} facts stored")
+            self.maybe_compact()
+        return len(entries)
+
+    # --- prompt ------------------------------------------------------------------
+
+    def relevant(self, context, max_chars=1200):
+        """'key: value' lines of the facts sharing most words with `context`, newest first on ties,
+        up to max_chars in total."""
+        query = words(context)
+        with self._lock:
+            items = list(self.facts.items())
+        scored = sorted(items, key=lambda item: (len(query & (words(item[1]["value"]) | words(item[0].replace("_", " ")))),
+                                                  item[1]["updated"]), reverse=True)
+        lines = []
+        used = 0
+        for key, fact in scored:
+            line = f"{key}: {fact['value']}"
+            if used + len(line) + 1 > max_chars:
+                continue
+            lines.append(line)
+            used += len(line) + 1
+        return "\n".join(lines)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, facts=len(self.facts), journal_lines=self.journal_lines)
@@ -0,0 +1,150 @@
+"""Local 2-D occupancy grid kept by dead reckoning and the ultrasonic sensor.
+
+Replaces the free-text map the LLM used to rewrite on every reply. The robot
+pose is advanced by the executed MOVE/TURN commands, and every distance
+reading clears the cells along the sonar beam and marks the cell where the
+echo came from. The grid has a fixed size and is shifted when the robot gets
+near its edge, so memory stays bounded however far the robot drives. A small
+ASCII crop around the robot goes into the prompt.
+"""
+
+import math
+import threading
+
+import numpy as np
+
+# Readings at or above this mean "no echo" (the sketch reports 0 as 1000)
+NO_ECHO_CM = 1000
+
+
+class OccupancyGrid:
+    """Log-odds occupancy grid in int8 cells; north (+y) is up when rendered.
+
+    Heading is in degrees, counter-clockwise from east; the robot starts at the
+    center facing north (90). `hit`/`miss` are the log-odds steps for an echo
+    and for a cell the beam passed through, clamped to +/-`clamp`. Cells at or
+    above OCCUPIED render as obstacles, at or below FREE as free space.
+    """
+
+    OCCUPIED = 2
+    FREE = -1
+
+    def __init__(self, size=128, cell_cm=20.0, hit=3, miss=1, clamp=12, max_range_cm=300.0, beam_deg=15.0, beam_rays=3):
+        self.size = size
+        self.cell_cm = float(cell_cm)
+        self.hit = hit
+        self.miss = miss
+        self.clamp = clamp
+        self.max_range_cm = max_range_cm
+        self.beam_offsets = np.radians(np.linspace(-beam_deg / 2.0, beam_deg / 2.0, beam_rays))
+        self.grid = np.zeros((size, size), dtype=np.int8)
+        self.x = self.y = size * self.cell_cm / 2.0
+        self.heading = 90.0
+        self.shifts = 0
+        self.updates = 0
+        self._lock = threading.Lock()
+
+    # --- helpers -----------------------------------------------------------------
+
+    def _cells(self, xs, ys):
+        """Flat indices of the in-bounds cells under the points (xs, ys), deduplicated."""
+        cols = np.floor(xs / self.cell_cm).astype(np.int64)
+        rows = np.floor(ys / self.cell_cm).astype(np.int64)
+        inside = (cols >= 0) & (cols < self.size) & (rows >= 0) & (rows < self.size)
+        return np.unique(rows[inside] * self.size + cols[inside])
+
+    def _add(self, flat_idx, step):
+        if not len(flat_idx):
+            return
+        flat = self.grid.reshape(-1)
+        flat[flat_idx] = np.clip(flat[flat_idx].astype(np.int16) + step, -self.clamp, self.clamp)
+
+    def _recenter(self):
+        """Shift the grid so the robot is back in the middle once it nears an edge."""
+        margin = self.size // 4
+        col, row = int(self.x // self.cell_cm), int(self.y // self.cell_cm)
+        if margin <= col < self.size - margin and margin <= row < self.size - margin:
+            return
+        dc, dr = self.size // 2 - col, self.size // 2 - row
+        shifted = np.zeros_like(self.grid)
+        src_r = slice(max(0, -dr), min(self.size, self.size - dr))
+        dst_r = slice(max(0, dr), min(self.size, self.size + dr))
+        src_c = slice(max(0, -dc), min(self.size, self.size - dc))
+        dst_c = slice(max(0, dc), min(self.size, self.size + dc))
+        shifted[dst_r, dst_c] = self.grid[src_r, src_c]
+        self.grid = shifted
+        self.x += dc * self.cell_cm
+        self.y += dr * self.cell_cm
+        self.shifts += 1
+
+    # --- updates -----------------------------------------------------------------
+
+    def turn(self, degrees):
+        """Rotate in place; positive is left (counter-clockwise)."""
+        with self._lock:
+            self.heading = (self.heading + degrees) % 360.0
+
+    def move(self, distance_cm):
+        """Drive straight; negative distance is backwards. Cells the robot drove over are free."""
+        with self._lock:
+            rad = math.radians(self.heading)
+            steps = np.arange(0.0, abs(distance_cm) + 1e-6, self.cell_cm / 2.0) * (1 if distance_cm >= 0 else -1)
+            self._add(self._cells(self.x + steps * math.cos(rad), self.y + steps * math.sin(rad)), -self.miss)
+            self.x += distance_cm * math.cos(rad)
+            self.y += distance_cm * math.sin(rad)
+            self._recenter()
+            self.updates += 1
+
+    def observe(self, distance_cm):
+        """Apply one forward ultrasonic reading."""
+        if distance_cm is None:
+            return
+        distance_cm = float(distance_cm)
+        echo = 0 < distance_cm < NO_ECHO_CM and distance_cm <= self.max_range_cm
+        free_len = distance_cm - self.cell_cm / 2.0 if echo else self.max_range_cm
+        with self._lock:
+            angles = math.radians(self.heading) + self.beam_offsets
+            ranges = np.arange(0.0, max(free_len, 0.0), self.cell_cm / 2.0)
+            xs = self.x + np.outer(np.cos(angles), ranges)
+            ys = self.y + np.outer(np.sin(angles), ranges)
+            free = self._cells(xs.ravel(), ys.ravel())
+            if echo:
+                hit = self._cells(self.x + distance_cm * np.cos(angles), self.y + distance_cm * np.sin(angles))
+                free = np.setdiff1d(free, hit, assume_unique=True)
+                self._add(hit, self.hit)
+            self._add(free, -self.miss)
+            self.updates += 1
+
+    # --- output ------------------------------------------------------------------
+
+    def heading_arrow(self):
+        return ">^<v"[int(((self.heading + 45.0) % 360.0) // 90.0)]
+
+    def render(self, radius=8):
+        """ASCII crop of (2*radius+1)^2 cells around the robot, north up."""
+        with self._lock:
+            col, row = int(self.x // self.cell_cm), int(self.y // self.cell_cm)
+            crop = np.zeros((2 * radius + 1, 2 * radius + 1), dtype=np.int8)
+            r0, c0 = row - radius, col - radius
+            rs, re = max(0, r0), min(self.size, row + radius + 1)
+            cs, ce = max(0, c0), min(self.size, col + radius + 1)
+            crop[rs - r0:re - r0, cs - c0:ce - c0] = self.grid[rs:re, cs:ce]
+            chars = np.full(crop.shape, "?", dtype="<U1")
+            chars[crop >= self.OCCUPIED] = "#"
+            chars[crop <= self.FREE] = "."
+            chars[radius, radius] = self.heading_arrow()
+            lines = ["".join(r) for r in chars[::-1]]
+            header = (f"{self.cell_cm:g}cm cells, north up, robot '{chars[radius, radius]}' at center "
+                      f"heading {self.heading:.0f} deg (0=east, 90=north); # obstacle, . free, ? unknown")
+            return header + "\n" + "\n".join(lines)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "bytes": int(self.grid.nbytes),
+                "known_cells": int(np.count_nonzero(self.grid)),
+                "occupied_cells": int(np.count_nonzero(self.grid >= self.OCCUPIED)),
+                "pose": [round(self.x, 1), round(self.y, 1), round(self.heading, 1)],
+                "updates": self.updates,
+                "shifts": self.shifts,
+            }
@@ -0,0 +1,221 @@
+"""The reply format of the robot's LLM, declared once for media_service.py and main.py.
+
+RESPONSE_SCHEMA is given to Gemini as the response schema (with the JSON mime
+type), so the model is constrained to valid JSON in a fixed key order: the
+actionable keys come first, which lets a streamed reply be acted on early.
+Both processes turn a reply into a RobotResponse with the same validating
+parser. A field that does not validate is dropped on its own, and the rest of
+the cycle is kept. Malformed replies and dropped fields are counted.
+"""
+
+import collections
+import json
+import threading
+from dataclasses import dataclass, field
+
+MOVE_COMMANDS = ("forward", "back", "left", "right", "stop")
+SOUNDS = ("casual",)
+MAX_TEXT_CHARS = 2000
+
+# Gemini Schema (OpenAPI subset); propertyOrdering fixes the order the keys are generated in
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "move": {
+            "type": "OBJECT",
+            "properties": {
+                "command": {"type": "STRING", "enum": list(MOVE_COMMANDS)},
+                "distance_cm": {"type": "INTEGER", "nullable": True},
+                "angle_deg": {"type": "INTEGER", "nullable": True},
+            },
+            "required": ["command"],
+            "propertyOrdering": ["command", "distance_cm", "angle_deg"],
+        },
+        "rgb": {"type": "STRING", "description": "R,G,B with each value 0-255"},
+        "speak": {
+            "type": "OBJECT",
+            "nullable": True,
+            "properties": {"text": {"type": "STRING"}},
+            "required": ["text"],
+        },
+        "sound": {"type": "STRING", "enum": list(SOUNDS), "nullable": True},
+        "subplan": {"type": "STRING"},
+        "plan": {"type": "STRING"},
+        "memory_ops": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "op": {"type": "STRING", "enum": ["add", "update", "delete"]},
+                    "key": {"type": "STRING"},
+                    "value": {"type": "STRING", "nullable": True},
+                },
+                "required": ["op", "key"],
+                "propertyOrdering": ["op", "key", "value"],
+            },
+        },
+    },
+    "required": ["move", "rgb", "speak", "sound", "subplan", "plan", "memory_ops"],
+    "propertyOrdering": ["move", "rgb", "speak", "sound", "subplan", "plan", "memory_ops"],
+}
+
+FIELDS = tuple(RESPONSE_SCHEMA["propertyOrdering"])
+
+_stats = collections.Counter()
+_stats_lock = threading.Lock()
+# Most recent validation problems, for the stats endpoint
+_invalid_log = collections.deque(maxlen=10)
+
+
+class MalformedReply(ValueError):
+    """The reply is not a JSON object at all."""
+
+
+@dataclass(slots=True)
+class RobotResponse:
+    """One validated LLM decision. `speak` holds the text to say; `move` is a normalized
+    {"command", "distance_cm" | "angle_deg"} dict. `pending` is client-side only: the Future
+    of the full reply while the slow fields of a streamed reply are still arriving."""
+
+    move: dict = None
+    rgb: str = None
+    speak: str = None
+    sound: str = None
+    subplan: str = None
+    plan: str = None
+    memory_ops: list = field(default_factory=list)
+    pending: object = field(default=None, repr=False, compare=False)
+
+    def __bool__(self):
+        return any(getattr(self, name) for name in FIELDS)
+
+    def to_dict(self, skip_empty=False) -> dict:
+        """The reply in its wire format (speak as {"text": ..})."""
+        data = {}
+        for name in FIELDS:
+            value = getattr(self, name)
+            if name == "speak" and value is not None:
+                value = {"text": value}
+            if skip_empty and not value:
+                continue
+            data[name] = value
+        return data
+
+
+def _count(key, n=1):
+    with _stats_lock:
+        _stats[key] += n
+
+
+def _text(value):
+    if isinstance(value, str):
+        value = value.strip()
+        return value[:MAX_TEXT_CHARS] if value else None
+    raise ValueError("not a string")
+
+
+def _move(value):
+    if not isinstance(value, dict):
+        raise ValueError("not an object")
+    command = str(value.get("command") or "").strip().lower()
+    if command not in MOVE_COMMANDS:
+        raise ValueError(f"unknown command {command!r}")
+    if command == "stop":
+        return {"command": "stop"}
+    key = "distance_cm" if command in ("forward", "back") else "angle_deg"
+    amount = int(float(value.get(key)))
+    if amount < 0:
+        raise ValueError(f"negative {key}")
+    return {"command": command, key: amount}
+
+
+def _rgb(value):
+    parts = [int(p) for p in str(value).split(",")]
+    if len(parts) != 3 or not all(0 <= p <= 255 for p in parts):
+        raise ValueError("not R,G,B")
+    return ",".join(str(p) for p in parts)
+
+
+def _speak(value):
+    if isinstance(value, dict):
+        value = value.get("text")
+    return _text(value) if value is not None else None
+
+
+def _sound(value):
+    if value not in SOUNDS:
+        raise ValueError(f"unknown sound {value!r}")
+    return value
+
+
+def _memory_ops(value):
+    if not isinstance(value, list):
+        raise ValueError("not a list")
+    ops = [op for op in value if isinstance(op, dict)]
+    if len(ops) != len(value):
+        _count("invalid_memory_ops_items", len(value) - len(ops))
+    return ops
+
+
+VALIDATORS = {
+    "move": _move,
+    "rgb": _rgb,
+    "speak": _speak,
+    "sound": _sound,
+    "subplan": _text,
+    "plan": _text,
+    "memory_ops": _memory_ops,
+}
+
+
+def parse_fields(fields) -> RobotResponse:
+    """Validate a (possibly partial) reply object field by field; invalid fields are dropped."""
+    response = RobotResponse()
+    if not isinstance(fields, dict):
+        return response
+    for name, validate in VALIDATORS.items():
+        value = fields.get(name)
+        if value is None:
+            continue
+        try:
+            setattr(response, name, validate(value))
+        except (TypeError, ValueError) as e:
+            _count(f"invalid_{name}")
+            _invalid_log.append(f"{name}: {e}")
+    return response
+
+
+def parse_reply(reply) -> RobotResponse:
+    """Parse a complete reply (JSON text, bytes or an already decoded dict) into a RobotResponse.
+
+    Raises MalformedReply when there is no JSON object to read. Text around the object
+    (a markdown fence when the schema was not enforced) is tolerated and counted as repaired.
+    """
+    _count("replies")
+    if isinstance(reply, (bytes, bytearray)):
+        reply = reply.decode("utf-8", errors="replace")
+    raw = reply
+    if isinstance(reply, str):
+        try:
+            reply = json.loads(reply)
+        except ValueError:
+            start, end = reply.find("{"), reply.rfind("}")
+            try:
+                reply = json.loads(reply[start:end + 1]) if 0 <= start < end else None
+            except ValueError:
+                reply = None
+            if isinstance(reply, dict):
+                _count("repaired")
+    if not isinstance(reply, dict):
+        _count("malformed")
+        raise MalformedReply(f"LLM reply is not a JSON object: {str(raw)[:200]!r}")
+    return parse_fields(reply)
+
+
+def stats():
+    with _stats_lock:
+        counters = dict(_stats)
+    replies = counters.get("replies", 0)
+    counters["malformed_rate"] = round(counters.get("malformed", 0) / replies, 4) if replies else None
+    counters["recent_invalid"] = list(_invalid_log)
+    return counters
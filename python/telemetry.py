@@ -0,0 +1,154 @@
+"""Rate-limited, deadband-filtered publishing of MCU telemetry to Arduino Cloud.
+
+The MCU reports distance, temperature and humidity on every loop (~10 Hz).
+TelemetryPublisher sits between the Bridge setters and the cloud object and
+only forwards a value when it moved by more than the channel's deadband and
+the channel's minimum interval has passed, or immediately when it changed
+significantly. Between publishes it keeps min/max/mean of the readings.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger("robot.telemetry")
+
+
+class Channel:
+    """Publishing rules for one cloud variable.
+
+    deadband:     smallest change from the last published value worth sending
+    min_interval: seconds between regular publishes
+    significant:  change that is published at once, ignoring min_interval
+    max_interval: publish at least this often even if nothing changed (0 = never)
+    publish:      'last' sends the newest reading, 'mean' the window mean
+    cast:         applied to the value before it is assigned to the cloud
+    """
+
+    def __init__(self, deadband, min_interval, significant=None, max_interval=300.0, publish="last", cast=float):
+        self.deadband = deadband
+        self.min_interval = min_interval
+        self.significant = significant
+        self.max_interval = max_interval
+        self.publish = publish
+        self.cast = cast
+
+
+DEFAULT_CHANNELS = {
+    "distance": Channel(deadband=2, min_interval=1.0, significant=25, cast=int),
+    "temperature": Channel(deadband=0.2, min_interval=30.0, significant=2.0, publish="mean"),
+    "humidity": Channel(deadband=1.0, min_interval=30.0, significant=5.0, publish="mean"),
+}
+
+
+class Window:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.total = 0.0
+        self.last = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.last = value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def snapshot(self):
+        if not self.count:
+            return {"count": 0}
+        return {"count": self.count, "min": self.min, "max": self.max,
+                "mean": round(self.mean, 3), "last": self.last}
+
+
+class TelemetryPublisher:
+    """Filters telemetry updates before they are assigned to `cloud.<name>`."""
+
+    def __init__(self, cloud, channels=None, log_every=600):
+        self.cloud = cloud
+        self.channels = dict(DEFAULT_CHANNELS if channels is None else channels)
+        self.log_every = log_every
+        self._lock = threading.Lock()
+        self._windows = {name: Window() for name in self.channels}
+        self._published = {}
+        self._published_at = {}
+        self.counters = {name: {"received": 0, "published": 0, "suppressed": 0, "significant": 0, "errors": 0}
+                         for name in self.channels}
+        self._received = 0
+
+    def update(self, name, value, now=None) -> bool:
+        """Record a reading; returns True if it was published to the cloud."""
+        now = time.time() if now is None else now
+        channel = self.channels.get(name)
+        if channel is None:
+            # Unknown variable: pass straight through
+            setattr(self.cloud, name, value)
+            return True
+        value = float(value)
+        with self._lock:
+            window = self._windows[name]
+            counters = self.counters[name]
+            window.add(value)
+            counters["received"] += 1
+            self._received += 1
+            report = self.log_every and self._received % self.log_every == 0
+
+            last = self._published.get(name)
+            if last is None:
+                reason = "first"
+            else:
+                candidate = window.mean if channel.publish == "mean" else value
+                change = abs(candidate - last)
+                elapsed = now - self._published_at[name]
+                if channel.significant is not None and abs(value - last) >= channel.significant:
+                    reason = "significant"
+                elif elapsed >= channel.min_interval and change >= channel.deadband:
+                    reason = "changed"
+                elif channel.max_interval and elapsed >= channel.max_interval:
+                    reason = "heartbeat"
+                else:
+                    reason = None
+
+            if reason is None:
+                counters["suppressed"] += 1
+                publish_value = None
+            else:
+                # A significant jump is sent as the new reading, not smeared into the mean
+                use_mean = channel.publish == "mean" and reason != "significant"
+                publish_value = window.mean if use_mean else value
+                self._published[name] = publish_value
+                self._published_at[name] = now
+                counters["published"] += 1
+                if reason == "significant":
+                    counters["significant"] += 1
+                window.reset()
+
+        if report:
+            logger.info(f"Telemetry stats: {self.stats()}")
+        if publish_value is None:
+            return False
+        try:
+            setattr(self.cloud, name, channel.cast(publish_value))
+        except Exception as e:
+            with self._lock:
+                counters["errors"] += 1
+            logger.warning(f"Could not publish {name} to cloud: {e}")
+            return False
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: dict(self.counters[name], published_value=self._published.get(name),
+                           window=self._windows[name].snapshot())
+                for name in self.channels
+            }
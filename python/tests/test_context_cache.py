@@ -0,0 +1,119 @@
+"""Gemini context caching in media_service against FakeGenaiClient."""
+
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import media_service  # noqa: E402
+from fakes import FakeGenaiClient  # noqa: E402
+
+MODEL = media_service.GEMINI_MODEL
+
+
+class ContextCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeGenaiClient()
+        patches = [
+            mock.patch.object(media_service, 'LLM_CLIENT', self.client),
+            mock.patch.object(media_service, 'GEMINI_CONTEXT_CACHE', True),
+            mock.patch.object(media_service, 'GEMINI_CACHE_RETRY_SEC', 0.05),
+            mock.patch.dict(media_service.CACHED_CONTEXTS, clear=True),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def creates(self):
+        return len(self.client.calls_to('caches.create'))
+
+    def test_created_once_and_reused(self):
+        first = media_service.get_cached_context('en', MODEL)
+        self.assertTrue(first)
+        self.assertEqual(media_service.get_cached_context('en', MODEL), first)
+        self.assertEqual(self.creates(), 1)
+
+    def test_one_cache_per_language_and_search_tool(self):
+        names = {
+            media_service.get_cached_context('en', MODEL),
+            media_service.get_cached_context('ru', MODEL),
+            media_service.get_cached_context('en', MODEL, search=False),
+        }
+        self.assertEqual(len(names), 3)
+        self.assertEqual(self.creates(), 3)
+
+    def test_requests_use_the_cache_instead_of_the_inline_instruction(self):
+        for _ in range(3):
+            media_service.send_to_gemini('state', b'', lang='en', tier='full')
+        self.assertEqual(self.creates(), 1)
+        configs = [call['config'] for call in self.client.calls_to('generate_content')]
+        self.assertEqual(len(configs), 3)
+        for config in configs:
+            self.assertEqual(config.cached_content, self.client.caches.created[0].name)
+            self.assertIsNone(config.system_instruction)
+
+    def test_refreshed_shortly_before_expiry(self):
+        first = media_service.get_cached_context('en', MODEL)
+        media_service.CACHED_CONTEXTS[(MODEL, 'en', True)]['expires'] = time.time() + 30
+        second = media_service.get_cached_context('en', MODEL)
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.creates(), 2)
+
+    def test_below_minimum_size_disables_caching_for_good(self):
+        self.client.min_cache_chars = 10 ** 9
+        self.assertIsNone(media_service.get_cached_context('en', MODEL))
+        time.sleep(0.1)
+        self.assertIsNone(media_service.get_cached_context('en', MODEL))
+        self.assertEqual(self.creates(), 1)
+        # Requests fall back to the inline system instruction
+        media_service.send_to_gemini('state', b'', lang='en', tier='full')
+        config = self.client.calls_to('generate_content')[-1]['config']
+        self.assertIsNone(config.cached_content)
+        self.assertTrue(config.system_instruction)
+
+    def test_transient_error_is_retried_after_a_growing_backoff(self):
+        self.client.cache_error = Exception('503 UNAVAILABLE')
+        self.assertIsNone(media_service.get_cached_context('en', MODEL))
+        # Within the backoff the create is not repeated
+        self.assertIsNone(media_service.get_cached_context('en', MODEL))
+        self.assertEqual(self.creates(), 1)
+
+        time.sleep(0.07)
+        self.assertIsNone(media_service.get_cached_context('en', MODEL))
+        self.assertEqual(self.creates(), 2)
+        # The second failure doubled the wait to 0.1 s
+        time.sleep(0.07)
+        self.assertIsNone(media_service.get_cached_context('en', MODEL))
+        self.assertEqual(self.creates(), 2)
+
+        self.client.cache_error = None
+        time.sleep(0.05)
+        self.assertTrue(media_service.get_cached_context('en', MODEL))
+        self.assertEqual(self.creates(), 3)
+
+    def test_slow_create_does_not_block_other_requests(self):
+        release = threading.Event()
+        self.client.cache_error = lambda: None if release.wait(5) else None
+        creator = threading.Thread(target=media_service.get_cached_context, args=('en', MODEL))
+        creator.start()
+        time.sleep(0.05)
+        try:
+            started = time.time()
+            # Same key while it is being created: inline instruction; another key is not held up
+            self.assertIsNone(media_service.get_cached_context('en', MODEL))
+            self.client.cache_error = None
+            self.assertTrue(media_service.get_cached_context('ru', MODEL))
+            self.assertLess(time.time() - started, 1.0)
+        finally:
+            release.set()
+            creator.join()
+        self.assertTrue(media_service.get_cached_context('en', MODEL))
+        self.assertEqual(self.creates(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+"""Gemini tier fallback, hedging and deadlines in media_service against FakeGenaiClient."""
+
+import collections
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import media_service  # noqa: E402
+from fakes import DEFAULT_REPLY, FakeGenaiClient  # noqa: E402
+
+BUDGETS = {settings['thinking_budget']: tier for tier, settings in media_service.GEMINI_TIERS.items()}
+
+
+def tier_of(config):
+    return BUDGETS[config.thinking_config.thinking_budget]
+
+
+def per_tier(**values):
+    """latency/error callable for FakeGenaiClient: the value given for the call's tier, else None."""
+    return lambda model, config: values.get(tier_of(config))
+
+
+class LlmTiersTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeGenaiClient()
+        self.stats = {'calls': collections.Counter(), 'wins': collections.Counter(), 'failures': collections.Counter(),
+                      'hedges': 0, 'hedges_skipped': 0, 'fallbacks': 0, 'deadline_missed': 0, 'wasted': 0,
+                      'in_flight': 0}
+        patches = [
+            mock.patch.object(media_service, 'LLM_CLIENT', self.client),
+            mock.patch.object(media_service, 'GEMINI_CONTEXT_CACHE', False),
+            mock.patch.object(media_service, 'LLM_TIER_STATS', self.stats),
+            mock.patch.object(media_service, 'LLM_HEDGE_AFTER', 0.5),
+            mock.patch.object(media_service, 'LLM_HEDGE_RETRY_SEC', 0.02),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        # Losing attempts keep running; let them finish before the patched stats go away
+        self.addCleanup(self.wait_for_attempts)
+
+    def wait_for_attempts(self, timeout=5.0):
+        deadline = time.time() + timeout
+        while self.stats['in_flight'] > 0 and time.time() < deadline:
+            time.sleep(0.01)
+
+    def ask(self, tier='full', deadline=0.4, stream=False, on_early=None):
+        request = {'text': 'state', 'image_bytes': b'', 'image_mime': 'image/jpeg', 'lang': 'en', 'audio_bytes': None}
+        payload = {'distance': 200, 'tier': tier, 'deadline_sec': deadline}
+        started = time.time()
+        if stream:
+            result = media_service.call_gemini_stream(request, payload, on_early=on_early)
+        else:
+            result = media_service.call_gemini(request, payload)
+        return result, time.time() - started
+
+    def calls_by_tier(self):
+        return [tier_of(call['config']) for call in self.client.calls]
+
+    def test_fast_reply_needs_one_call(self):
+        result, _ = self.ask()
+        self.assertEqual(result['move'], {'command': 'left', 'angle_deg': 30})
+        self.assertEqual(self.calls_by_tier(), ['full'])
+        self.assertEqual(self.stats['wins'], {'full': 1})
+        self.assertEqual((self.stats['hedges'], self.stats['deadline_missed'], self.stats['wasted']), (0, 0, 0))
+
+    def test_slow_tier_is_hedged_and_the_faster_one_wins(self):
+        self.client.latency = per_tier(full=1.0, fast=0.05)
+        result, elapsed = self.ask(deadline=0.4)
+        self.assertEqual(result['plan'], DEFAULT_REPLY['plan'])
+        # Hedge at 0.5 * 0.4 s, answered 0.05 s later, well before the slow tier
+        self.assertLess(elapsed, 0.4)
+        self.assertEqual(self.calls_by_tier(), ['full', 'fast'])
+        self.assertEqual(self.stats['hedges'], 1)
+        self.assertEqual(self.stats['wins'], {'fast': 1})
+        self.assertEqual(self.stats['wasted'], 1)
+        self.assertEqual(self.stats['deadline_missed'], 0)
+
+    def test_failed_tier_falls_back_at_once(self):
+        self.client.error = per_tier(full=Exception('500 INTERNAL'))
+        result, elapsed = self.ask(deadline=2.0)
+        self.assertTrue(result['move'])
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(self.calls_by_tier(), ['full', 'fast'])
+        self.assertEqual(self.stats['failures'], {'full': 1})
+        self.assertEqual(self.stats['fallbacks'], 1)
+        self.assertEqual(self.stats['wins'], {'fast': 1})
+
+    def test_malformed_reply_counts_as_a_failure(self):
+        self.client.reply = 'I would rather not answer in JSON'
+        with self.assertRaises(Exception):
+            self.ask(tier='fast', deadline=2.0)
+        self.assertEqual(self.calls_by_tier(), ['fast', 'minimal'])
+        self.assertEqual(self.stats['failures'], {'fast': 1, 'minimal': 1})
+
+    def test_all_tiers_failing_raises_the_last_error(self):
+        self.client.error = Exception('503 UNAVAILABLE')
+        with self.assertRaisesRegex(Exception, '503'):
+            self.ask()
+        self.assertEqual(self.calls_by_tier(), ['full', 'fast', 'minimal'])
+
+    def test_missed_deadline_is_counted(self):
+        self.client.latency = per_tier(minimal=0.3)
+        self.ask(tier='minimal', deadline=0.1)
+        self.assertEqual(self.stats['deadline_missed'], 1)
+        self.assertEqual(self.stats['hedges'], 0)
+
+    def test_no_hedge_without_a_free_worker(self):
+        self.client.latency = per_tier(full=0.4, fast=0.01)
+        self.stats['in_flight'] = media_service.LLM_WORKERS - 1
+        try:
+            self.ask(deadline=0.2)
+        finally:
+            self.stats['in_flight'] -= media_service.LLM_WORKERS - 1
+        self.assertEqual(self.calls_by_tier(), ['full'])
+        self.assertEqual(self.stats['hedges_skipped'], 1)
+        self.assertEqual(self.stats['hedges'], 0)
+
+    def test_stream_deadline_is_met_by_the_early_fields(self):
+        # The first chunk holds the early fields (after 0.05 s), the slow fields follow 0.5 s later
+        self.client.latency = per_tier(full=0.05)
+        self.client.stream_chunk_chars = 120
+        self.client.chunk_delay = 0.5
+        early = []
+        result, elapsed = self.ask(deadline=0.3, stream=True, on_early=early.append)
+        self.assertGreater(elapsed, 0.3)
+        self.assertEqual(len(early), 1)
+        self.assertEqual(early[0]['move'], result['move'])
+        self.assertEqual(self.calls_by_tier(), ['full'])
+        self.assertEqual((self.stats['hedges'], self.stats['deadline_missed'], self.stats['wasted']), (0, 0, 0))
+
+    def test_stream_fallback_keeps_the_early_fields_already_sent(self):
+        sent = []
+
+        def attempt(tier, race):
+            fields = {'move': {'command': 'left', 'angle_deg': 30}, 'rgb': '0,0,255'} if tier == 'full' else \
+                {'move': {'command': 'forward', 'distance_cm': 50}, 'rgb': '255,0,0'}
+            if race.claim_early(tier, fields):
+                sent.append(fields)
+            if tier == 'full':
+                raise Exception('stream broke after the early fields')
+            return dict(fields, plan=f'plan from {tier}', speak=None, sound=None)
+
+        race = media_service.TierRace()
+        result = race.reconcile(media_service.run_with_deadline(attempt, 'full', 1.0, race=race))
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(result['move'], {'command': 'left', 'angle_deg': 30})
+        self.assertEqual(result['rgb'], '0,0,255')
+        self.assertEqual(result['plan'], 'plan from fast')
+
+
+if __name__ == '__main__':
+    unittest.main()
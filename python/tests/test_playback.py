@@ -0,0 +1,48 @@
+"""AudioPlayer handling of streamed speech chunks that are still being synthesized."""
+
+import concurrent.futures
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import media_service  # noqa: E402
+
+
+class AudioPlayerSourceTest(unittest.TestCase):
+    def setUp(self):
+        self.player = media_service.AudioPlayer(media_service.NullSink(), source_timeout=0.1)
+
+    def test_synthesized_chunk_is_played(self):
+        source = concurrent.futures.Future()
+        job = self.player.enqueue(source, priority=media_service.PRIORITY_SPEECH)
+        source.set_result('chunk.wav')
+        self.assertTrue(job.wait(1.0))
+        self.assertEqual(job.state, 'played')
+        self.assertEqual(job.filename, 'chunk.wav')
+
+    def test_chunk_that_never_arrives_times_out_as_failed(self):
+        stuck = concurrent.futures.Future()
+        started = time.time()
+        stuck_job, next_job = self.player.enqueue_group([stuck, 'next.wav'], priority=media_service.PRIORITY_SPEECH)
+        self.assertTrue(next_job.wait(1.0))
+        self.assertLess(time.time() - started, 1.0)
+        self.assertEqual(stuck_job.state, 'failed')
+        self.assertEqual(stuck_job.error, 'synthesis timed out')
+        self.assertEqual(next_job.state, 'played')
+        self.assertEqual(self.player.counters['failed'], 1)
+        self.assertTrue(stuck.cancelled())
+
+    def test_failed_synthesis_is_counted(self):
+        source = concurrent.futures.Future()
+        source.set_exception(Exception('TTS quota exceeded'))
+        job = self.player.enqueue(source, priority=media_service.PRIORITY_SPEECH)
+        self.assertTrue(job.wait(1.0))
+        self.assertEqual(job.state, 'failed')
+        self.assertEqual(self.player.counters['failed'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""TelemetryPublisher deadband and rate limiting against FakeCloud."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FakeCloud  # noqa: E402
+from telemetry import Channel, TelemetryPublisher  # noqa: E402
+
+
+class TelemetryPublisherTest(unittest.TestCase):
+    def setUp(self):
+        self.cloud = FakeCloud()
+        self.telemetry = TelemetryPublisher(self.cloud, log_every=0)
+
+    def feed(self, name, values, start=0.0, step=0.1):
+        """Readings at 10 Hz like the MCU loop; returns how many were published."""
+        return sum(self.telemetry.update(name, value, now=start + i * step) for i, value in enumerate(values))
+
+    def test_first_reading_is_published(self):
+        self.assertTrue(self.telemetry.update("distance", 120, now=0.0))
+        self.assertEqual(self.cloud.writes_to("distance"), [120])
+
+    def test_deadband_suppresses_small_changes(self):
+        # 30 s of jitter within +-1 cm of 100 cm: only the first reading goes out
+        jitter = [(100, 101, 100, 99)[i % 4] for i in range(300)]
+        self.assertEqual(self.feed("distance", jitter), 1)
+        stats = self.telemetry.stats()["distance"]
+        self.assertEqual(stats["published"], 1)
+        self.assertEqual(stats["suppressed"], 299)
+
+    def test_change_beyond_deadband_waits_for_min_interval(self):
+        self.telemetry.update("distance", 100, now=0.0)
+        self.assertFalse(self.telemetry.update("distance", 105, now=0.5))
+        self.assertTrue(self.telemetry.update("distance", 105, now=1.0))
+        self.assertEqual(self.cloud.writes_to("distance"), [100, 105])
+
+    def test_rate_limit_bounds_publishes_of_a_changing_value(self):
+        # Approaching a wall at 10 cm/s for 10 s: past the deadband every tick, min_interval is 1 s
+        ramp = [200 - i for i in range(100)]
+        published = self.feed("distance", ramp)
+        self.assertLessEqual(published, 11)
+        self.assertGreaterEqual(published, 9)
+
+    def test_significant_change_skips_the_rate_limit(self):
+        self.telemetry.update("distance", 200, now=0.0)
+        self.assertTrue(self.telemetry.update("distance", 30, now=0.1))
+        self.assertEqual(self.cloud.writes_to("distance"), [200, 30])
+        self.assertEqual(self.telemetry.stats()["distance"]["significant"], 1)
+
+    def test_mean_channels_publish_the_window_mean(self):
+        self.telemetry.update("temperature", 21.0, now=0.0)
+        readings = [21.4, 21.6, 21.5, 21.7, 21.3, 21.5]
+        # Every 5 s; min_interval is 30 s, so the sixth reading publishes the mean of all six
+        published = [self.telemetry.update("temperature", value, now=5.0 * (i + 1)) for i, value in enumerate(readings)]
+        self.assertEqual(published, [False] * 5 + [True])
+        self.assertAlmostEqual(self.cloud.writes_to("temperature")[-1], sum(readings) / len(readings))
+
+    def test_heartbeat_republishes_an_unchanged_value(self):
+        telemetry = TelemetryPublisher(self.cloud, channels={"distance": Channel(deadband=2, min_interval=1.0, max_interval=5.0, cast=int)},
+                                       log_every=0)
+        for i in range(61):
+            telemetry.update("distance", 100, now=i * 0.1)
+        self.assertEqual(self.cloud.writes_to("distance"), [100, 100])
+
+    def test_cast_is_applied(self):
+        self.telemetry.update("distance", 99.7, now=0.0)
+        self.assertEqual(self.cloud.writes_to("distance"), [99])
+        self.assertIsInstance(self.cloud.distance, int)
+
+    def test_unknown_variable_passes_through(self):
+        self.assertTrue(self.telemetry.update("rgb", "1,2,3"))
+        self.assertEqual(self.cloud.rgb, "1,2,3")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Runs the VAD over the synthetic WAVs in vad_testset/ (see vad_testset/make_testset.py)."""
+
+import contextlib
+import glob
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vad  # noqa: E402
+
+TESTSET = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vad_testset')
+
+
+def clips(label):
+    return sorted(glob.glob(os.path.join(TESTSET, label, '*.wav')))
+
+
+class VadTestSetTest(unittest.TestCase):
+    def test_testset_is_present(self):
+        self.assertGreaterEqual(len(clips('speech')), 3)
+        self.assertGreaterEqual(len(clips('silence')), 4)
+
+    def test_speech_clips_are_detected_and_ended(self):
+        for path in clips('speech'):
+            with self.subTest(clip=os.path.basename(path)):
+                result = vad.analyze_file(path)
+                self.assertTrue(result['speech'])
+                # Every clip has more than the 800 ms hangover of silence after the last burst
+                self.assertEqual(result['state'], 'ended')
+                self.assertLess(result['listened_sec'], result['total_sec'])
+
+    def test_silence_clips_give_up(self):
+        for path in clips('silence'):
+            with self.subTest(clip=os.path.basename(path)):
+                result = vad.analyze_file(path)
+                self.assertFalse(result['speech'])
+                self.assertEqual(result['state'], 'no_speech')
+                self.assertEqual((result['start_sec'], result['end_sec']), (0.0, 0.0))
+
+    def test_trim_keeps_the_bursts(self):
+        # syllables_over_noise: five 0.25 s bursts every 0.37 s starting at 0.8 s
+        result = vad.analyze_file(os.path.join(TESTSET, 'speech', 'syllables_over_noise.wav'))
+        self.assertLessEqual(result['start_sec'], 0.8)
+        self.assertGreaterEqual(result['end_sec'], 0.8 + 4 * 0.37 + 0.25)
+        self.assertLess(result['end_sec'], 3.0)
+
+    def test_verdict_does_not_depend_on_chunk_size(self):
+        for path in clips('speech') + clips('silence'):
+            with self.subTest(clip=os.path.basename(path)):
+                verdicts = {chunk_ms: vad.analyze_file(path, chunk_ms=chunk_ms)['speech'] for chunk_ms in (10, 37, 100, 500)}
+                self.assertEqual(len(set(verdicts.values())), 1, verdicts)
+
+    def test_cli_reports_full_accuracy(self):
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(vad.main([TESTSET]), 0)
+        self.assertIn('Accuracy: ', out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
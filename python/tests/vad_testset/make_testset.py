@@ -0,0 +1,78 @@
+"""Regenerates the synthetic WAVs of this VAD test set (8 kHz, 16-bit mono, 3.5 s).
+
+speech/ holds voiced syllable bursts (a 140 or 220 Hz harmonic series) over
+different noise floors, silence/ holds noise, hum and a click with no speech.
+Real recordings can be dropped into the same subdirectories and checked with:
+
+    python3 vad.py tests/vad_testset/
+"""
+
+import os
+import wave
+
+import numpy as np
+
+RATE = 8000
+SECONDS = 3.5
+
+rng = np.random.default_rng(7)
+t = np.arange(int(RATE * SECONDS)) / RATE
+
+
+def dbfs(level):
+    return 10 ** (level / 20) * 32767
+
+
+def noise(level):
+    return rng.normal(0, 1, len(t)) * dbfs(level)
+
+
+def dither():
+    return rng.integers(-2, 3, len(t))
+
+
+def voiced(f0=140):
+    """Harmonic series at roughly the RMS of a full-scale sine, like a sustained vowel."""
+    v = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 8))
+    return v / np.sqrt(np.mean(v * v)) / np.sqrt(2)
+
+
+def syllables(start, count, on=0.25, off=0.12):
+    """Envelope of `count` bursts of `on` seconds with 30 ms ramps."""
+    env = np.zeros(len(t))
+    ramp = int(0.03 * RATE)
+    for i in range(count):
+        a = int((start + i * (on + off)) * RATE)
+        b = a + int(on * RATE)
+        seg = np.ones(b - a)
+        seg[:ramp] = np.linspace(0, 1, ramp)
+        seg[-ramp:] = np.linspace(1, 0, ramp)
+        env[a:b] = seg
+    return env
+
+
+def save(path, x):
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(RATE)
+        wf.writeframes(np.clip(x, -32768, 32767).astype('<i2').tobytes())
+
+
+CLIPS = {
+    'silence/digital_silence.wav': lambda: dither(),
+    'silence/room_noise.wav': lambda: noise(-42),
+    'silence/hum_and_hiss.wav': lambda: noise(-45) + np.sin(2 * np.pi * 50 * t) * dbfs(-38),
+    'silence/click.wav': lambda: noise(-45) + ((t > 1.0) & (t < 1.02)) * dbfs(-10),
+    'speech/tone_bursts.wav': lambda: syllables(0.6, 5) * voiced() * dbfs(-12) + dither(),
+    'speech/syllables_over_noise.wav': lambda: noise(-40) + syllables(0.8, 5) * voiced() * dbfs(-14),
+    'speech/quiet_speaker.wav': lambda: noise(-50) + syllables(0.5, 4, on=0.3) * voiced(220) * dbfs(-26),
+}
+
+
+if __name__ == '__main__':
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name, make in CLIPS.items():
+        os.makedirs(os.path.join(here, os.path.dirname(name)), exist_ok=True)
+        save(os.path.join(here, name), make())
+        print(name)
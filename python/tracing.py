@@ -0,0 +1,162 @@
+"""Lightweight span timing for the AGI cycle.
+
+A span times one stage of a cycle (frame fetch, Gemini call, TTS, mic capture,
+...). Every span goes into a per-stage histogram. Spans that carry a cycle ID
+are also summed into a per-cycle breakdown, and the last N cycles are kept.
+main.py creates a cycle ID per agi_loop call and sends it along with its
+requests, so media_service can attribute its own spans to the same cycle.
+main.py posts its spans to media_service, which serves everything as
+Prometheus text on /metrics.
+"""
+
+import bisect
+import collections
+import contextlib
+import itertools
+import threading
+import time
+
+# Upper bounds in seconds of the span histogram buckets
+SPAN_BUCKETS_SEC = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, buckets=SPAN_BUCKETS_SEC):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Tracer:
+    """Collects spans of one process (`source`, e.g. "robot" or "media") and spans posted by others."""
+
+    def __init__(self, source, keep_cycles=20, buckets=SPAN_BUCKETS_SEC, enabled=True):
+        self.source = source
+        self.keep_cycles = keep_cycles
+        self.buckets = buckets
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._histograms = {}
+        self._cycles = collections.OrderedDict()
+        self._ids = itertools.count(1)
+        self._prefix = f"{int(time.time()) % 100000:05d}"
+
+    # --- cycle IDs -------------------------------------------------------------
+
+    def new_cycle_id(self):
+        return f"{self.source[0]}{self._prefix}-{next(self._ids)}"
+
+    def current_cycle(self):
+        return getattr(self._local, "cycle_id", None)
+
+    @contextlib.contextmanager
+    def cycle(self, cycle_id):
+        """Spans opened in this thread without an explicit cycle ID belong to `cycle_id`."""
+        previous = self.current_cycle()
+        self._local.cycle_id = cycle_id
+        try:
+            yield cycle_id
+        finally:
+            self._local.cycle_id = previous
+
+    # --- spans -----------------------------------------------------------------
+
+    @contextlib.contextmanager
+    def span(self, name, cycle_id=None):
+        if not self.enabled:
+            yield
+            return
+        cycle_id = cycle_id or self.current_cycle()
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.record(name, time.perf_counter() - started, cycle_id, error=True)
+            raise
+        self.record(name, time.perf_counter() - started, cycle_id)
+
+    def record(self, name, seconds, cycle_id=None, source=None, error=False):
+        if not self.enabled:
+            return
+        source = source or self.source
+        with self._lock:
+            hist = self._histograms.get((source, name))
+            if hist is None:
+                hist = self._histograms[(source, name)] = Histogram(self.buckets)
+            hist.observe(seconds)
+            if error:
+                hist.errors += 1
+            if cycle_id:
+                cycle = self._cycles.get(cycle_id)
+                if cycle is None:
+                    cycle = self._cycles[cycle_id] = {"cycle_id": cycle_id, "started": time.time(), "spans": {}}
+                    while len(self._cycles) > self.keep_cycles:
+                        self._cycles.popitem(last=False)
+                key = f"{source}.{name}"
+                cycle["spans"][key] = round(cycle["spans"].get(key, 0.0) + seconds, 4)
+
+    def cycle_spans(self, cycle_id):
+        """{"source.name": seconds} recorded so far for one cycle."""
+        with self._lock:
+            cycle = self._cycles.get(cycle_id)
+            return dict(cycle["spans"]) if cycle else {}
+
+    # --- output ------------------------------------------------------------------
+
+    def recent_cycles(self, n=None):
+        """Breakdown of the last n cycles, newest first."""
+        with self._lock:
+            cycles = [dict(c, spans=dict(c["spans"])) for c in reversed(self._cycles.values())]
+        return cycles[:n] if n else cycles
+
+    def summary(self):
+        with self._lock:
+            return {
+                f"{source}.{name}": {
+                    "count": hist.count,
+                    "mean_sec": round(hist.total / hist.count, 4) if hist.count else None,
+                    "errors": hist.errors,
+                }
+                for (source, name), hist in sorted(self._histograms.items())
+            }
+
+    def prometheus(self, prefix="agi"):
+        """All histograms in the Prometheus text exposition format."""
+        lines = [
+            f"# HELP {prefix}_span_seconds Duration of one stage of the AGI cycle.",
+            f"# TYPE {prefix}_span_seconds histogram",
+        ]
+        errors = []
+        with self._lock:
+            for (source, name), hist in sorted(self._histograms.items()):
+                labels = f'source="{_label(source)}",span="{_label(name)}"'
+                cumulative = 0
+                for bound, n in zip(self.buckets, hist.counts):
+                    cumulative += n
+                    lines.append(f'{prefix}_span_seconds_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+                lines.append(f'{prefix}_span_seconds_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f"{prefix}_span_seconds_sum{{{labels}}} {hist.total:.6f}")
+                lines.append(f"{prefix}_span_seconds_count{{{labels}}} {hist.count}")
+                errors.append(f"{prefix}_span_errors_total{{{labels}}} {hist.errors}")
+            tracked = len(self._cycles)
+        lines += [
+            f"# HELP {prefix}_span_errors_total Spans that ended with an exception.",
+            f"# TYPE {prefix}_span_errors_total counter",
+        ] + errors + [
+            f"# HELP {prefix}_trace_cycles Cycles held in the recent-cycles breakdown.",
+            f"# TYPE {prefix}_trace_cycles gauge",
+            f"{prefix}_trace_cycles {tracked}",
+        ]
+        return "\n".join(lines) + "\n"
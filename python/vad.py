@@ -0,0 +1,196 @@
+"""Energy / zero-crossing voice activity detection for microphone recordings.
+
+Used by main.py to end a recording as soon as the user stops talking, to give up
+early when nobody answers, and to trim leading and trailing silence.
+
+Run it on WAV files to check the thresholds against real recordings:
+
+    python3 vad.py recordings/            # every .wav in the directory
+    python3 vad.py tests/vad_testset/     # with speech/ and silence/ subdirectories,
+                                          # also prints detection accuracy
+"""
+
+import glob
+import os
+import sys
+import wave
+
+import numpy as np
+
+
+def _env(name, default):
+    return float(os.environ.get(name, default))
+
+
+class VoiceActivityDetector:
+    """Streaming endpoint detector over int16 PCM chunks.
+
+    Each chunk is cut into fixed frames; frame energy (dBFS) and zero-crossing
+    rate are computed for all frames at once. A frame counts as speech when it
+    is louder than the noise floor by `margin_db` (and above `min_energy_db`)
+    and its zero-crossing rate is below `max_zcr`, unless it is very loud.
+    Speech starts after `start_ms` of consecutive speech frames and ends after
+    `hangover_ms` of non-speech. If speech has not started `no_speech_sec` after
+    the first sample, the detector gives up.
+
+    `state` is one of 'waiting', 'speech', 'ended' or 'no_speech'.
+    """
+
+    def __init__(self, rate=16000, frame_ms=20,
+                 min_energy_db=None, margin_db=None, max_zcr=None,
+                 start_ms=None, hangover_ms=None, no_speech_sec=None,
+                 pad_ms=None, noise_frames=10):
+        self.rate = rate
+        self.frame_len = max(1, int(rate * frame_ms / 1000))
+        self.frame_ms = frame_ms
+        self.min_energy_db = min_energy_db if min_energy_db is not None else _env('VAD_MIN_ENERGY_DB', '-45')
+        self.margin_db = margin_db if margin_db is not None else _env('VAD_MARGIN_DB', '12')
+        self.max_zcr = max_zcr if max_zcr is not None else _env('VAD_MAX_ZCR', '0.35')
+        self.start_frames = max(1, int((start_ms if start_ms is not None else _env('VAD_START_MS', '80')) / frame_ms))
+        self.hangover_frames = max(1, int((hangover_ms if hangover_ms is not None else _env('VAD_HANGOVER_MS', '800')) / frame_ms))
+        self.no_speech_frames = int((no_speech_sec if no_speech_sec is not None else _env('VAD_NO_SPEECH_SEC', '2.5')) * 1000 / frame_ms)
+        self.pad_frames = int((pad_ms if pad_ms is not None else _env('VAD_PAD_MS', '200')) / frame_ms)
+        self.noise_frames = noise_frames
+        self.reset()
+
+    def reset(self):
+        self.state = 'waiting'
+        self.frames_seen = 0
+        self.noise_floor_db = None
+        self.speech_start_frame = None
+        self.last_speech_frame = None
+        self._run = 0
+        self._silence = 0
+        self._noise = []
+        self._remainder = np.zeros(0, dtype=np.int16)
+
+    @property
+    def speech_detected(self):
+        return self.speech_start_frame is not None
+
+    def frame_features(self, samples):
+        """Per-frame (energy dBFS, zero-crossing rate) for whole frames of samples."""
+        n = len(samples) // self.frame_len
+        frames = samples[:n * self.frame_len].reshape(n, self.frame_len).astype(np.float32) / 32768.0
+        energy_db = 10.0 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / float(self.frame_len - 1)
+        return energy_db, zcr
+
+    def process(self, chunk):
+        """Feed a chunk of int16 samples; returns the updated state."""
+        samples = np.asarray(chunk).reshape(-1)
+        if samples.dtype != np.int16:
+            samples = samples.astype(np.int16)
+        if len(self._remainder):
+            samples = np.concatenate((self._remainder, samples))
+        whole = (len(samples) // self.frame_len) * self.frame_len
+        self._remainder = samples[whole:].copy()
+        if not whole or self.state in ('ended', 'no_speech'):
+            return self.state
+
+        energy_db, zcr = self.frame_features(samples[:whole])
+        if self.noise_floor_db is None:
+            self._noise.extend(energy_db[:self.noise_frames - len(self._noise)].tolist())
+            if len(self._noise) >= self.noise_frames:
+                self.noise_floor_db = float(np.percentile(self._noise, 20))
+        floor = self.noise_floor_db if self.noise_floor_db is not None else (min(self._noise) if self._noise else -90.0)
+        threshold = max(self.min_energy_db, floor + self.margin_db)
+        voiced = (energy_db > threshold) & ((zcr < self.max_zcr) | (energy_db > threshold + 10.0))
+
+        for is_speech in voiced:
+            index = self.frames_seen
+            self.frames_seen += 1
+            if self.state == 'waiting':
+                self._run = self._run + 1 if is_speech else 0
+                if self._run >= self.start_frames:
+                    self.state = 'speech'
+                    self.speech_start_frame = index - self._run + 1
+                    self.last_speech_frame = index
+                elif self.frames_seen >= self.no_speech_frames:
+                    self.state = 'no_speech'
+                    break
+            elif self.state == 'speech':
+                if is_speech:
+                    self.last_speech_frame = index
+                    self._silence = 0
+                else:
+                    self._silence += 1
+                    if self._silence >= self.hangover_frames:
+                        self.state = 'ended'
+                        break
+        return self.state
+
+    def trim_bounds(self, total_samples):
+        """(start, end) sample range of the detected speech plus padding, clipped to total_samples."""
+        if not self.speech_detected:
+            return 0, 0
+        start = max(0, (self.speech_start_frame - self.pad_frames) * self.frame_len)
+        end = min(total_samples, (self.last_speech_frame + 1 + self.pad_frames) * self.frame_len)
+        return start, end
+
+
+def read_wav(path):
+    with wave.open(path, 'rb') as wf:
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"{path}: only 16-bit PCM is supported")
+        samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+        channels = wf.getnchannels()
+        if channels > 1:
+            samples = samples[::channels]
+        return samples, wf.getframerate()
+
+
+def analyze_file(path, chunk_ms=100):
+    samples, rate = read_wav(path)
+    vad = VoiceActivityDetector(rate=rate)
+    step = int(rate * chunk_ms / 1000)
+    consumed = 0
+    for offset in range(0, len(samples), step):
+        consumed = min(len(samples), offset + step)
+        if vad.process(samples[offset:offset + step]) in ('ended', 'no_speech'):
+            break
+    start, end = vad.trim_bounds(consumed)
+    return {
+        'file': path,
+        'speech': vad.speech_detected,
+        'state': vad.state,
+        'noise_floor_db': round(vad.noise_floor_db, 1) if vad.noise_floor_db is not None else None,
+        'start_sec': round(start / rate, 2),
+        'end_sec': round(end / rate, 2),
+        'listened_sec': round(consumed / rate, 2),
+        'total_sec': round(len(samples) / rate, 2),
+    }
+
+
+def main(paths):
+    files = []
+    expected = {}
+    for path in paths:
+        if os.path.isdir(path):
+            for label, want in (('speech', True), ('silence', False)):
+                for f in sorted(glob.glob(os.path.join(path, label, '*.wav'))):
+                    files.append(f)
+                    expected[f] = want
+            files.extend(sorted(glob.glob(os.path.join(path, '*.wav'))))
+        else:
+            files.append(path)
+    correct = 0
+    for f in files:
+        result = analyze_file(f)
+        mark = ''
+        if f in expected:
+            ok = result['speech'] == expected[f]
+            correct += ok
+            mark = 'OK  ' if ok else 'FAIL'
+        print(f"{mark} {result['file']}: speech={result['speech']} state={result['state']} "
+              f"kept {result['start_sec']}-{result['end_sec']}s, listened {result['listened_sec']}/{result['total_sec']}s, "
+              f"noise floor {result['noise_floor_db']} dB")
+    if expected:
+        print(f"Accuracy: {correct}/{len(expected)}")
+        return 0 if correct == len(expected) else 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:] or ['.']))
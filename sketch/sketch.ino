@@ -37,6 +37,38 @@ const int bluePin = 6;
 
 String rgb_str = "255,0,255"; //activate before python
 
+long state_version = -1; // last state version received from python, -1 = none yet
+
+// Parse "version|speed|back|left|right|forward|agi|r,g,b" from get_state
+void apply_state(String state)
+{
+    int start = 0;
+    String fields[8];
+    for (int i = 0; i < 8; i++)
+    {
+        int sep = state.indexOf('|', start);
+        if (sep == -1)
+        {
+            if (i != 7)
+                return; // malformed, keep the previous state
+            fields[i] = state.substring(start);
+        }
+        else
+        {
+            fields[i] = state.substring(start, sep);
+            start = sep + 1;
+        }
+    }
+    state_version = fields[0].toInt();
+    speed = fields[1].toInt();
+    back = fields[2] == "1";
+    left = fields[3] == "1";
+    right = fields[4] == "1";
+    forward = fields[5] == "1";
+    agi = fields[6] == "1";
+    rgb_str = fields[7];
+}
+
 void setup()
 {
     Bridge.begin();
@@ -73,13 +105,11 @@ void setup()
 
 void loop()
 {
-    Bridge.call("get_speed").result(speed);
-    Bridge.call("get_back").result(back);
-    Bridge.call("get_left").result(left);
-    Bridge.call("get_right").result(right);
-    Bridge.call("get_forward").result(forward);
-    Bridge.call("get_agi").result(agi);
-    Bridge.call("get_rgb").result(rgb_str);
+    // One round trip for all control fields; empty reply = nothing changed
+    String state;
+    Bridge.call("get_state", state_version).result(state);
+    if (state.length() > 0)
+        apply_state(state);
 
     int r = 0, g = 0, b = 0;
     int firstComma = rgb_str.indexOf(',');
@@ -96,13 +126,9 @@ void loop()
     analogWrite(greenPin, g/2);
 
     distance = sonar.ping_cm();
-    Bridge.call("set_distance", distance);
-
     float temperature = thermo.getTemperature();
-    Bridge.call("set_temperature", temperature);
-
     float humidity = thermo.getHumidity();
-    Bridge.call("set_humidity", humidity);
+    Bridge.call("set_telemetry", distance, temperature, humidity);
 
     if (left)
     {